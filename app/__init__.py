@@ -14,6 +14,9 @@ from .routes.certificates import certificates_bp
 from app.routes.reference_lists import reference_lists_bp
 from app.routes.status import status_bp
 from app.routes.system_time import system_time_bp
+from app.routes.fleet import fleet_bp
+from app.routes.metrics import metrics_bp
+from app.fleet import FleetMiddleware
 import app.config as config
 
 # Global variable to store the start time of the system
@@ -54,6 +57,11 @@ def create_app():
     app.register_blueprint(reference_lists_bp, url_prefix='/manage')
     app.register_blueprint(status_bp)
     app.register_blueprint(system_time_bp)
+    app.register_blueprint(fleet_bp)
+    app.register_blueprint(metrics_bp)
+
+    # Requests under /readers/<name> or on a fleet reader's port address that reader
+    app.wsgi_app = FleetMiddleware(app.wsgi_app)
    
 
     return app
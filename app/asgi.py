@@ -0,0 +1,257 @@
+import asyncio
+import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+from hypercorn.app_wrappers import WSGIWrapper
+from app.buffer import EventBuffer, BLOCK, DISCONNECT, DROP_OLDEST, OVERFLOW_POLICIES
+from app.events import dumps
+from app.fleet import resolve
+from app.metrics import events_delivered, events_dropped
+from app.reader import default_reader
+from app.routes.stream import DEFAULT_STREAM_BUFFER_SIZE, MAX_CHUNK_EVENTS, format_events, query_fields
+
+STREAM_PATH = "/api/v1/data/stream"
+BRIDGE_BUFFER_SIZE = 10000
+WSGI_MAX_BODY_SIZE = 16 * 1024 * 1024
+
+delivered = events_delivered.labels("sse")
+dropped_metric = events_dropped.labels("sse")
+
+
+class AsyncSubscriber:
+    """
+    Per-connection queue of encoded chunks. Chunks are shared between all
+    connections with the same `fields` projection, so a subscriber costs a
+    deque of references, bounded to `size` events.
+    """
+
+    def __init__(self, size, policy, fields=None):
+        self.size = size
+        self.policy = policy
+        self.fields = fields
+        self.chunks = deque()
+        self.queued = 0
+        self.dropped = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.room = asyncio.Event()
+        self.room.set()
+
+    def full(self):
+        return self.queued >= self.size
+
+    def push(self, chunk, count):
+        if self.policy == DISCONNECT and self.queued + count > self.size:
+            dropped_metric.inc(count)
+            self.close()
+            return
+        self.chunks.append((chunk, count))
+        self.queued += count
+        if self.policy == DROP_OLDEST:
+            while self.queued > self.size and len(self.chunks) > 1:
+                _, dropped = self.chunks.popleft()
+                self.queued -= dropped
+                self.dropped += dropped
+                dropped_metric.inc(dropped)
+        elif self.full():
+            self.room.clear()
+        self.ready.set()
+
+    async def get(self, timeout):
+        if not self.chunks and not self.closed:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        chunks = [chunk for chunk, _ in self.chunks]
+        self.chunks.clear()
+        self.queued = 0
+        self.ready.clear()
+        self.room.set()
+        return chunks
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+        self.room.set()
+
+
+class StreamBridge:
+    """
+    Single event bus subscription per reader and event loop. Batches are
+    pulled on the bridge's own executor thread, so a waiting pump never
+    holds a thread of the loop's default executor that the Flask routes
+    run on, then encoded once per projection and handed to every async
+    subscriber.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.subscribers = set()
+        self.buffer = EventBuffer(BRIDGE_BUFFER_SIZE)
+        self.task = None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="stream-bridge")
+
+    def subscribe(self, size, policy, fields=None):
+        subscriber = AsyncSubscriber(size, policy, fields)
+        self.subscribers.add(subscriber)
+        if self.task is None or self.task.done():
+            self.bus.subscribe(self.buffer)
+            self.task = asyncio.get_running_loop().create_task(self.pump())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def pump(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.subscribers:
+                # Producer-side backpressure for subscribers that asked to block
+                self.buffer.policy = BLOCK if any(s.policy == BLOCK for s in self.subscribers) else DROP_OLDEST
+                for subscriber in list(self.subscribers):
+                    if subscriber.policy == BLOCK and not subscriber.closed:
+                        await subscriber.room.wait()
+                events = await loop.run_in_executor(self.executor, self.buffer.take, MAX_CHUNK_EVENTS, 0.25)
+                if not events:
+                    continue
+                chunks = {}
+                subscribers = list(self.subscribers)
+                for subscriber in subscribers:
+                    chunk = chunks.get(subscriber.fields)
+                    if chunk is None:
+                        chunk = chunks[subscriber.fields] = format_events(events, subscriber.fields)
+                    subscriber.push(chunk, len(events))
+                delivered.inc(len(events) * len(subscribers))
+        finally:
+            self.bus.unsubscribe(self.buffer)
+            self.buffer.take(BRIDGE_BUFFER_SIZE, 0)
+
+    def stats(self):
+        return {"subscribers": len(self.subscribers)}
+
+
+def basic_auth_ok(scope, credentials):
+    expected = base64.b64encode(f"{credentials[0]}:{credentials[1]}".encode('utf-8'))
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            return value == b"Basic " + expected
+    return False
+
+
+async def send_simple(send, status, body, headers=()):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json")] + list(headers)})
+    await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+class EmulatorASGI:
+    """
+    ASGI front end: the event stream is served natively on the event loop,
+    so thousands of clients do not each pin a thread, while every other
+    route (and the Swagger spec) is delegated to the Flask app.
+    """
+
+    def __init__(self, flask_app, credentials=None):
+        self.wsgi = WSGIWrapper(flask_app, WSGI_MAX_BODY_SIZE)
+        self.credentials = credentials
+        self.bridge = StreamBridge(default_reader.bus)
+        self.bridges = {}
+
+    def bridge_for(self, reader):
+        if reader is default_reader:
+            return self.bridge
+        bridge = self.bridges.get(reader.name)
+        if bridge is None:
+            bridge = self.bridges[reader.name] = StreamBridge(reader.bus)
+        return bridge
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        reader, path, _ = resolve(scope.get("path", ""), (scope.get("server") or (None, None))[1])
+        if reader is not None and scope["type"] == "http" and path == STREAM_PATH and scope["method"] == "GET":
+            await self.stream(reader, scope, receive, send)
+        else:
+            # Everything else, fleet readers included, is resolved again by the Flask app's middleware
+            loop = asyncio.get_running_loop()
+
+            def call_soon(func, *args):
+                return asyncio.run_coroutine_threadsafe(func(*args), loop).result()
+
+            await self.wsgi(scope, receive, send, partial(loop.run_in_executor, None), call_soon)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def stream(self, reader, scope, receive, send):
+        if self.credentials and not basic_auth_ok(scope, self.credentials):
+            await send_simple(send, 401, b'{"message": "Could not verify your access level for that URL."}',
+                              [(b"www-authenticate", b'Basic realm="Login Required"')])
+            return
+        query = parse_qs(scope.get("query_string", b"").decode('ascii'))
+        policy = query.get("overflow", [DROP_OLDEST])[0]
+        try:
+            buffer_size = int(query.get("bufferSize", [DEFAULT_STREAM_BUFFER_SIZE])[0])
+        except ValueError:
+            buffer_size = DEFAULT_STREAM_BUFFER_SIZE
+        if buffer_size < 1 or policy not in OVERFLOW_POLICIES:
+            message = f"bufferSize must be positive and overflow one of {', '.join(OVERFLOW_POLICIES)}"
+            await send_simple(send, 400, dumps({"message": message}))
+            return
+        try:
+            fields = query_fields(query.get("reportFields", [None])[0])
+        except ValueError as e:
+            await send_simple(send, 400, dumps({"message": str(e)}))
+            return
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        bridge = self.bridge_for(reader)
+        subscriber = bridge.subscribe(buffer_size, policy, fields)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            subscriber.close()
+
+        watcher = asyncio.get_running_loop().create_task(watch_disconnect())
+        try:
+            while reader.streaming and not subscriber.closed:
+                chunks = await subscriber.get(0.25)
+                if chunks:
+                    await send({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+        finally:
+            bridge.unsubscribe(subscriber)
+            watcher.cancel()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def create_asgi_app(flask_app, credentials=None):
+    return EmulatorASGI(flask_app, credentials)
+
+
+def serve(flask_app, host="0.0.0.0", port=5000, certfile=None, keyfile=None, credentials=None, extra_ports=()):
+    """
+    Run the emulator on Hypercorn with the asyncio event stream, also
+    listening on `extra_ports` (the ports of fleet readers).
+    """
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    hypercorn_config = Config()
+    hypercorn_config.bind = [f"{host}:{port}"] + [f"{host}:{extra}" for extra in extra_ports]
+    hypercorn_config.backlog = 4096
+    if certfile and keyfile:
+        hypercorn_config.certfile = certfile
+        hypercorn_config.keyfile = keyfile
+    asyncio.run(hypercorn_serve(create_asgi_app(flask_app, credentials), hypercorn_config))
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+from app.metrics import events_dropped
+
+# What a buffer does when an offer would exceed its size
+DROP_OLDEST = "drop-oldest"
+BLOCK = "block"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, BLOCK, DISCONNECT)
+
+
+class EventBuffer:
+    """
+    Bounded FIFO of events between a producer and one consumer. On overflow
+    the oldest events are dropped, the producer blocks until the consumer
+    catches up, or the buffer is closed, depending on `policy`. Drops are
+    also counted in the metrics of its `sink` (sse, mqtt or webhook).
+    With a spill queue attached, events that do not fit go to disk instead
+    and are handed out after the events in memory, oldest first.
+    """
+
+    def __init__(self, size, policy=DROP_OLDEST, sink="sse"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.size = max(1, size)
+        self.policy = policy
+        self.events = deque()
+        self.ready = threading.Condition()
+        self.sink = sink
+        self.dropped_metric = events_dropped.labels(sink)
+        self.dropped = 0
+        self.closed = False
+        self.spill = None
+
+    def __len__(self):
+        return len(self.events) + (len(self.spill) if self.spill is not None else 0)
+
+    def resize(self, size):
+        with self.ready:
+            self.size = max(1, size)
+            if self.spill is None:
+                self._trim()
+
+    def spill_to(self, queue):
+        """Attach a SpillQueue for the events that do not fit, or detach it with None."""
+        with self.ready:
+            self.spill = queue
+            if queue is None:
+                self._trim()
+            elif queue:
+                self.ready.notify_all()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+    def reopen(self):
+        with self.ready:
+            self.closed = False
+
+    def offer(self, events, cancelled=None):
+        """
+        Queue events according to the overflow policy. Returns False once
+        closed. A blocked offer gives up, dropping `events`, as soon as
+        `cancelled()` returns True.
+        """
+        with self.ready:
+            if self.spill is not None and not self.closed:
+                self._spill(events)
+                return True
+            if self.policy == BLOCK:
+                # A batch larger than the buffer is accepted once it is empty
+                while self.events and len(self.events) + len(events) > self.size and not self.closed:
+                    if cancelled is not None and cancelled():
+                        self.drop(len(events))
+                        return True
+                    self.ready.wait(0.1)
+            elif self.policy == DISCONNECT and len(self.events) + len(events) > self.size:
+                self.drop(len(events))
+                self.closed = True
+            if self.closed:
+                self.ready.notify_all()
+                return False
+            self.events.extend(events)
+            self._trim()
+            if self.events:
+                self.ready.notify_all()
+            return True
+
+    def _spill(self, events):
+        # Once events are on disk, newer ones follow them there to keep the order
+        room = 0 if self.spill else max(0, self.size - len(self.events))
+        self.events.extend(events[:room])
+        if len(events) > room:
+            dropped = self.spill.append(events[room:])
+            if dropped:
+                self.drop(dropped)
+        if events:
+            self.ready.notify_all()
+
+    def _trim(self):
+        overflow = len(self.events) - self.size
+        for _ in range(overflow):
+            self.events.popleft()
+        if overflow > 0:
+            self.drop(overflow)
+
+    def drop(self, count):
+        self.dropped += count
+        self.dropped_metric.inc(count)
+
+    def _pop(self, limit):
+        events = [self.events.popleft() for _ in range(min(limit, len(self.events)))]
+        if len(events) < limit and self.spill:
+            events.extend(self.spill.read(limit - len(events)))
+        if self.policy == BLOCK and events:
+            self.ready.notify_all()
+        return events
+
+    def take(self, limit, timeout=0.5):
+        """Return up to `limit` events, waiting up to `timeout` for the first one."""
+        with self.ready:
+            if not self and not self.closed:
+                self.ready.wait(timeout)
+            return self._pop(limit)
+
+    def take_batch(self, limit, linger):
+        """
+        Return once `limit` events are queued or `linger` seconds have
+        passed, whichever comes first.
+        """
+        deadline = time.monotonic() + linger
+        with self.ready:
+            while len(self) < limit and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.ready.wait(remaining)
+            return self._pop(limit)
@@ -0,0 +1,106 @@
+import threading
+import time
+from app.generator import EventGenerator
+from app.metrics import events_generated
+from app.state import ReaderState
+
+generated = events_generated.labels()
+
+
+class EventBus:
+    """
+    Runs a single event producer per started preset and fans its batches
+    out to every subscribed EventBuffer (SSE connections, MQTT, webhook).
+    Each subscriber has its own bounded buffer and overflow policy, so
+    adding a consumer only copies event references and a slow consumer
+    only affects the producer when it asked for the `block` policy.
+    """
+
+    def __init__(self, state=None):
+        self.lock = threading.Lock()
+        # Replaced, never mutated, so the producer can iterate it without locking
+        self.subscribers = ()
+        # The streaming flag of the reader this bus belongs to
+        self.state = state or ReaderState()
+        self.run = 0
+        self.running = False
+        self.published = 0
+        self.generator = None
+
+    def subscribe(self, buffer):
+        with self.lock:
+            if buffer not in self.subscribers:
+                buffer.reopen()
+                self.subscribers = self.subscribers + (buffer,)
+        return buffer
+
+    def unsubscribe(self, buffer):
+        """Remove a subscriber and close its buffer, releasing a producer blocked on it."""
+        with self.lock:
+            if buffer not in self.subscribers:
+                return
+            self.subscribers = tuple(subscriber for subscriber in self.subscribers if subscriber is not buffer)
+        buffer.close()
+
+    def start(self, event_generator=None, workers=None):
+        """
+        Start the producer for a new run, retiring the previous one. The run
+        gets its own thread, or is driven by the shared `workers` when given.
+        """
+        with self.lock:
+            self.run += 1
+            run = self.run
+        event_generator = event_generator or EventGenerator()
+        self.generator = event_generator
+        self.running = True
+        if workers is not None:
+            workers.schedule(self, run, event_generator)
+            return None
+        thread = threading.Thread(target=self._produce, args=(run, event_generator), daemon=True)
+        thread.start()
+        return thread
+
+    def publish(self, events, run=None):
+        """
+        Offer events to every subscriber. With a `run`, a producer blocked on
+        a full `block` buffer gives up once streaming stops or a new run starts.
+        """
+        cancelled = None
+        if run is not None:
+            cancelled = lambda: not self.state.streaming or self.run != run
+        closed = [buffer for buffer in self.subscribers if not buffer.offer(events, cancelled)]
+        for buffer in closed:
+            self.unsubscribe(buffer)
+        self.published += len(events)
+        generated.inc(len(events))
+
+    def active(self, run):
+        """True while `run` is current and streaming; marks the bus idle once it is over."""
+        if self.state.streaming and self.run == run:
+            return True
+        if self.run == run:
+            self.running = False
+        return False
+
+    def produce(self, run, event_generator):
+        """Generate and publish the events that are due now, returning how many there were."""
+        events = event_generator.next_batch()
+        if events:
+            self.publish(events, run)
+        return len(events)
+
+    def _produce(self, run, event_generator):
+        while self.active(run):
+            if not self.subscribers:
+                time.sleep(0.05)
+                continue
+            self.produce(run, event_generator)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "subscribers": len(self.subscribers),
+            "eventsPublished": self.published
+        }
+
+event_bus = EventBus()
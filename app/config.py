@@ -1,2 +1,4 @@
-streaming = False
-system_start_time = ""
\ No newline at end of file
+system_start_time = ""
+
+# Worker processes generating events for the default reader (0 generates in-process)
+generation_processes = 0
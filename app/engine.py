@@ -0,0 +1,102 @@
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from app.epc import EPC_BYTES
+from app.events import EncodedEvent, event_template, DEFAULT_HOSTNAME
+from app.generator import EventGenerator, antenna_ports
+from app.seeding import EpcStream
+
+# Smaller batches are built in-process; a round trip to a worker costs more than it saves
+MIN_SHARD_EVENTS = 256
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(processes):
+    """
+    Shared pool of `processes` worker processes. Workers are spawned rather
+    than forked, since the emulator process runs server and publisher threads.
+    """
+    with pools_lock:
+        pool = pools.get(processes)
+        if pool is None:
+            pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+            pools[processes] = pool
+        return pool
+
+
+def encode_shard(packed, random_count, hostname, seed=None, random_start=0, antennas=(1,), antenna_start=0,
+                 fields=None):
+    """
+    Build the events of one shard inside a worker process: the packed
+    reference records followed by `random_count` random EPCs, from
+    position `random_start` of the run's EPC stream, read on `antennas`
+    in turn from index `antenna_start` and reporting `fields`. The events
+    are returned as their JSON encodings joined by newlines, so a batch
+    crosses the pipe as a single bytes object.
+    """
+    if random_count:
+        packed += EpcStream(seed).range(random_start, random_count)
+    render = event_template(hostname, fields).render
+    timestamp = time.time()
+    offsets = range(0, len(packed), EPC_BYTES)
+    ports = antenna_ports(antennas, antenna_start, len(offsets))
+    if isinstance(ports, int):
+        return b"\n".join([render(timestamp, packed[offset:offset + EPC_BYTES], ports) for offset in offsets])
+    return b"\n".join([render(timestamp, packed[offset:offset + EPC_BYTES], port)
+                        for offset, port in zip(offsets, ports)])
+
+
+class ShardedGenerator(EventGenerator):
+    """
+    EventGenerator that builds and encodes events in a pool of worker
+    processes instead of on the GIL. Pacing and the reference list cursor
+    stay in this process, which splits each due batch into one shard per
+    worker and hands out the already-encoded results in order. While a
+    batch is handed out the shards of the next one are being built, so
+    the workers and the publishing thread run concurrently. Shards draw
+    their random EPCs at positions reserved here, in order, so a seeded run
+    yields the same EPCs with any number of processes.
+    """
+
+    def __init__(self, settings=None, cursor=None, hostname=DEFAULT_HOSTNAME, sleep=time.sleep, processes=2):
+        super().__init__(settings, cursor, hostname, sleep)
+        self.processes = max(1, processes)
+        self.pool = get_pool(self.processes)
+        self.pending = deque()
+        self.ready = []
+
+    def events(self, count):
+        if count < MIN_SHARD_EVENTS and not self.pending and not self.ready:
+            return super().events(count)
+        while len(self.ready) < count:
+            if not self.pending:
+                self.submit(count - len(self.ready))
+            self.ready += self.pending.popleft().result().split(b"\n")
+        encoded, self.ready = self.ready[:count], self.ready[count:]
+        if count >= MIN_SHARD_EVENTS:
+            self.submit(count)
+        hostname = self.hostname
+        return [EncodedEvent(encoded_event, hostname) for encoded_event in encoded]
+
+    def submit(self, count):
+        """Queue `count` more events, split into one shard per idle worker."""
+        shard_size = math.ceil(count / self.processes)
+        while count > 0 and len(self.pending) < self.processes:
+            size = min(shard_size, count)
+            packed = self.cursor.next_records(size)
+            random_count = size - len(packed) // EPC_BYTES
+            self.pending.append(self.pool.submit(encode_shard, packed, random_count, self.hostname,
+                                                 self.epcs.seed, self.epcs.reserve(random_count),
+                                                 self.antennas, self.emitted, self.fields))
+            self.emitted += size
+            count -= size
+
+    def stats(self):
+        stats = super().stats()
+        stats["processes"] = self.processes
+        return stats
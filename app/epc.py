@@ -1,5 +1,10 @@
 import random
 import base64
+import numpy as np
+
+# Big-endian 96-bit EPC split into a 32-bit and a 64-bit word
+PACKED_DTYPE = np.dtype([("hi", ">u4"), ("lo", ">u8")])
+EPC_BYTES = 12
 
 class EPC:
     DefaultHeader = 0x35
@@ -9,11 +14,13 @@ class EPC:
     MaxClass = 0xFFFFFF
     MaxSerial = 0xFFFFFFFFF
 
-    def __init__(self, header=None, manager=None, class_=None, serial=None):
+    def __init__(self, header=None, manager=None, class_=None, serial=None, rng=None):
+        # Random parts come from `rng` (a random.Random) when given, so callers can seed them
+        rng = rng or random
         self.header = header if header is not None else self.DefaultHeader
         self.manager = manager if manager is not None else self.DefaultManager
-        self.class_ = class_ if class_ is not None else random.randint(0, self.MaxClass)
-        self.serial = serial if serial is not None else random.randint(0, self.MaxSerial)
+        self.class_ = class_ if class_ is not None else rng.randint(0, self.MaxClass)
+        self.serial = serial if serial is not None else rng.randint(0, self.MaxSerial)
 
     def hex(self):
         return f"{self.header:02X}{self.manager:07X}{self.class_:06X}{self.serial:09X}"
@@ -22,3 +29,31 @@ class EPC:
         hex_string = self.hex()
         binary_data = bytes.fromhex(hex_string)
         return base64.b64encode(binary_data).decode('utf-8')
+
+    @classmethod
+    def generate_batch(cls, n, header=None, manager=None, rng=None):
+        """
+        Generate `n` random EPCs at once, returned as a packed buffer of
+        12-byte big-endian records (header, manager, class, serial).
+        """
+        rng = rng or np.random.default_rng()
+        header = cls.DefaultHeader if header is None else header
+        manager = cls.DefaultManager if manager is None else manager
+        class_ = rng.integers(0, cls.MaxClass, size=n, endpoint=True, dtype=np.uint64)
+        serial = rng.integers(0, cls.MaxSerial, size=n, endpoint=True, dtype=np.uint64)
+        packed = np.empty(n, dtype=PACKED_DTYPE)
+        packed["hi"] = (header << 24) | (manager >> 4)
+        packed["lo"] = np.uint64((manager & 0xF) << 60) | (class_ << np.uint64(36)) | serial
+        return packed.tobytes()
+
+    @staticmethod
+    def encode_batch(packed):
+        """
+        Encode a packed buffer of 12-byte EPCs into the `epc` (base64) and
+        `epcHex` columns. 12 bytes encode to exactly 16 base64 characters,
+        so the whole buffer is encoded in one call and sliced per record.
+        """
+        b64 = base64.b64encode(packed).decode('ascii')
+        hex_string = packed.hex().upper()
+        return ([b64[i:i + 16] for i in range(0, len(b64), 16)],
+                [hex_string[i:i + 24] for i in range(0, len(hex_string), 24)])
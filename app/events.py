@@ -1,22 +1,337 @@
+import binascii
+import functools
+import json
+import operator
 import time
-from .epc import EPC
+from .epc import EPC, EPC_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_HOSTNAME = "r700-emulator"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# FCC hop table: 50 channels of 500 kHz from 902.75 MHz
+FIRST_CHANNEL_KHZ = 902750
+CHANNEL_SPACING_KHZ = 500
+CHANNELS = 50
+
+# (second, text, bytes) of the last second an event was stamped in
+last_timestamp = (None, "", b"")
+
+
+def cached_timestamp(seconds):
+    global last_timestamp
+    second = int(seconds)
+    cached = last_timestamp
+    if cached[0] != second:
+        text = time.strftime(TIMESTAMP_FORMAT, time.gmtime(second))
+        cached = (second, text, text.encode('ascii'))
+        last_timestamp = cached
+    return cached
+
+
+def format_timestamp(seconds=None):
+    """ISO 8601 UTC timestamp of `seconds` (default now), formatted once per second."""
+    return cached_timestamp(time.time() if seconds is None else seconds)[1]
+
+
+def dumps(obj):
+    """Encode `obj` as UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+class EventTemplate:
+    """
+    JSON of a tag event pre-rendered for one hostname, with only the
+    timestamp, EPC and antenna left to fill in. Renders exactly what
+    json.dumps(event.to_dict()) would, without building any dicts. With
+    `fields`, only those top-level and tagInventoryEvent fields are
+    rendered; the projection is compiled into the template and an
+    itemgetter.
+    """
+    # tagInventoryEvent fields, in order, and how their values are rendered
+    FIELDS = (("epc", b'"%s"'), ("epcHex", b'"%s"'), ("antennaPort", b'%d'), ("antennaName", b'"Antenna %d"'))
+
+    def __init__(self, hostname, fields=None):
+        def kept(name):
+            return fields is None or name in fields
+        columns = [index for index, (name, _) in enumerate(self.FIELDS) if kept(name)]
+        # Value 0 is the timestamp, the others the columns shifted by one
+        values = ([0] if kept("timestamp") else []) + [index + 1 for index in columns]
+        if len(values) == len(self.FIELDS) + 1:
+            self.project = None
+        elif len(values) > 1:
+            self.project = operator.itemgetter(*values)
+        else:
+            # itemgetter would return a lone value rather than a tuple
+            self.project = lambda all_values: tuple(all_values[index] for index in values)
+        parts = []
+        if kept("timestamp"):
+            parts.append(b'"timestamp": "%s"')
+        if kept("hostname"):
+            parts.append(b'"hostname": ' + json.dumps(hostname).encode('ascii').replace(b'%', b'%%'))
+        if kept("eventType"):
+            parts.append(b'"eventType": "tagInventory"')
+        parts.append(b'"tagInventoryEvent": {' +
+                     b", ".join(b'"' + self.FIELDS[index][0].encode('ascii') + b'": ' + self.FIELDS[index][1]
+                                for index in columns) + b'}')
+        self.template = b'{' + b', '.join(parts) + b'}'
+
+    def fill(self, values):
+        return self.template % (values if self.project is None else self.project(values))
+
+    def render(self, timestamp, epc, antenna=1):
+        """Render the event of a raw 12-byte `epc` stamped at `timestamp` (seconds since the epoch)."""
+        return self.fill((cached_timestamp(timestamp)[2], binascii.b2a_base64(epc, newline=False),
+                          binascii.hexlify(epc).upper(), antenna, antenna))
+
+
+class ReadTemplate(EventTemplate):
+    """EventTemplate for simulated reads, which also report their signal."""
+    FIELDS = EventTemplate.FIELDS + (
+        ("peakRssiCdbm", b'%d'), ("phaseAngle", b'%a'), ("frequency", b'%d'), ("channel", b'%d'))
+
+    def render(self, timestamp, epc, antenna, rssi, phase, channel):
+        return self.fill((cached_timestamp(timestamp)[2], binascii.b2a_base64(epc, newline=False),
+                          binascii.hexlify(epc).upper(), antenna, antenna,
+                          rssi, phase, FIRST_CHANNEL_KHZ + channel * CHANNEL_SPACING_KHZ, channel))
+
+
+class SummaryTemplate(EventTemplate):
+    """EventTemplate for aggregated reports of a tag."""
+    FIELDS = EventTemplate.FIELDS + (
+        ("firstSeenTime", b'"%s"'), ("lastSeenTime", b'"%s"'), ("tagSeenCount", b'%d'))
+
+    def render(self, timestamp, epc, antenna, first_seen, last_seen, count):
+        return self.fill((cached_timestamp(timestamp)[2], binascii.b2a_base64(epc, newline=False),
+                          binascii.hexlify(epc).upper(), antenna, antenna,
+                          format_timestamp(first_seen).encode('ascii'),
+                          format_timestamp(last_seen).encode('ascii'), count))
+
+
+# Every field a report can be projected to: the top-level ones and those of its tagInventoryEvent
+TOP_FIELDS = ("timestamp", "hostname", "eventType")
+REPORT_FIELDS = TOP_FIELDS + tuple(dict.fromkeys(name for name, _ in ReadTemplate.FIELDS + SummaryTemplate.FIELDS))
+
+
+def parse_report_fields(data):
+    """
+    Validate a list of fields for events to report, as a canonical tuple for
+    the template caches. The top-level fields are kept unless one is listed.
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("reportFields must be a non-empty list of field names")
+    if any(field not in REPORT_FIELDS for field in data):
+        raise ValueError(f"reportFields must be among {', '.join(REPORT_FIELDS)}")
+    fields = tuple(field for field in REPORT_FIELDS if field in data)
+    if not any(field in TOP_FIELDS for field in fields):
+        fields = TOP_FIELDS + fields
+    return fields
+
+
+@functools.lru_cache(maxsize=256)
+def narrow(fields, sink_fields):
+    """The fields events projected to `fields` report at a sink that keeps `sink_fields`; None for all."""
+    if fields is None or sink_fields is None:
+        return sink_fields if fields is None else fields
+    return tuple(field for field in fields if field in sink_fields)
+
+
+@functools.lru_cache(maxsize=4096)
+def event_template(hostname, fields=None):
+    return EventTemplate(hostname, fields)
+
+
+@functools.lru_cache(maxsize=4096)
+def read_template(hostname, fields=None):
+    return ReadTemplate(hostname, fields)
+
+
+@functools.lru_cache(maxsize=4096)
+def summary_template(hostname, fields=None):
+    return SummaryTemplate(hostname, fields)
+
+
+def project_dict(event, fields):
+    """Keep only `fields` of an event dict and of its tagInventoryEvent."""
+    if fields is None:
+        return event
+    projected = {key: value for key, value in event.items() if key in fields or key == "tagInventoryEvent"}
+    if isinstance(projected.get("tagInventoryEvent"), dict):
+        projected["tagInventoryEvent"] = {key: value for key, value in projected["tagInventoryEvent"].items()
+                                          if key in fields}
+    return projected
+
 
 class TagEvent:
-    def __init__(self, epc):
-        self.timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        self.hostname = "r700-emulator"
-        self.eventType = "tagInventory"
-        self.tagInventoryEvent = {
-            "epc": epc.b64(),
-            "epcHex": epc.hex(),
-            "antennaPort": 1,
-            "antennaName": "Antenna 1"
-        }
+    """
+    A tag read kept as the raw 12-byte EPC, antenna port and a numeric
+    timestamp. Events of a batch share the timestamp and hostname objects,
+    so buffering an event costs little more than its EPC. The base64/hex
+    strings and dict form are only built when asked for; the JSON encoding
+    is rendered on first use and reused by every consumer. The fields an
+    event reports are a class attribute, set by the subclasses projected()
+    returns, so a projection costs no memory per event.
+    """
+    __slots__ = ("epc", "antenna", "timestamp", "hostname", "encoded")
+    fields = None
+
+    def __init__(self, epc, antenna=1, timestamp=None, hostname=DEFAULT_HOSTNAME):
+        self.epc = bytes.fromhex(epc.hex()) if isinstance(epc, EPC) else epc
+        self.antenna = antenna
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.hostname = hostname
+        self.encoded = None
+
+    @property
+    def epc_b64(self):
+        return binascii.b2a_base64(self.epc, newline=False).decode('ascii')
+
+    @property
+    def epc_hex(self):
+        return self.epc.hex().upper()
 
     def to_dict(self):
+        return project_dict(self.full_dict(), self.fields)
+
+    def full_dict(self):
         return {
-            "timestamp": self.timestamp,
+            "timestamp": format_timestamp(self.timestamp),
             "hostname": self.hostname,
-            "eventType": self.eventType,
-            "tagInventoryEvent": self.tagInventoryEvent
+            "eventType": "tagInventory",
+            "tagInventoryEvent": {
+                "epc": self.epc_b64,
+                "epcHex": self.epc_hex,
+                "antennaPort": self.antenna,
+                "antennaName": f"Antenna {self.antenna}"
+            }
         }
+
+    def encode(self):
+        """UTF-8 JSON of the event, rendered from the hostname's template on first use."""
+        if self.encoded is None:
+            self.encoded = self.render(self.fields)
+        return self.encoded
+
+    def encode_fields(self, fields):
+        """UTF-8 JSON of the event for a sink that only reports `fields`, rendered from their template."""
+        fields = narrow(self.fields, fields)
+        if fields == self.fields:
+            return self.encode()
+        return self.render(fields)
+
+    def render(self, fields):
+        return event_template(self.hostname, fields).render(self.timestamp, self.epc, self.antenna)
+
+
+class TagRead(TagEvent):
+    """
+    Tag event of the field simulation, with the peak RSSI (centi-dBm),
+    phase angle (degrees) and hop channel of the read.
+    """
+    __slots__ = ("rssi", "phase", "channel")
+
+    def __init__(self, epc, antenna, timestamp, hostname, rssi, phase, channel):
+        super().__init__(epc, antenna, timestamp, hostname)
+        self.rssi = rssi
+        self.phase = phase
+        self.channel = channel
+
+    def full_dict(self):
+        event = super().full_dict()
+        event["tagInventoryEvent"].update({
+            "peakRssiCdbm": self.rssi,
+            "phaseAngle": self.phase,
+            "frequency": FIRST_CHANNEL_KHZ + self.channel * CHANNEL_SPACING_KHZ,
+            "channel": self.channel
+        })
+        return event
+
+    def render(self, fields):
+        return read_template(self.hostname, fields).render(
+            self.timestamp, self.epc, self.antenna, self.rssi, self.phase, self.channel)
+
+
+class TagSummary(TagEvent):
+    """Aggregated report of the reads of one tag (and antenna) over a reporting interval."""
+    __slots__ = ("first_seen", "last_seen", "count")
+
+    def __init__(self, epc, antenna, timestamp, hostname, first_seen, last_seen, count):
+        super().__init__(epc, antenna, timestamp, hostname)
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.count = count
+
+    def full_dict(self):
+        event = super().full_dict()
+        event["tagInventoryEvent"].update({
+            "firstSeenTime": format_timestamp(self.first_seen),
+            "lastSeenTime": format_timestamp(self.last_seen),
+            "tagSeenCount": self.count
+        })
+        return event
+
+    def render(self, fields):
+        return summary_template(self.hostname, fields).render(
+            self.timestamp, self.epc, self.antenna, self.first_seen, self.last_seen, self.count)
+
+
+def events_from_records(packed, antenna=1, timestamp=None, hostname=DEFAULT_HOSTNAME, fields=None):
+    """
+    Events for a buffer of packed 12-byte EPCs, all read at `timestamp`
+    (default now) on `antenna`, or on the ports of a list with one per EPC.
+    """
+    timestamp = time.time() if timestamp is None else timestamp
+    event_class = projected(TagEvent, fields)
+    offsets = range(0, len(packed), EPC_BYTES)
+    if isinstance(antenna, int):
+        return [event_class(packed[offset:offset + EPC_BYTES], antenna, timestamp, hostname)
+                for offset in offsets]
+    return [event_class(packed[offset:offset + EPC_BYTES], port, timestamp, hostname)
+            for offset, port in zip(offsets, antenna)]
+
+
+@functools.lru_cache(maxsize=256)
+def projected(event_class, fields=None):
+    """Subclass of `event_class` whose events only report `fields` (a tuple), or the class itself for all fields."""
+    if fields is None:
+        return event_class
+    return type(event_class.__name__, (event_class,), {"__slots__": (), "fields": fields})
+
+
+class EncodedEvent:
+    """A tag event that arrives already encoded, e.g. from a generation worker process."""
+    __slots__ = ("encoded", "hostname")
+
+    def __init__(self, encoded, hostname=DEFAULT_HOSTNAME):
+        self.encoded = encoded
+        self.hostname = hostname
+
+    def to_dict(self):
+        return json.loads(self.encoded)
+
+    def encode(self):
+        return self.encoded
+
+    def encode_fields(self, fields):
+        """The encoding projected to `fields`; with no raw values left, it is decoded and encoded again."""
+        if fields is None:
+            return self.encoded
+        return dumps(project_dict(json.loads(self.encoded), fields))
+
+
+def encode_events(events, fields=None):
+    """The encodings of `events`, projected to `fields` when a sink only reports those."""
+    if fields is None:
+        return [event.encode() for event in events]
+    return [event.encode_fields(fields) for event in events]
+
+
+def json_array(events, fields=None):
+    """UTF-8 JSON array of events, built from their cached or projected encodings."""
+    return b"[" + b",".join(encode_events(events, fields)) + b"]"
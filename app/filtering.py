@@ -0,0 +1,194 @@
+import time
+from collections import deque
+from app.events import TagSummary, projected
+
+MODE_DEDUP = "dedup"
+MODE_AGGREGATE = "aggregate"
+FILTER_MODES = (MODE_DEDUP, MODE_AGGREGATE)
+KEY_EPC = "epc"
+KEY_EPC_ANTENNA = "epcAntenna"
+FILTER_KEYS = (KEY_EPC, KEY_EPC_ANTENNA)
+
+DEFAULT_FILTER = {
+    "mode": MODE_DEDUP,
+    "key": KEY_EPC,
+    "windowSeconds": 1.0,
+    "reportIntervalSeconds": 1.0
+}
+
+# Time buckets a dedup window is split into; keys expire at most one bucket late
+BUCKETS_PER_WINDOW = 16
+
+
+def parse_filter(data):
+    """Validate the `filter` generator settings, returning a new settings dict."""
+    if not isinstance(data, dict):
+        raise ValueError("filter must be an object")
+    settings = dict(DEFAULT_FILTER)
+    for key, choices in (("mode", FILTER_MODES), ("key", FILTER_KEYS)):
+        if key in data:
+            if data[key] not in choices:
+                raise ValueError(f"filter.{key} must be one of {', '.join(choices)}")
+            settings[key] = data[key]
+    for key in ("windowSeconds", "reportIntervalSeconds"):
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                raise ValueError(f"filter.{key} must be a positive number")
+            settings[key] = value
+    return settings
+
+
+def key_function(key):
+    if key == KEY_EPC_ANTENNA:
+        return lambda event: (event.epc, event.antenna)
+    return lambda event: event.epc
+
+
+class ExpiringIndex:
+    """
+    Keys that are forgotten about `window` seconds after they were added,
+    kept as a time-bucketed hash: a dict of key -> time bucket plus a queue
+    of the keys added in each bucket. Adding and looking up a key are O(1)
+    and each key is expired once, when its bucket falls out of the window,
+    so the cost per read does not grow with the number of tracked tags.
+    """
+
+    def __init__(self, window, buckets=BUCKETS_PER_WINDOW):
+        self.resolution = window / buckets
+        self.span = buckets
+        self.bucket_of = {}
+        self.buckets = deque()
+
+    def __contains__(self, key):
+        return key in self.bucket_of
+
+    def __len__(self):
+        return len(self.bucket_of)
+
+    def expire(self, now):
+        """Forget the keys added more than a window before `now`."""
+        oldest = int(now / self.resolution) - self.span
+        buckets, bucket_of = self.buckets, self.bucket_of
+        while buckets and buckets[0][0] < oldest:
+            number, keys = buckets.popleft()
+            for key in keys:
+                # Keys added again later belong to a newer bucket
+                if bucket_of.get(key) == number:
+                    del bucket_of[key]
+
+    def add(self, key, now):
+        number = int(now / self.resolution)
+        buckets = self.buckets
+        if not buckets or buckets[-1][0] < number:
+            buckets.append((number, []))
+        number, keys = buckets[-1]
+        keys.append(key)
+        self.bucket_of[key] = number
+
+
+class DuplicateFilter:
+    """Reports a tag (or tag and antenna) once, then suppresses its reads for a window."""
+
+    def __init__(self, settings):
+        self.index = ExpiringIndex(settings["windowSeconds"])
+        self.key = key_function(settings["key"])
+        self.reads = 0
+        self.suppressed = 0
+
+    def process(self, events):
+        if not events:
+            return events
+        index, key_of = self.index, self.key
+        index.expire(events[0].timestamp)
+        reported = []
+        for event in events:
+            key = key_of(event)
+            if key in index:
+                continue
+            index.add(key, event.timestamp)
+            reported.append(event)
+        self.reads += len(events)
+        self.suppressed += len(events) - len(reported)
+        return reported
+
+    def due_in(self):
+        return float('inf')
+
+    def stats(self):
+        return {"mode": MODE_DEDUP, "reads": self.reads, "suppressed": self.suppressed,
+                "trackedTags": len(self.index)}
+
+
+class ReadAggregator:
+    """
+    Collects the reads of each tag (or tag and antenna) and reports them as
+    one summary event per reporting interval, with the first and last time
+    the tag was seen and how often.
+    """
+
+    def __init__(self, settings, hostname, clock=time.time, fields=None):
+        self.interval = settings["reportIntervalSeconds"]
+        self.key = key_function(settings["key"])
+        self.hostname = hostname
+        self.event_class = projected(TagSummary, fields)
+        self.clock = clock
+        self.entries = {}
+        self.next_report = clock() + self.interval
+        self.reads = 0
+        self.reported = 0
+
+    def process(self, events):
+        entries, key_of = self.entries, self.key
+        for event in events:
+            key = key_of(event)
+            entry = entries.get(key)
+            if entry is None:
+                entries[key] = [event.epc, event.antenna, event.timestamp, event.timestamp, 1]
+            else:
+                entry[1] = event.antenna
+                entry[3] = event.timestamp
+                entry[4] += 1
+        self.reads += len(events)
+        now = self.clock()
+        if now < self.next_report:
+            return []
+        self.next_report = max(self.next_report + self.interval, now)
+        self.entries = {}
+        hostname, event_class = self.hostname, self.event_class
+        summaries = [event_class(epc, antenna, now, hostname, first_seen, last_seen, count)
+                     for epc, antenna, first_seen, last_seen, count in entries.values()]
+        self.reported += len(summaries)
+        return summaries
+
+    def due_in(self):
+        return max(0.0, self.next_report - self.clock())
+
+    def stats(self):
+        return {"mode": MODE_AGGREGATE, "reads": self.reads, "reported": self.reported,
+                "trackedTags": len(self.entries)}
+
+
+def create_stage(settings, hostname, fields=None):
+    if settings["mode"] == MODE_AGGREGATE:
+        return ReadAggregator(settings, hostname, fields=fields)
+    return DuplicateFilter(settings)
+
+
+class FilteredGenerator:
+    """Event source that passes the events of another one through a filtering stage."""
+
+    def __init__(self, event_generator, stage):
+        self.generator = event_generator
+        self.stage = stage
+
+    def next_batch(self):
+        return self.stage.process(self.generator.next_batch())
+
+    def due_in(self):
+        return min(self.generator.due_in(), self.stage.due_in())
+
+    def stats(self):
+        stats = self.generator.stats()
+        stats["filter"] = self.stage.stats()
+        return stats
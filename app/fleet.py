@@ -0,0 +1,126 @@
+import heapq
+import itertools
+import threading
+import time
+from app.events import DEFAULT_HOSTNAME
+from app.reader import Reader, READER_ENVIRON_KEY, default_reader, readers, readers_by_port, register
+
+# Fleet readers are served under /readers/<name>/...
+READER_PATH_PREFIX = "/readers/"
+DEFAULT_WORKERS = 2
+
+# How often a running reader without subscribers is looked at again
+IDLE_RECHECK_SECONDS = 0.25
+# Upper bound between two looks at a running reader, so stops are noticed
+MAX_WAIT_SECONDS = 1.0
+
+
+class GenerationWorkers:
+    """
+    A few shared threads that drive the event buses of all fleet readers.
+    Each run is pinned to one worker, which keeps the runs it serves in a
+    heap ordered by when their next events are due, so a fleet of thousands
+    of readers needs neither a thread nor a wake-up per reader.
+    """
+
+    def __init__(self, count=DEFAULT_WORKERS):
+        self.count = max(1, count)
+        self.heaps = [[] for _ in range(self.count)]
+        self.conditions = [threading.Condition() for _ in range(self.count)]
+        self.sequence = itertools.count()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def schedule(self, bus, run, event_generator, due=None, shard=None):
+        """Drive a run of `bus`; new runs are spread over the workers round-robin."""
+        if shard is None:
+            shard = next(self.sequence) % self.count
+        self._start()
+        with self.conditions[shard]:
+            heapq.heappush(self.heaps[shard], (due or time.monotonic(), next(self.sequence), bus, run, event_generator))
+            self.conditions[shard].notify()
+
+    def _start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for shard in range(self.count):
+                thread = threading.Thread(target=self._work, args=(shard,), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _next(self, shard):
+        heap, condition = self.heaps[shard], self.conditions[shard]
+        with condition:
+            while True:
+                if not heap:
+                    condition.wait()
+                    continue
+                delay = heap[0][0] - time.monotonic()
+                if delay <= 0:
+                    return heapq.heappop(heap)
+                condition.wait(delay)
+
+    def _work(self, shard):
+        while True:
+            _, _, bus, run, event_generator = self._next(shard)
+            if not bus.active(run):
+                continue
+            if bus.subscribers:
+                bus.produce(run, event_generator)
+                delay = min(event_generator.due_in(), MAX_WAIT_SECONDS)
+            else:
+                delay = IDLE_RECHECK_SECONDS
+            self.schedule(bus, run, event_generator, time.monotonic() + delay, shard)
+
+
+def fleet_serial(index):
+    return f"370-18-{index // 10000 % 100:02d}-{index % 10000:04d}"
+
+
+def create_fleet(size, workers=DEFAULT_WORKERS, base_port=None):
+    """
+    Register `size` virtual readers named reader-0001, reader-0002, ...
+    Reader i is also served on `base_port + i` when a base port is given.
+    """
+    generation_workers = GenerationWorkers(workers)
+    created = []
+    for index in range(1, size + 1):
+        reader = Reader(f"reader-{index:04d}", fleet_serial(index), f"{DEFAULT_HOSTNAME}-{index:04d}",
+                        port=base_port + index if base_port else None, workers=generation_workers)
+        register(reader)
+        created.append(reader)
+    return created
+
+
+def resolve(path, port=None):
+    """
+    Return (reader, path within the reader, path prefix) for a request.
+    The reader is None when the path names an unknown fleet reader.
+    """
+    if path.startswith(READER_PATH_PREFIX):
+        name, _, rest = path[len(READER_PATH_PREFIX):].partition('/')
+        return readers.get(name), '/' + rest, READER_PATH_PREFIX + name
+    if port and readers_by_port:
+        reader = readers_by_port.get(int(port))
+        if reader is not None:
+            return reader, path, ''
+    return default_reader, path, ''
+
+
+class FleetMiddleware:
+    """WSGI middleware that hands fleet reader requests to the Flask app with the reader attached."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        reader, path, prefix = resolve(environ.get('PATH_INFO', ''), environ.get('SERVER_PORT'))
+        if reader is None:
+            start_response('404 NOT FOUND', [('Content-Type', 'application/json')])
+            return [b'{"message": "Unknown reader"}']
+        if reader is not default_reader:
+            environ[READER_ENVIRON_KEY] = reader
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = path
+        return self.wsgi_app(environ, start_response)
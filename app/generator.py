@@ -0,0 +1,149 @@
+import time
+from app.epc import EPC, EPC_BYTES
+from app.events import events_from_records, parse_report_fields, DEFAULT_HOSTNAME
+from app.filtering import parse_filter
+from app.pacing import Pacer, MODES, MODE_FIXED, MODE_MAX
+from app.reflist import ReferenceCursor
+from app.replay import parse_replay
+from app.seeding import EpcStream, STREAM_PACING, python_rng
+from app.simulation import parse_simulation
+
+# Default pacing keeps the historic behaviour of one event every two seconds
+DEFAULT_SETTINGS = {
+    "eventsPerSecond": 0.5,
+    "mode": MODE_FIXED,
+    "burstSize": 1,
+    "maxBatchSize": 1000
+}
+
+# Antenna ports a reader can read on
+MAX_ANTENNA_PORT = 32
+
+
+def parse_settings(data):
+    """Validate generator settings from a request body, returning a new settings dict."""
+    settings = dict(DEFAULT_SETTINGS)
+    if not data:
+        return settings
+    if not isinstance(data, dict):
+        raise ValueError("Generator settings must be an object")
+    mode = data.get("mode", settings["mode"])
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    settings["mode"] = mode
+    for key, minimum in (("eventsPerSecond", 0), ("burstSize", 1), ("maxBatchSize", 1)):
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+                raise ValueError(f"{key} must be a number >= {minimum}")
+            settings[key] = value
+    if mode != MODE_MAX and settings["eventsPerSecond"] <= 0:
+        raise ValueError("eventsPerSecond must be positive")
+    if data.get("seed") is not None:
+        seed = data["seed"]
+        if isinstance(seed, bool) or not isinstance(seed, int) or seed < 0:
+            raise ValueError("seed must be a non-negative integer")
+        settings["seed"] = seed
+    if data.get("durationSeconds") is not None:
+        duration = data["durationSeconds"]
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)) or duration <= 0:
+            raise ValueError("durationSeconds must be a positive number")
+        settings["durationSeconds"] = duration
+    if data.get("antennas") is not None:
+        settings["antennas"] = parse_antennas(data["antennas"])
+    if data.get("reportFields") is not None:
+        settings["reportFields"] = parse_report_fields(data["reportFields"])
+    if data.get("simulation") is not None:
+        settings["simulation"] = parse_simulation(data["simulation"])
+        if "antennas" in settings:
+            settings["simulation"]["antennas"] = len(settings["antennas"])
+    if data.get("filter") is not None:
+        settings["filter"] = parse_filter(data["filter"])
+    if data.get("replay") is not None:
+        if any(key in settings for key in ("filter", "simulation", "antennas", "reportFields")):
+            raise ValueError("replay cannot be combined with simulation, filter, antennas or reportFields")
+        settings["replay"] = parse_replay(data["replay"])
+    return settings
+
+
+def parse_antennas(data):
+    """Validate a list of distinct antenna ports, which generated events rotate through."""
+    if not isinstance(data, list) or not data:
+        raise ValueError("antennas must be a non-empty list of antenna ports")
+    for port in data:
+        if isinstance(port, bool) or not isinstance(port, int) or not 1 <= port <= MAX_ANTENNA_PORT:
+            raise ValueError(f"antennas must be ports between 1 and {MAX_ANTENNA_PORT}")
+    if len(set(data)) != len(data):
+        raise ValueError("antennas must not repeat a port")
+    return tuple(data)
+
+
+def antenna_ports(ports, start, count):
+    """The ports of `count` events rotating through `ports` from index `start`, or one port for all."""
+    if len(ports) == 1:
+        return ports[0]
+    start %= len(ports)
+    rotation = list(ports[start:] + ports[:start])
+    return (rotation * (count // len(rotation) + 1))[:count]
+
+
+def next_epc_records(cursor, count, epcs=None):
+    """
+    Return `count` packed 12-byte EPCs, taken from the reference lists
+    through `cursor` and otherwise drawn in bulk from the `epcs` stream.
+    """
+    packed = cursor.next_records(count)
+    missing = count - len(packed) // EPC_BYTES
+    if missing:
+        packed += epcs.take(missing) if epcs is not None else EPC.generate_batch(missing)
+    return packed
+
+
+class EventGenerator:
+    """
+    Rate-controlled source of tag events shared by the HTTP stream,
+    MQTT and webhook publishers. With a `seed` setting, the random EPCs
+    and Poisson arrivals are drawn from streams spawned from it, so runs
+    with the same seed and reference lists produce the same tags.
+    """
+
+    def __init__(self, settings=None, cursor=None, hostname=DEFAULT_HOSTNAME, sleep=time.sleep):
+        self.settings = settings or DEFAULT_SETTINGS
+        self.cursor = cursor or ReferenceCursor()
+        self.hostname = hostname
+        self.antennas = self.settings.get("antennas", (1,))
+        self.fields = self.settings.get("reportFields")
+        self.emitted = 0
+        seed = self.settings.get("seed")
+        self.epcs = EpcStream(seed)
+        self.pacer = Pacer(
+            rate=self.settings["eventsPerSecond"],
+            mode=self.settings["mode"],
+            burst=self.settings["burstSize"],
+            max_batch=self.settings["maxBatchSize"],
+            sleep=sleep,
+            rng=python_rng(seed, STREAM_PACING)
+        )
+
+    def next_batch(self):
+        """Return the events that are due now (possibly none)."""
+        count = self.pacer.next_batch()
+        if not count:
+            return []
+        return self.events(count)
+
+    def events(self, count):
+        """Build `count` events from the reference lists or random EPCs."""
+        antenna = antenna_ports(self.antennas, self.emitted, count)
+        self.emitted += count
+        return events_from_records(next_epc_records(self.cursor, count, self.epcs), antenna,
+                                   hostname=self.hostname, fields=self.fields)
+
+    def due_in(self):
+        """Seconds until the next event is due."""
+        return self.pacer.due_in()
+
+    def stats(self):
+        stats = {"settings": self.settings}
+        stats.update(self.pacer.stats())
+        return stats
@@ -0,0 +1,195 @@
+import bisect
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 10, 100, 500, 1000, 2500, 5000, 10000, 50000)
+
+
+class PerThreadCells:
+    """
+    One list of values per recording thread, so recording is a plain
+    in-place add without locks or contention; readers sum the cells. The
+    cells of threads that have ended are folded into a shared total, so
+    short-lived request threads do not accumulate.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.cells = []
+        self.retired = [0] * width
+
+    def cell(self):
+        try:
+            return self.local.cell
+        except AttributeError:
+            return self.add_cell()
+
+    def add_cell(self):
+        cell = [0] * self.width
+        with self.lock:
+            self.fold_ended()
+            self.cells.append((threading.current_thread(), cell))
+        self.local.cell = cell
+        return cell
+
+    def fold_ended(self):
+        alive = []
+        for thread, cell in self.cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                self.retired = [total + value for total, value in zip(self.retired, cell)]
+        self.cells = alive
+
+    def totals(self):
+        with self.lock:
+            self.fold_ended()
+            totals = list(self.retired)
+            for _, cell in self.cells:
+                totals = [total + value for total, value in zip(totals, cell)]
+        return totals
+
+
+class Counter:
+    """Monotonic count of one label combination."""
+
+    def __init__(self):
+        self.cells = PerThreadCells(1)
+
+    def inc(self, amount=1):
+        self.cells.cell()[0] += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.cells.totals()[0])]
+
+
+class Histogram:
+    """Distribution of observed values over fixed bucket upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # One count per bucket plus +Inf, then the sum and count of all observations
+        self.cells = PerThreadCells(len(self.buckets) + 3)
+
+    def observe(self, value):
+        cell = self.cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def samples(self, name, labels):
+        totals = self.cells.totals()
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), totals):
+            cumulative += count
+            samples.append((name + "_bucket", labels + (("le", str(bound)),), cumulative))
+        samples.append((name + "_sum", labels, totals[-2]))
+        samples.append((name + "_count", labels, totals[-1]))
+        return samples
+
+
+class Metric:
+    """
+    A named metric family. Children are created per label values on first
+    use; hot paths look their child up once and keep it.
+    """
+
+    def __init__(self, kind, name, documentation, labels=(), factory=Counter):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+    def samples(self):
+        samples = []
+        for values, child in list(self.children.items()):
+            samples.extend(child.samples(self.name, tuple(zip(self.label_names, values))))
+        return samples
+
+
+class GaugeFunction:
+    """Gauge computed at scrape time by `function`, which returns {label values: value}."""
+
+    def __init__(self, name, documentation, labels, function):
+        self.kind = "gauge"
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.function = function
+
+    def samples(self):
+        return [(self.name, tuple(zip(self.label_names, values)), value)
+                for values, value in self.function().items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Metric("counter", name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Metric("histogram", name, documentation, labels, lambda: Histogram(buckets)))
+
+    def gauge_function(self, name, documentation, labels, function):
+        return self.register(GaugeFunction(name, documentation, labels, function))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{key}="{escape(str(label))}"' for key, label in labels)
+                    lines.append(f"{name}{{{label_text}}} {format_value(value)}")
+                else:
+                    lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+registry = Registry()
+
+events_generated = registry.counter(
+    "emulator_events_generated_total", "Tag events produced by the event generators.")
+events_delivered = registry.counter(
+    "emulator_events_delivered_total", "Tag events handed to each sink.", ("sink",))
+events_dropped = registry.counter(
+    "emulator_events_dropped_total", "Tag events dropped by full sink buffers.", ("sink",))
+mqtt_publish_latency = registry.histogram(
+    "emulator_mqtt_publish_latency_seconds",
+    "Time from publishing an MQTT message to its acknowledgement (QoS 1/2) or hand-off to the client (QoS 0).")
+webhook_batch_size = registry.histogram(
+    "emulator_webhook_batch_size_events", "Events per webhook request.", buckets=BATCH_SIZE_BUCKETS)
+webhook_latency = registry.histogram(
+    "emulator_webhook_request_latency_seconds", "Time to deliver a webhook batch, retries included.")
@@ -1,63 +1,401 @@
+import logging
+import random
 import paho.mqtt.client as mqtt
 import threading
 import time
 import ssl
+from app.buffer import EventBuffer, DROP_OLDEST, BLOCK
+from app.bus import event_bus
+from app.events import json_array, parse_report_fields
+from app.metrics import events_delivered, mqtt_publish_latency
+from app.pacing import TokenBucket
+from app.spill import configure_spill
 
-mqtt_client = mqtt.Client()
+DEFAULT_BUFFER_SIZE = 100000
+DEFAULT_PENDING_DELIVERY_LIMIT = 20
+
+logger = logging.getLogger(__name__)
+delivered_metric = events_delivered.labels("mqtt")
+latency_metric = mqtt_publish_latency.labels()
+
+# Reconnect delays double from the minimum up to the maximum, each drawn from [delay/2, delay]
+RECONNECT_MIN_SECONDS = 1.0
+RECONNECT_MAX_SECONDS = 60.0
+# Fleet readers spread their connects over this many seconds, so a fleet does not connect all at once
+CONNECT_SPREAD_SECONDS = 5.0
+NETWORK_LOOP_SECONDS = 0.1
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        print("Connected to MQTT broker")
-    else:
-        print(f"Failed to connect to MQTT broker, return code {rc}")
+# Settings that only take effect on a new connection
+CONNECTION_SETTINGS = ('brokerHostname', 'brokerPort', 'clientId', 'cleanSession', 'username', 'password',
+                       'keepAliveIntervalSeconds', 'tlsEnabled', 'tlsCertfile', 'tlsKeyfile', 'tlsCafile',
+                       'tlsInsecure', 'willTopic', 'willMessage', 'willQualityOfService')
 
-def on_disconnect(client, userdata, rc):
-    print("Disconnected from MQTT broker")
+# Numeric event settings as (key, minimum, whether it must be an integer)
+NUMERIC_SETTINGS = (("eventBatchSize", 1, True), ("eventBufferSize", 1, True), ("eventPendingDeliveryLimit", 1, True),
+                    ("eventPerSecondLimit", 0, False), ("eventQualityOfService", 0, True))
+
+mqtt_client = mqtt.Client()
 
 def on_publish(client, userdata, mid):
-    print(f"Message {mid} published")
+    mqtt_publisher.delivered(mid)
 
-def connect_mqtt(mqtt_config):
-    global mqtt_client
-    
-    # Configure TLS if enabled
+def backoff_delay(attempt, minimum=RECONNECT_MIN_SECONDS, maximum=RECONNECT_MAX_SECONDS):
+    """Jittered exponential backoff before reconnect attempt `attempt` (0 for the first retry)."""
+    delay = min(maximum, minimum * 2 ** min(attempt, 32))
+    return delay * random.uniform(0.5, 1.0)
+
+def validate_config(mqtt_config):
+    """Check the types and ranges of the event settings the publisher computes with. Raises ValueError."""
+    for key, minimum, integer in NUMERIC_SETTINGS:
+        value = mqtt_config.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)) or value < minimum:
+            raise ValueError(f"{key} must be {'an integer' if integer else 'a number'} >= {minimum}")
+    if mqtt_config.get('eventQualityOfService', 0) > 2:
+        raise ValueError("eventQualityOfService must be 0, 1 or 2")
+    if mqtt_config.get('reportFields') is not None:
+        parse_report_fields(mqtt_config['reportFields'])
+
+def connection_settings(mqtt_config):
+    return tuple(mqtt_config.get(key) for key in CONNECTION_SETTINGS)
+
+def status_topic(mqtt_config):
+    """Topic of the connect and disconnect messages: the will topic, else the event topic."""
+    return mqtt_config.get('willTopic') or mqtt_config.get('eventTopic', 'default/topic')
+
+def set_up_client(client, mqtt_config):
+    """Apply the TLS, credential and will settings of `mqtt_config` to a fresh client."""
     if mqtt_config.get('tlsEnabled', False):
-        tls_certfile = mqtt_config.get('tlsCertfile', None)  # Client certificate
-        tls_keyfile = mqtt_config.get('tlsKeyfile', None)    # Client private key
-        tls_cafile = mqtt_config.get('tlsCafile', None)      # CA certificate
         tls_insecure = mqtt_config.get('tlsInsecure', False) # Whether to bypass the server certificate verification
-        
-        # Set up TLS/SSL
-        mqtt_client.tls_set(
-            ca_certs=tls_cafile,
-            certfile=tls_certfile,
-            keyfile=tls_keyfile,
+        client.tls_set(
+            ca_certs=mqtt_config.get('tlsCafile', None),     # CA certificate
+            certfile=mqtt_config.get('tlsCertfile', None),   # Client certificate
+            keyfile=mqtt_config.get('tlsKeyfile', None),     # Client private key
             cert_reqs=ssl.CERT_NONE if tls_insecure else ssl.CERT_REQUIRED,
             tls_version=ssl.PROTOCOL_TLS,
             ciphers=None
         )
-        
         # Allow unsecure or self-signed certificates
-        mqtt_client.tls_insecure_set(tls_insecure)
-    
-    # Set username and password if provided
+        client.tls_insecure_set(tls_insecure)
     if mqtt_config.get('username'):
-        mqtt_client.username_pw_set(mqtt_config['username'], mqtt_config.get('password', ''))
-    
-    # Connect to the MQTT broker
-    while mqtt_config.get('active', False):
+        client.username_pw_set(mqtt_config['username'], mqtt_config.get('password', ''))
+    if mqtt_config.get('willTopic') and mqtt_config.get('willMessage'):
+        client.will_set(mqtt_config['willTopic'], mqtt_config['willMessage'],
+                        qos=mqtt_config.get('willQualityOfService', 0))
+
+
+class MqttConnection:
+    """
+    Keeps one MQTT client connected to the configured broker, on a single
+    thread that also runs the client's network loop. New settings are
+    applied in place: event settings take effect with the next message,
+    while changed connection settings close the connection (sending the
+    disconnectMessage) and reopen it on the same client object. Failed
+    and lost connections are retried with jittered exponential backoff.
+
+    Unacknowledged QoS 1/2 messages stay queued in the client across
+    reconnects and are sent again once connected, with the DUP flag so a
+    persistent session (cleanSession false) completes them, or as new
+    deliveries when the session is clean. Messages still in flight when
+    the connection settings change are carried over to the new session.
+    """
+    reconnect_delays = (RECONNECT_MIN_SECONDS, RECONNECT_MAX_SECONDS)
+
+    def __init__(self, client, publisher=None, client_id="", spread=0.0):
+        self.client = client
+        self.publisher = publisher
+        self.client_id = client_id
+        self.spread = spread
+        self.config = {}
+        # Connection settings in effect, and the settings they came with
+        self.settings = None
+        self.client_config = {}
+        self.wake = threading.Condition()
+        self.thread = None
+        self.attempt = 0
+        self.retry_at = 0.0
+        self.connects = 0
+        self.failures = 0
+        self.install_callbacks()
+
+    def install_callbacks(self, on_publish=None):
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        if on_publish is not None:
+            self.client.on_publish = on_publish
+
+    def configure(self, mqtt_config):
+        with self.wake:
+            self.config = mqtt_config
+            self.wake.notify()
+            if mqtt_config.get('active', False) and self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.warning("Failed to connect to MQTT broker, return code %s", rc)
+            return
+        logger.info("Connected to MQTT broker")
+        self.attempt = 0
+        self.connects += 1
+        mqtt_config = self.config
+        if mqtt_config.get('connectMessage'):
+            client.publish(status_topic(mqtt_config), mqtt_config['connectMessage'])
+
+    def on_disconnect(self, client, userdata, rc):
+        if rc == 0:
+            logger.info("Disconnected from MQTT broker")
+        else:
+            logger.warning("Lost the connection to the MQTT broker, return code %s", rc)
+
+    def wait(self, mqtt_config, timeout=None):
+        """Sleep until `timeout` passes or the settings are replaced."""
+        with self.wake:
+            if self.config is mqtt_config:
+                self.wake.wait(timeout)
+
+    def _run(self):
+        while True:
+            mqtt_config = self.config
+            active = mqtt_config.get('active', False)
+            settings = connection_settings(mqtt_config) if active else None
+            if settings != self.settings:
+                self.close()
+                if active:
+                    self.reset(mqtt_config)
+                self.settings = settings
+            if not active:
+                self.wait(mqtt_config)
+            elif self.client.socket() is not None:
+                if self.client.loop(NETWORK_LOOP_SECONDS) != mqtt.MQTT_ERR_SUCCESS:
+                    self.schedule_retry()
+            elif time.monotonic() < self.retry_at:
+                self.wait(mqtt_config, self.retry_at - time.monotonic())
+            else:
+                self.open(mqtt_config)
+
+    def open(self, mqtt_config):
+        broker_port = mqtt_config.get('brokerPort', 8883 if mqtt_config.get('tlsEnabled', False) else 1883)
         try:
-            broker_port = mqtt_config.get('brokerPort', 8883 if mqtt_config.get('tlsEnabled', False) else 1883)
-            mqtt_client.connect(mqtt_config['brokerHostname'], broker_port, mqtt_config.get('keepAliveIntervalSeconds', 60))
-            mqtt_client.loop_start()
-            break
-        except Exception as e:
-            print(f"Error connecting to MQTT broker: {e}")
-            time.sleep(5)
-
-mqtt_client.on_connect = on_connect
-mqtt_client.on_disconnect = on_disconnect
+            self.client.connect(mqtt_config.get('brokerHostname', ''), broker_port,
+                                mqtt_config.get('keepAliveIntervalSeconds', 60))
+        except (OSError, ValueError) as e:
+            logger.warning("Error connecting to MQTT broker: %s", e)
+            self.failures += 1
+            self.schedule_retry()
+
+    def schedule_retry(self):
+        self.retry_at = time.monotonic() + backoff_delay(self.attempt, *self.reconnect_delays)
+        self.attempt += 1
+
+    def close(self):
+        """Disconnect cleanly, after sending the disconnectMessage of the settings in use."""
+        if self.client.socket() is None:
+            return
+        previous = self.client_config
+        if self.client.is_connected() and previous.get('disconnectMessage'):
+            self.client.publish(status_topic(previous), previous['disconnectMessage'])
+        self.client.disconnect()
+        # Flush the DISCONNECT, after which the client closes its socket
+        for _ in range(10):
+            if self.client.socket() is None or self.client.loop(NETWORK_LOOP_SECONDS) != mqtt.MQTT_ERR_SUCCESS:
+                break
+
+    def reset(self, mqtt_config):
+        """Re-create the client in place for new connection settings, keeping its unacknowledged messages."""
+        client = self.client
+        with client._out_message_mutex:
+            # paho keeps no public view of its outgoing queue
+            pending = [(mid, message.topic, message.payload, message.qos)
+                       for mid, message in client._out_messages.items() if message.qos > 0]
+        on_publish = client.on_publish
+        clean_session = mqtt_config.get('cleanSession', True)
+        client_id = mqtt_config.get('clientId') or self.client_id
+        if not client_id:
+            # A persistent session needs a client id; the broker assigns one otherwise
+            clean_session = True
+        client.reinitialise(client_id, clean_session)
+        self.install_callbacks(on_publish)
+        set_up_client(client, mqtt_config)
+        if self.publisher is not None:
+            client.max_inflight_messages_set(self.publisher.pending_delivery_limit())
+        mids = {}
+        for mid, topic, payload, qos in pending:
+            mids[mid] = client.publish(topic, payload, qos=qos).mid
+        if self.publisher is not None:
+            self.publisher.requeued(mids)
+        self.client_config = mqtt_config
+        self.attempt = 0
+        self.retry_at = time.monotonic() + random.uniform(0, self.spread)
+
+    def stats(self):
+        return {"connected": self.client.is_connected(), "connects": self.connects,
+                "connectionFailures": self.failures}
+
+
+class MqttPublisher:
+    """
+    Publishes tag events from its event bus subscription, independently of
+    whether anyone reads the HTTP stream. Honors eventBufferSize (oldest
+    events are dropped when full unless eventBufferOverflowPolicy is
+    `block`), eventPendingDeliveryLimit (in-flight
+    window for QoS 1/2), eventPerSecondLimit (0 means unlimited) and
+    eventBatchSize (events per message, sent as a JSON array when > 1).
+    With `reportFields`, messages carry only those fields of each event.
+    With `eventSpill` active, events that overflow the buffer while the
+    broker is unreachable go to disk and are published once it is back.
+    """
+
+    def __init__(self, client, bus=event_bus, client_id="", spread=0.0, name="default"):
+        self.client = client
+        self.bus = bus
+        self.name = name
+        self.connection = MqttConnection(client, self, client_id, spread)
+        self.config = {}
+        self.fields = None
+        self.buffer = EventBuffer(DEFAULT_BUFFER_SIZE, sink="mqtt")
+        self.window = threading.Condition()
+        # Message id -> publish time of the messages awaiting acknowledgement
+        self.inflight = {}
+        self.early = set()
+        # Window slots taken by publish() calls that have no mid yet
+        self.reserved = 0
+        self.bucket = None
+        self.published = 0
+        self.failed = 0
+        self.threads = []
+
+    def configure(self, mqtt_config):
+        self.config = mqtt_config
+        fields = mqtt_config.get('reportFields')
+        self.fields = parse_report_fields(fields) if fields else None
+        limit = mqtt_config.get('eventPerSecondLimit', 0)
+        self.bucket = TokenBucket(limit, capacity=limit) if limit > 0 else None
+        self.client.max_inflight_messages_set(self.pending_delivery_limit())
+        self.buffer.resize(mqtt_config.get('eventBufferSize', DEFAULT_BUFFER_SIZE))
+        # Publishers keep their subscription, so only drop-oldest and block apply
+        self.buffer.policy = BLOCK if mqtt_config.get('eventBufferOverflowPolicy') == BLOCK else DROP_OLDEST
+        self.buffer.spill_to(configure_spill(self.buffer.spill, f"{self.name}-mqtt", mqtt_config.get('eventSpill')))
+        if mqtt_config.get('active', False):
+            self.bus.subscribe(self.buffer)
+            self.start()
+        else:
+            self.bus.unsubscribe(self.buffer)
+        self.connection.configure(mqtt_config)
+
+    def pending_delivery_limit(self):
+        return max(1, self.config.get('eventPendingDeliveryLimit', DEFAULT_PENDING_DELIVERY_LIMIT))
+
+    def batch_size(self):
+        return max(1, self.config.get('eventBatchSize', 1))
+
+    def start(self):
+        if self.threads:
+            return
+        thread = threading.Thread(target=self._send, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def offer(self, events):
+        self.buffer.offer(events)
+
+    def take(self, limit, timeout=0.5):
+        return self.buffer.take(limit, timeout)
+
+    def delivered(self, mid):
+        """Release the in-flight slot of an acknowledged QoS 1/2 message."""
+        with self.window:
+            published = self.inflight.pop(mid, None)
+            if published is not None:
+                latency_metric.observe(time.monotonic() - published)
+                self.window.notify()
+            elif self.config.get('eventQualityOfService', 0) > 0:
+                # The acknowledgement overtook the publish() call
+                self.early.add(mid)
+
+    def requeued(self, mids):
+        """Track the messages re-queued on a re-created client under their new ids ({old mid: new mid})."""
+        with self.window:
+            now = time.monotonic()
+            self.inflight = {new: self.inflight.get(old, now) for old, new in mids.items()}
+            self.early.clear()
+            self.window.notify_all()
+
+    def publish(self, events):
+        # One settings snapshot per message, however often they are replaced meanwhile
+        mqtt_config = self.config
+        topic = mqtt_config.get('eventTopic', 'default/topic')
+        qos = mqtt_config.get('eventQualityOfService', 0)
+        if self.bucket is not None:
+            self.bucket.consume(len(events))
+        fields = self.fields
+        payload = events[0].encode_fields(fields) if len(events) == 1 else json_array(events, fields)
+        if qos > 0:
+            with self.window:
+                while len(self.inflight) + self.reserved >= self.pending_delivery_limit():
+                    self.window.wait(0.5)
+                self.reserved += 1
+            started = time.monotonic()
+            # paho acknowledges under its own message lock and then calls
+            # delivered(), so the client must not be called with the window held
+            info = self.client.publish(topic, payload, qos=qos)
+            with self.window:
+                self.reserved -= 1
+                if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+                    self.failed += len(events)
+                    self.window.notify()
+                    return
+                # Messages published while disconnected stay queued in the client
+                if info.mid in self.early:
+                    self.early.discard(info.mid)
+                    latency_metric.observe(time.monotonic() - started)
+                    self.window.notify()
+                else:
+                    self.inflight[info.mid] = started
+        else:
+            started = time.monotonic()
+            info = self.client.publish(topic, payload, qos=qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.failed += len(events)
+                return
+            latency_metric.observe(time.monotonic() - started)
+        self.published += len(events)
+        delivered_metric.inc(len(events))
+
+    def _send(self):
+        while True:
+            if not self.config.get('active', False) or not self.client.is_connected():
+                time.sleep(0.1)
+                continue
+            try:
+                events = self.take(self.batch_size())
+                if events:
+                    self.publish(events)
+            except Exception:
+                # The thread outlives a bad batch or settings; there is no other publisher
+                logger.exception("Error publishing events to MQTT")
+                time.sleep(0.1)
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "dropped": self.buffer.dropped,
+            "failed": self.failed,
+            "buffered": len(self.buffer),
+            "spilled": len(self.buffer.spill) if self.buffer.spill is not None else 0,
+            "inFlight": len(self.inflight),
+            **self.connection.stats()
+        }
+
+mqtt_publisher = MqttPublisher(mqtt_client)
+
 mqtt_client.on_publish = on_publish
 
-def start_mqtt_thread(mqtt_config):
-    threading.Thread(target=connect_mqtt, args=(mqtt_config,), daemon=True).start()
+def create_publisher(client_id, bus, spread=CONNECT_SPREAD_SECONDS):
+    """MQTT client and publisher of a fleet reader, wired like the default ones."""
+    client = mqtt.Client(client_id=client_id)
+    publisher = MqttPublisher(client, bus, client_id, spread, name=client_id)
+    client.on_publish = lambda client, userdata, mid: publisher.delivered(mid)
+    return publisher
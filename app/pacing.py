@@ -0,0 +1,173 @@
+import random
+import time
+
+MODE_FIXED = "fixed"
+MODE_BURST = "burst"
+MODE_POISSON = "poisson"
+MODE_MAX = "max"
+MODES = (MODE_FIXED, MODE_BURST, MODE_POISSON, MODE_MAX)
+
+# Upper bound for a single sleep so callers can react to stop requests
+MAX_SLEEP_SECONDS = 0.25
+
+
+class TokenBucket:
+    """Classic token bucket: tokens accrue at `rate` per second up to `capacity`."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate * 0.1)
+        self.clock = clock
+        self.tokens = 0.0
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, limit):
+        """Take up to `limit` whole tokens and return how many were granted."""
+        # The epsilon absorbs float error after sleeping exactly `wait_time`
+        granted = min(int(self.refill() + 1e-9), limit)
+        self.tokens -= granted
+        return granted
+
+    def consume(self, tokens, sleep=time.sleep):
+        """Block until `tokens` tokens are available, then take them."""
+        delay = self.wait_time(min(tokens, self.capacity))
+        if delay > 0:
+            sleep(delay)
+        self.refill()
+        self.tokens -= tokens
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` tokens are available."""
+        missing = tokens - self.refill()
+        return max(0.0, missing / self.rate) if self.rate > 0 else MAX_SLEEP_SECONDS
+
+
+class RateMeter:
+    """Tracks the achieved event rate overall and over the last window."""
+
+    def __init__(self, window=1.0, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.started = self.clock()
+        self.total = 0
+        self.window_start = self.started
+        self.window_count = 0
+        self.current_rate = 0.0
+
+    def add(self, count):
+        self.total += count
+        self.window_count += count
+        now = self.clock()
+        elapsed = now - self.window_start
+        if elapsed >= self.window:
+            self.current_rate = self.window_count / elapsed
+            self.window_start = now
+            self.window_count = 0
+
+    def average_rate(self):
+        elapsed = self.clock() - self.started
+        return self.total / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            "eventsGenerated": self.total,
+            "averageEventsPerSecond": round(self.average_rate(), 3),
+            "currentEventsPerSecond": round(self.current_rate, 3),
+        }
+
+
+class Pacer:
+    """
+    Decides how many events a generator loop may emit right now.
+
+    Instead of sleeping once per event, `next_batch` hands out every event
+    that is due since the last call, so high rates are reached with few
+    wake-ups and the average rate holds even when the loop falls behind.
+    """
+
+    def __init__(self, rate=0.5, mode=MODE_FIXED, burst=1, max_batch=1000,
+                 clock=time.monotonic, sleep=time.sleep, rng=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown pacing mode: {mode}")
+        if mode != MODE_MAX and rate <= 0:
+            raise ValueError("Event rate must be positive")
+        self.rate = float(rate)
+        self.mode = mode
+        self.burst = max(1, int(burst))
+        self.max_batch = max(1, int(max_batch))
+        self.clock = clock
+        self.sleep = sleep
+        # Only Poisson pacing draws random numbers
+        self.rng = rng or (random.Random() if mode == MODE_POISSON else None)
+        self.meter = RateMeter(clock=clock)
+        self.bucket = None
+        if mode == MODE_FIXED:
+            self.bucket = TokenBucket(rate, clock=clock)
+        elif mode == MODE_BURST:
+            self.bucket = TokenBucket(rate, capacity=self.burst, clock=clock)
+        self.next_arrival = clock()
+
+    def next_batch(self):
+        """
+        Return the number of events to emit now. Sleeps at most
+        MAX_SLEEP_SECONDS and may return 0 when nothing is due yet.
+        """
+        if self.mode == MODE_MAX:
+            count = self.max_batch
+        elif self.mode == MODE_POISSON:
+            count = self._poisson_arrivals()
+        else:
+            count = self._bucket_tokens()
+        if count:
+            self.meter.add(count)
+        return count
+
+    def due_in(self):
+        """Seconds until next_batch() has events to hand out."""
+        if self.mode == MODE_MAX:
+            return 0.0
+        if self.mode == MODE_POISSON:
+            return max(0.0, self.next_arrival - self.clock())
+        return self.bucket.wait_time(self.burst if self.mode == MODE_BURST else 1)
+
+    def _bucket_tokens(self):
+        needed = self.burst if self.mode == MODE_BURST else 1
+        delay = self.bucket.wait_time(needed)
+        if delay > 0:
+            self.sleep(min(delay, MAX_SLEEP_SECONDS))
+            if delay > MAX_SLEEP_SECONDS:
+                return 0
+        if self.mode == MODE_BURST and self.bucket.refill() + 1e-9 < needed:
+            return 0
+        return self.bucket.take(self.max_batch)
+
+    def _poisson_arrivals(self):
+        now = self.clock()
+        delay = self.next_arrival - now
+        if delay > 0:
+            self.sleep(min(delay, MAX_SLEEP_SECONDS))
+            if delay > MAX_SLEEP_SECONDS:
+                return 0
+            now = self.clock()
+        count = 0
+        # Do not let a long stall turn into an unbounded catch-up burst
+        if now - self.next_arrival > 1.0:
+            self.next_arrival = now
+        while self.next_arrival <= now and count < self.max_batch:
+            count += 1
+            self.next_arrival += self.rng.expovariate(self.rate)
+        return count
+
+    def stats(self):
+        stats = {"mode": self.mode, "targetEventsPerSecond": None if self.mode == MODE_MAX else self.rate}
+        stats.update(self.meter.to_dict())
+        return stats
@@ -0,0 +1,124 @@
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from app.generator import parse_settings
+
+PRESETS_FILE = "presets.json"
+
+# Started with the request body as its settings; it cannot be stored or deleted
+DEFAULT_PRESET = "default"
+PRESET_ID = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+logger = logging.getLogger(__name__)
+
+
+def parse_preset(data):
+    """
+    Validate a preset definition, returning the generator settings a run
+    starts from. Raises ValueError for an invalid definition.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("A preset must be an object")
+    if "description" in data and not isinstance(data["description"], str):
+        raise ValueError("description must be a string")
+    return parse_settings(data)
+
+
+@functools.lru_cache(maxsize=64)
+def parse_body(body):
+    """Settings of a start request body given as canonical JSON, so repeated starts skip validation."""
+    return parse_settings(json.loads(body))
+
+
+class PresetStore:
+    """
+    Inventory presets by id, kept in PRESETS_FILE. Each preset is validated
+    once, when it is stored or loaded, and its settings are cached next to
+    the definition, so starting a preset neither parses nor validates
+    anything. The generator, pacer and EPC stream of a run hold its state
+    and are built by each start.
+    """
+
+    def __init__(self, file_name=PRESETS_FILE):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.presets = None
+        self.settings = {}
+
+    def load(self):
+        """Read the saved presets on first use; call with the lock held."""
+        if self.presets is not None:
+            return
+        self.presets = {}
+        if not os.path.exists(self.file_name):
+            return
+        with open(self.file_name, 'r') as f:
+            saved = json.load(f)
+        for preset_id, data in saved.items():
+            try:
+                self.settings[preset_id] = parse_preset(data)
+                self.presets[preset_id] = data
+            except ValueError as e:
+                logger.warning("Skipping invalid preset %s: %s", preset_id, e)
+
+    def save(self):
+        # Written aside and renamed, so a concurrent reader never sees a partial file
+        temporary_file = self.file_name + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self.presets, f)
+        os.replace(temporary_file, self.file_name)
+
+    def ids(self):
+        with self.lock:
+            self.load()
+            return [DEFAULT_PRESET] + sorted(self.presets)
+
+    def get(self, preset_id):
+        """The definition of a preset, or None if there is none."""
+        with self.lock:
+            self.load()
+            return self.presets.get(preset_id)
+
+    def put(self, preset_id, data):
+        """
+        Store a preset, replacing one with the same id. Returns whether it is
+        new. Raises ValueError for an invalid id or definition.
+        """
+        if preset_id == DEFAULT_PRESET or not PRESET_ID.fullmatch(preset_id):
+            raise ValueError(f"Preset ids are 1 to 64 letters, digits, '.', '_' or '-', other than '{DEFAULT_PRESET}'")
+        settings = parse_preset(data)
+        with self.lock:
+            self.load()
+            created = preset_id not in self.presets
+            self.presets[preset_id] = data
+            self.settings[preset_id] = settings
+            self.save()
+        return created
+
+    def delete(self, preset_id):
+        """Remove a preset, returning whether there was one."""
+        with self.lock:
+            self.load()
+            if self.presets.pop(preset_id, None) is None:
+                return False
+            del self.settings[preset_id]
+            self.save()
+        return True
+
+    def start_settings(self, preset_id, body=None):
+        """
+        The settings to start `preset_id` with, or None for an unknown preset.
+        The default preset takes its settings from the request `body`.
+        Raises ValueError for an invalid body.
+        """
+        if preset_id == DEFAULT_PRESET:
+            return parse_body(json.dumps(body, sort_keys=True))
+        with self.lock:
+            self.load()
+            return self.settings.get(preset_id)
+
+
+preset_store = PresetStore()
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from flask import request
+import app.config as config
+import app.utils as utils
+from app.bus import EventBus, event_bus
+from app.engine import ShardedGenerator
+from app.events import DEFAULT_HOSTNAME
+from app.filtering import FilteredGenerator, create_stage
+from app.generator import EventGenerator, DEFAULT_SETTINGS
+from app.mqtt import mqtt_publisher, create_publisher
+from app.mqtt import validate_config as validate_mqtt_config
+from app.reflist import ReferenceCursor
+from app.replay import ReplayGenerator
+from app.simulation import SimulatedGenerator
+from app.state import ReaderState
+from app.webhook import WebhookPublisher, webhook_publisher
+from app.webhook import validate_config as validate_webhook_config
+
+SERIAL_NUMBER = "370-17-16-0022"
+
+# WSGI environ key under which the fleet middleware passes the addressed reader
+READER_ENVIRON_KEY = "emulator.reader"
+
+logger = logging.getLogger(__name__)
+
+
+def no_sleep(seconds):
+    pass
+
+
+class Reader:
+    """
+    One emulated reader: identity, reference list cursor and event bus,
+    whose ReaderState holds the streaming flag and settings snapshots,
+    plus MQTT and webhook publishers that are only created once
+    configured. A reader takes about 1 KB idle and 2 KB streaming, so a
+    fleet of thousands fits in one process.
+    """
+    __slots__ = ("name", "serial", "hostname", "port", "bus", "workers", "mqtt", "webhook", "cursor")
+
+    def __init__(self, name, serial, hostname, bus=None, mqtt=None, webhook=None, port=None, workers=None):
+        self.name = name
+        self.serial = serial
+        self.hostname = hostname
+        self.port = port
+        self.bus = bus or EventBus(ReaderState())
+        # Fleet readers share generation workers instead of running a thread each
+        self.workers = workers
+        self.mqtt = mqtt
+        self.webhook = webhook
+        self.cursor = ReferenceCursor()
+
+    @property
+    def state(self):
+        return self.bus.state
+
+    @property
+    def streaming(self):
+        return self.state.streaming
+
+    @property
+    def mqtt_config(self):
+        return self.state.mqtt_config
+
+    @property
+    def webhook_config(self):
+        return self.state.webhook_config
+
+    @property
+    def generator_settings(self):
+        return self.state.generator_settings or DEFAULT_SETTINGS
+
+    def start(self, settings):
+        """
+        Start a run with the given generator settings, rewinding the reference
+        lists. A run with a `durationSeconds` setting stops itself after it.
+        """
+        lists = utils.refresh_epc_lists()
+        with self.state.lock:
+            settings = self.state.swap("generator_settings", settings)
+            self.cursor = ReferenceCursor(lists.epc_list, lists.unique_epc_list)
+            self.state.streaming = True
+            self.bus.start(self.create_generator(settings), self.workers)
+            run = self.bus.run
+        if settings.get("durationSeconds"):
+            timer = threading.Timer(settings["durationSeconds"], self.stop_run, (run,))
+            timer.daemon = True
+            timer.start()
+        utils.compile_stale_lists(reload_lists)
+
+    def create_generator(self, settings):
+        """The event source for `settings`, behind the filtering stage when one is configured."""
+        sleep = no_sleep if self.workers else time.sleep
+        if settings.get("replay"):
+            event_generator = ReplayGenerator(settings, self.hostname, sleep=sleep)
+        elif settings.get("simulation"):
+            event_generator = SimulatedGenerator(settings, self.cursor, self.hostname, sleep=sleep)
+        elif self.workers is None and config.generation_processes and not settings.get("filter"):
+            # Filtering needs the raw reads, which worker processes only return encoded
+            event_generator = ShardedGenerator(settings, self.cursor, self.hostname,
+                                               processes=config.generation_processes)
+        else:
+            event_generator = EventGenerator(settings, self.cursor, self.hostname, sleep=sleep)
+        if settings.get("filter"):
+            event_generator = FilteredGenerator(event_generator, create_stage(settings["filter"], self.hostname,
+                                                                              settings.get("reportFields")))
+        return event_generator
+
+    def stop(self):
+        self.state.streaming = False
+
+    def stop_run(self, run):
+        """Stop the run numbered `run`, unless another run was started since."""
+        with self.state.lock:
+            if self.bus.run == run:
+                self.stop()
+
+    def configure_mqtt(self, mqtt_config):
+        """
+        Swap in new MQTT settings; the running publisher picks them up with
+        its next batch and its connection reconnects only if the broker,
+        session, credential or will settings changed.
+        """
+        with self.state.lock:
+            mqtt_config = self.state.swap("mqtt_config", mqtt_config)
+            if self.mqtt is None:
+                if not mqtt_config.get('active', False):
+                    return
+                self.mqtt = create_publisher(self.name, self.bus)
+            self.mqtt.configure(mqtt_config)
+
+    def configure_webhook(self, webhook_config):
+        """Swap in new webhook settings; the running publisher picks them up with its next batch."""
+        with self.state.lock:
+            webhook_config = self.state.swap("webhook_config", webhook_config)
+            if self.webhook is None:
+                if not webhook_config.get('active', False):
+                    return
+                self.webhook = WebhookPublisher(self.bus, self.name)
+            self.webhook.configure(webhook_config)
+
+    def save_settings(self):
+        """Persist the default reader's settings; fleet reader settings are kept in memory only."""
+        if self is default_reader:
+            with self.state.lock:
+                utils.save_settings(self.mqtt_config, self.webhook_config)
+
+    def load_settings(self):
+        """Restore the saved MQTT and webhook settings, skipping any that no longer validate."""
+        try:
+            mqtt_config, webhook_config = utils.load_settings()
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable settings file: %s", e)
+            return
+        for name, saved, validate, configure in (("MQTT", mqtt_config, validate_mqtt_config, self.configure_mqtt),
+                                                 ("webhook", webhook_config, validate_webhook_config,
+                                                  self.configure_webhook)):
+            try:
+                validate(saved)
+            except ValueError as e:
+                logger.warning("Ignoring saved %s settings: %s", name, e)
+                continue
+            configure(saved)
+
+    def mqtt_connected(self):
+        return self.mqtt is not None and self.mqtt.client.is_connected()
+
+    def generator_stats(self):
+        if self.bus.generator is None:
+            return {"settings": self.generator_settings}
+        return self.bus.generator.stats()
+
+
+default_reader = Reader("default", SERIAL_NUMBER, DEFAULT_HOSTNAME, bus=event_bus,
+                        mqtt=mqtt_publisher, webhook=webhook_publisher)
+default_reader.load_settings()
+
+# Fleet readers by name and by dedicated port; the default reader is not listed
+readers = {}
+readers_by_port = {}
+
+
+def all_readers():
+    return [default_reader] + list(readers.values())
+
+
+def register(reader):
+    readers[reader.name] = reader
+    if reader.port:
+        readers_by_port[reader.port] = reader
+
+
+def current_reader():
+    """The reader addressed by the current request."""
+    return request.environ.get(READER_ENVIRON_KEY, default_reader)
+
+
+def reload_lists(file_name=None):
+    """Hand reference lists converted in the background to every reader's cursor."""
+    lists = utils.init_epc_lists()
+    for reader in all_readers():
+        reader.cursor.update(lists.epc_list, lists.unique_epc_list)
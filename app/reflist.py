@@ -0,0 +1,646 @@
+import base64
+import bisect
+import logging
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.epc import EPC_BYTES
+
+HEX_CHARS = EPC_BYTES * 2
+B64_CHARS = EPC_BYTES * 4 // 3
+
+# Records are encoded to base64/hex lazily, one block at a time
+BLOCK_RECORDS = 4096
+CACHED_BLOCKS = 256
+
+# Text files are converted in chunks of roughly this many bytes
+TEXT_CHUNK_BYTES = 1 << 20
+
+BINARY_EXTENSION = ".epc"
+LOG_EXTENSION = ".log"
+
+# Change log entries: an operation, a record count and the packed records
+LOG_HEADER = struct.Struct("<cI")
+LOG_ADD = b"+"
+LOG_REMOVE = b"-"
+# The log is folded into the binary list once it outgrows both of these
+COMPACT_MIN_BYTES = 1 << 20
+COMPACT_RATIO = 1 / 64
+# Replayed records are found in the list by hashing it against a table of this many buckets, in chunks
+LOCATE_BUCKETS = 1 << 20
+LOCATE_CHUNK_RECORDS = 1 << 20
+
+EPC_PATTERN = re.compile(r"[0-9A-Fa-f]{%d}" % HEX_CHARS)
+
+# Text lists currently being converted to the binary format, and lists being compacted
+compiling = set()
+compacting = set()
+compile_lock = threading.RLock()
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hex_lines(lines):
+    """
+    Pack reference list lines into 12-byte EPC records. Only the first
+    24 hex digits of a line are used; blank or malformed lines are skipped.
+    """
+    epcs = [line.strip()[:HEX_CHARS] for line in lines]
+    epcs = [epc for epc in epcs if epc]
+    try:
+        packed = bytes.fromhex("".join(epcs))
+        if len(packed) == len(epcs) * EPC_BYTES:
+            return packed
+    except ValueError:
+        pass
+    # Slow path, only taken when the list contains invalid entries
+    records = bytearray()
+    for epc in epcs:
+        try:
+            record = bytes.fromhex(epc)
+        except ValueError:
+            continue
+        if len(record) == EPC_BYTES:
+            records += record
+    return bytes(records)
+
+
+def invalid_epcs(epcs):
+    """
+    Return the entries that do not start with 24 hex digits. Longer entries
+    are valid; only their first 96 bits are stored.
+    """
+    return [epc for epc in epcs if not EPC_PATTERN.match(epc.strip())]
+
+
+def binary_file_name(file_name):
+    """Path of the fixed-width binary form of a reference list text file."""
+    return os.path.splitext(file_name)[0] + BINARY_EXTENSION
+
+
+def log_file_name(file_name):
+    """Path of the change log of a reference list text file."""
+    return os.path.splitext(file_name)[0] + LOG_EXTENSION
+
+
+def split_records(packed):
+    return [packed[offset:offset + EPC_BYTES] for offset in range(0, len(packed), EPC_BYTES)]
+
+
+def compile_text_list(file_name):
+    """Convert a text reference list into the binary format, chunk by chunk."""
+    binary_file = binary_file_name(file_name)
+    temp_file = f"{binary_file}.{os.getpid()}.tmp"
+    with compile_lock:
+        with open(file_name, 'r') as src, open(temp_file, 'wb') as dst:
+            while True:
+                lines = src.readlines(TEXT_CHUNK_BYTES)
+                if not lines:
+                    break
+                dst.write(parse_hex_lines(lines))
+        os.replace(temp_file, binary_file)
+    return binary_file
+
+
+def needs_compile(file_name):
+    """True when the text list is newer than its binary form (or has none)."""
+    binary_file = binary_file_name(file_name)
+    return os.path.exists(file_name) and (
+        not os.path.exists(binary_file) or os.path.getmtime(file_name) > os.path.getmtime(binary_file))
+
+
+def is_compiling(file_name):
+    with compile_lock:
+        return file_name in compiling
+
+
+def compile_in_background(file_name, on_done=None):
+    """
+    Convert a text list on a background thread so that large files never
+    hold up a request. `on_done(file_name)` is called once the binary file
+    is in place. Returns the thread, or None if a conversion is already
+    running.
+    """
+    with compile_lock:
+        if file_name in compiling:
+            return None
+        compiling.add(file_name)
+
+    def run():
+        try:
+            with compile_lock:
+                # The list may have been replaced through the API meanwhile
+                if needs_compile(file_name):
+                    compile_text_list(file_name)
+        except OSError as e:
+            logger.error("Error converting reference list %s: %s", file_name, e)
+            return
+        finally:
+            with compile_lock:
+                compiling.discard(file_name)
+        if on_done is not None:
+            on_done(file_name)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def write_list(file_name, epcs):
+    """Replace a reference list with `epcs`; the text source is dropped."""
+    write_records(file_name, parse_hex_lines(epcs))
+
+
+def write_records(file_name, packed):
+    """Replace a reference list with packed records; the text source and change log are dropped."""
+    temp_file = binary_file_name(file_name) + ".tmp"
+    with compile_lock:
+        with open(temp_file, 'wb') as f:
+            f.write(packed)
+        install_records(file_name, temp_file)
+
+
+def install_records(file_name, temp_file, append=False):
+    """
+    Replace a reference list with a file of packed records, dropping the
+    text source and change log, or append the file's records to it. The
+    file is consumed either way.
+    """
+    binary_file = binary_file_name(file_name)
+    with compile_lock:
+        if not append:
+            os.replace(temp_file, binary_file)
+            for path in (file_name, log_file_name(file_name)):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        prepare_append(file_name)
+        with open(temp_file, 'rb') as src, open(binary_file, 'ab') as dst:
+            shutil.copyfileobj(src, dst, TEXT_CHUNK_BYTES)
+        os.remove(temp_file)
+
+
+def prepare_append(file_name):
+    # Appending is a write, so a pending text edit is converted first
+    if needs_compile(file_name):
+        compile_text_list(file_name)
+    # and logged changes are folded in, so they stay ahead of the new records
+    if os.path.exists(log_file_name(file_name)):
+        compact_list(file_name)
+
+
+def append_list(file_name, epcs):
+    with compile_lock:
+        prepare_append(file_name)
+        with open(binary_file_name(file_name), 'ab') as f:
+            f.write(parse_hex_lines(epcs))
+
+
+def delete_list(file_name):
+    with compile_lock:
+        for path in (file_name, binary_file_name(file_name), log_file_name(file_name)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def append_log(file_name, added, removed):
+    """Record the records a delta removed and then added in the change log, returning its size."""
+    entries = []
+    for operation, packed in ((LOG_REMOVE, removed), (LOG_ADD, added)):
+        if packed:
+            entries += [LOG_HEADER.pack(operation, len(packed) // EPC_BYTES), packed]
+    with compile_lock:
+        with open(log_file_name(file_name), 'ab') as f:
+            f.write(b"".join(entries))
+            return f.tell()
+
+
+def read_log(data):
+    """Yield the (operation, packed records) entries of a change log, ignoring a torn last entry."""
+    offset = 0
+    while offset + LOG_HEADER.size <= len(data):
+        operation, count = LOG_HEADER.unpack_from(data, offset)
+        end = offset + LOG_HEADER.size + count * EPC_BYTES
+        if end > len(data):
+            break
+        yield operation, data[offset + LOG_HEADER.size:end]
+        offset = end
+
+
+def bucket_of(words):
+    """Hash bucket of each record, given as rows of three 32-bit words."""
+    return (words[:, 0] ^ words[:, 1] ^ words[:, 2]) & (LOCATE_BUCKETS - 1)
+
+
+def locate(packed, count, records):
+    """
+    Slots of those of the set `records` that are among the first `count`
+    packed records, the last slot of a duplicate. The list is hashed
+    against a bucket table of `records` in one vectorized pass, and only
+    records in a hit bucket are compared, so a few records are found in a
+    memory-mapped list of millions without building an index of it.
+    """
+    slots = {}
+    if not records or not count:
+        return slots
+    table = np.zeros(LOCATE_BUCKETS, dtype=bool)
+    table[bucket_of(np.frombuffer(b"".join(records), dtype='<u4').reshape(-1, 3))] = True
+    words = np.frombuffer(packed, dtype='<u4', count=count * 3).reshape(count, 3)
+    for start in range(0, count, LOCATE_CHUNK_RECORDS):
+        hits = np.flatnonzero(table[bucket_of(words[start:start + LOCATE_CHUNK_RECORDS])]) + start
+        for slot in hits.tolist():
+            record = bytes(packed[slot * EPC_BYTES:(slot + 1) * EPC_BYTES])
+            if record in records:
+                slots[record] = slot
+    return slots
+
+
+def needs_compaction(file_name, log_size):
+    binary_file = binary_file_name(file_name)
+    base_size = os.path.getsize(binary_file) if os.path.exists(binary_file) else 0
+    return log_size >= COMPACT_MIN_BYTES and log_size >= base_size * COMPACT_RATIO
+
+
+def compact_list(file_name):
+    """
+    Fold the change log into the binary list. The list is rebuilt from the
+    log as it was when compaction started; changes logged meanwhile are
+    carried over into a fresh log.
+    """
+    binary_file = binary_file_name(file_name)
+    log_file = log_file_name(file_name)
+    with compile_lock:
+        if not os.path.exists(log_file):
+            return
+        logged = os.path.getsize(log_file)
+        base = os.stat(binary_file) if os.path.exists(binary_file) else None
+    store = ReferenceStore.load(file_name, logged)
+    temp_file = f"{binary_file}.{os.getpid()}.compact"
+    chunk = TEXT_CHUNK_BYTES // EPC_BYTES
+    with open(temp_file, 'wb') as f:
+        for start in range(0, len(store), chunk):
+            f.write(store.records(start, chunk))
+    with compile_lock:
+        current = os.stat(binary_file) if os.path.exists(binary_file) else None
+        if (current and (current.st_ino, current.st_mtime_ns)) != (base and (base.st_ino, base.st_mtime_ns)) \
+                or not os.path.exists(log_file) or os.path.getsize(log_file) < logged:
+            # The list was replaced or deleted meanwhile
+            os.remove(temp_file)
+            return
+        with open(log_file, 'rb') as f:
+            f.seek(logged)
+            tail = f.read()
+        os.replace(temp_file, binary_file)
+        if tail:
+            with open(log_file + ".tmp", 'wb') as f:
+                f.write(tail)
+            os.replace(log_file + ".tmp", log_file)
+        else:
+            os.remove(log_file)
+
+
+def compact_in_background(file_name, on_done=None):
+    """
+    Compact a list's change log on a background thread, calling
+    `on_done(file_name)` when done. Returns the thread, or None if a
+    compaction is already running.
+    """
+    with compile_lock:
+        if file_name in compacting:
+            return None
+        compacting.add(file_name)
+
+    def run():
+        try:
+            compact_list(file_name)
+        except OSError as e:
+            logger.error("Error compacting reference list %s: %s", file_name, e)
+            return
+        finally:
+            with compile_lock:
+                compacting.discard(file_name)
+        if on_done is not None:
+            on_done(file_name)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+class ReferenceStore:
+    """
+    Reference list backed by packed 12-byte records, either in memory or
+    memory-mapped from the binary list file. Records are base64/hex encoded
+    in blocks on first access and kept in a bounded cache, so multi-million
+    EPC lists are opened instantly and never materialized as Python strings.
+
+    The store is also the live list: `apply` and `replace` change it in
+    place under its lock, so cursors reading it see each delta whole and
+    from their next batch on. The first change copies the records into
+    memory and builds a hash index of them, used to dedupe added EPCs and
+    find removed ones. A store opened with a `file_name` persists deltas
+    to the list's append-only change log, which `load` replays as an
+    overlay of the slots the log changed, so reopening a changed list
+    keeps it memory-mapped.
+    """
+
+    def __init__(self, packed, file_name=None):
+        self.packed = packed
+        self.count = len(packed) // EPC_BYTES
+        self.file_name = file_name
+        self.index = None
+        # Replayed changes: {slot: record} over the first `base_count` records of `packed`, and beyond them
+        self.overlay = None
+        self.patched = []
+        self.base_count = self.count
+        # Bumped by every change, so blocks encoded meanwhile are not cached
+        self.version = 0
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_lines(cls, lines):
+        return cls(parse_hex_lines(lines))
+
+    @classmethod
+    def load(cls, file_name, log_bytes=None):
+        """
+        Open the binary form of a reference list with its change log
+        replayed (up to `log_bytes` of it), or return None if neither
+        exists. Never converts or writes anything.
+        """
+        binary_file = binary_file_name(file_name)
+        log_file = log_file_name(file_name)
+        if not os.path.exists(binary_file):
+            if not os.path.exists(log_file):
+                return None
+            store = cls(b"", file_name)
+        else:
+            with open(binary_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < EPC_BYTES:
+                    store = cls(b"", file_name)
+                else:
+                    store = cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), file_name)
+        if os.path.exists(log_file):
+            with open(log_file, 'rb') as f:
+                data = f.read() if log_bytes is None else f.read(log_bytes)
+            with store.lock:
+                store._replay(list(read_log(data)))
+        return store
+
+    def _replay(self, entries):
+        """
+        Apply change log entries as apply() did, but only tracking the
+        slots they change, over a list that stays as loaded. Holds the lock.
+        """
+        index = locate(self.packed, self.count, {record for _, packed in entries
+                                                  for record in split_records(packed)})
+        overlay = {}
+        count = self.count
+        for operation, packed in entries:
+            for record in split_records(packed):
+                if operation == LOG_ADD:
+                    if record not in index:
+                        index[record] = count
+                        overlay[count] = record
+                        count += 1
+                    continue
+                slot = index.pop(record, None)
+                if slot is None:
+                    continue
+                last = count - 1
+                if slot != last:
+                    moved = overlay.get(last) or bytes(self.packed[last * EPC_BYTES:count * EPC_BYTES])
+                    overlay[slot] = moved
+                    if index.get(moved) == last:
+                        index[moved] = slot
+                overlay.pop(last, None)
+                count = last
+        self.base_count = min(self.count, count)
+        self.count = count
+        if overlay:
+            self.overlay = overlay
+            self.patched = sorted(slot for slot in overlay if slot < self.base_count)
+            self.changed()
+
+    def _slice(self, start, end):
+        """Packed records [start, end), with the replayed changes. Holds the lock."""
+        end = min(end, self.count)
+        if self.overlay is None:
+            return self.packed[start * EPC_BYTES:end * EPC_BYTES]
+        base_end = max(start, min(end, self.base_count))
+        data = bytearray(self.packed[start * EPC_BYTES:base_end * EPC_BYTES])
+        for slot in self.patched[bisect.bisect_left(self.patched, start):bisect.bisect_left(self.patched, base_end)]:
+            data[(slot - start) * EPC_BYTES:(slot - start + 1) * EPC_BYTES] = self.overlay[slot]
+        data += b"".join([self.overlay[slot] for slot in range(max(start, self.base_count), end)])
+        return data
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        with self.lock:
+            return bytes(self._slice(index, index + 1))
+
+    def records(self, start, count):
+        """Return up to `count` packed records from `start`."""
+        with self.lock:
+            return bytes(self._slice(start, start + count))
+
+    def apply(self, added=b"", removed=b""):
+        """
+        Remove and then add packed records, ignoring added EPCs already in
+        the list and removed ones that are not. A removed record's slot is
+        filled with the last record, so removing costs O(delta) as well.
+        Returns the counts of the delta and the new list size.
+        """
+        with compile_lock:
+            with self.lock:
+                removed = self._remove(removed)
+                added = self._add(added)
+                size = self.count
+            if self.file_name and (added or removed):
+                append_log(self.file_name, added, removed)
+        return {"added": len(added) // EPC_BYTES, "removed": len(removed) // EPC_BYTES, "size": size}
+
+    def replace(self, packed):
+        """Replace the whole list with the distinct records of `packed`, rewriting its file."""
+        distinct = b"".join(dict.fromkeys(split_records(packed)))
+        with compile_lock:
+            if self.file_name:
+                write_records(self.file_name, distinct)
+            with self.lock:
+                self.packed = bytearray(distinct)
+                self.count = len(distinct) // EPC_BYTES
+                self.index = None
+                self.overlay = None
+                self.changed()
+        return {"added": self.count, "removed": 0, "size": self.count}
+
+    def _writable(self):
+        if self.index is None:
+            packed = bytes(self._slice(0, self.count))
+            # Duplicates already in the list resolve to their last slot
+            self.index = dict(zip(split_records(packed), range(self.count)))
+            self.packed = bytearray(packed)
+            self.overlay = None
+        return self.packed, self.index
+
+    def _add(self, packed):
+        """Append the new distinct records of `packed`, returning them packed. Holds the lock."""
+        records, index = self._writable()
+        added = []
+        for record in split_records(bytes(packed)):
+            if record not in index:
+                index[record] = self.count + len(added)
+                added.append(record)
+        if not added:
+            return b""
+        self.count += len(added)
+        added = b"".join(added)
+        records += added
+        self.changed()
+        return added
+
+    def _remove(self, packed):
+        """Remove the records of `packed` that are in the list, returning them packed. Holds the lock."""
+        records, index = self._writable()
+        removed = []
+        for record in split_records(bytes(packed)):
+            slot = index.pop(record, None)
+            if slot is None:
+                continue
+            last = self.count - 1
+            if slot != last:
+                moved = bytes(records[last * EPC_BYTES:])
+                records[slot * EPC_BYTES:(slot + 1) * EPC_BYTES] = moved
+                if index.get(moved) == last:
+                    index[moved] = slot
+            del records[last * EPC_BYTES:]
+            self.count = last
+            removed.append(record)
+        if removed:
+            self.changed()
+        return b"".join(removed)
+
+    def changed(self):
+        self.version += 1
+        self.blocks.clear()
+
+    def _block(self, block):
+        start = block * BLOCK_RECORDS
+        with self.lock:
+            encoded = self.blocks.get(block)
+            if encoded is not None:
+                self.blocks.move_to_end(block)
+                return encoded
+            raw = bytes(self._slice(start, start + BLOCK_RECORDS))
+            version = self.version
+        encoded = (base64.b64encode(raw).decode('ascii'), raw.hex().upper())
+        with self.lock:
+            if version == self.version:
+                self.blocks[block] = encoded
+            if len(self.blocks) > CACHED_BLOCKS:
+                self.blocks.popitem(last=False)
+        return encoded
+
+    def pair(self, index):
+        b64, hex_ = self._block(index // BLOCK_RECORDS)
+        offset = index % BLOCK_RECORDS
+        return (b64[offset * B64_CHARS:(offset + 1) * B64_CHARS],
+                hex_[offset * HEX_CHARS:(offset + 1) * HEX_CHARS])
+
+    def pairs(self, start, count):
+        """Return the (b64, hex) pairs of up to `count` records from `start`."""
+        stop = min(start + count, self.count)
+        pairs = []
+        while start < stop:
+            block, offset = divmod(start, BLOCK_RECORDS)
+            end = min(stop - start + offset, BLOCK_RECORDS)
+            b64, hex_ = self._block(block)
+            pairs += [(b64[i * B64_CHARS:(i + 1) * B64_CHARS], hex_[i * HEX_CHARS:(i + 1) * HEX_CHARS])
+                      for i in range(offset, end)]
+            start += end - offset
+        return pairs
+
+    def iter_hex(self, start=0, stop=None):
+        """Lazily yield the hex EPCs of records [start, stop) in block-sized lists."""
+        stop = self.count if stop is None else min(stop, self.count)
+        while start < stop:
+            end = min(stop, start + BLOCK_RECORDS)
+            with self.lock:
+                hex_ = self._slice(start, end).hex().upper()
+            yield [hex_[i:i + HEX_CHARS] for i in range(0, len(hex_), HEX_CHARS)]
+            start = end
+
+
+class ReferenceCursor:
+    """
+    Walks the unique list once, then cycles through the default list.
+    Neither step touches the filesystem or parses anything.
+    """
+
+    def __init__(self, default_store=None, unique_store=None):
+        self.default_store = default_store
+        self.unique_store = unique_store
+        self.reset()
+
+    def reset(self):
+        self.index = 0
+        self.unique_sent = not self.unique_store
+
+    def update(self, default_store, unique_store):
+        """
+        Swap in reloaded lists without rewinding the run. A unique list that
+        appears mid-run is sent from its start.
+        """
+        if unique_store and not self.unique_store:
+            self.index = 0
+            self.unique_sent = False
+        self.unique_store = unique_store
+        self.default_store = default_store
+
+    def _advance(self, count):
+        """
+        Move the cursor over up to `count` records, returning the
+        (store, start, count) runs it passed.
+        """
+        runs = []
+        taken = 0
+        unique_store, store = self.unique_store, self.default_store
+        if not self.unique_sent and unique_store:
+            # The list may have shrunk under the cursor
+            taken = max(0, min(count, len(unique_store) - self.index))
+            runs.append((unique_store, self.index, taken))
+            self.index += taken
+            if self.index >= len(unique_store):
+                self.unique_sent = True
+                self.index = 0
+        if store:
+            while taken < count:
+                if self.index >= len(store):
+                    self.index = 0
+                chunk = min(count - taken, len(store) - self.index)
+                runs.append((store, self.index, chunk))
+                self.index += chunk
+                taken += chunk
+        return runs
+
+    def next_pairs(self, count):
+        """
+        Return up to `count` (b64, hex) pairs. Any shortfall is filled with
+        random EPCs by the caller, as when no reference list is loaded.
+        """
+        pairs = []
+        for store, start, chunk in self._advance(count):
+            pairs += store.pairs(start, chunk)
+        return pairs
+
+    def next_records(self, count):
+        """Like next_pairs, but return the packed 12-byte records."""
+        return b"".join(store.records(start, chunk) for store, start, chunk in self._advance(count))
@@ -0,0 +1,207 @@
+import calendar
+import gzip
+import io
+import os
+import re
+import time
+from app.events import EncodedEvent, format_timestamp
+from app.pacing import RateMeter, MAX_SLEEP_SECONDS
+
+# Traces are read from this directory, relative to the working directory
+REPLAY_DIRECTORY = os.getenv('REPLAY_DIRECTORY', 'traces')
+GZIP_MAGIC = b"\x1f\x8b"
+TRACE_READ_BUFFER = 1024 * 1024
+
+DEFAULT_REPLAY = {
+    "file": None,
+    "speed": 1.0,
+    "loop": False
+}
+
+# The top-level timestamp of a captured event, e.g. "2024-03-01T12:00:00.123456Z"
+TIMESTAMP_PATTERN = re.compile(rb'"timestamp"\s*:\s*"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?Z?"')
+
+
+def parse_replay(data):
+    """Validate the `replay` generator settings, returning a new settings dict."""
+    if not isinstance(data, dict):
+        raise ValueError("replay must be an object")
+    settings = dict(DEFAULT_REPLAY)
+    file_name = data.get("file")
+    if not isinstance(file_name, str) or not file_name:
+        raise ValueError("replay.file must name a trace file")
+    trace_path(file_name)
+    settings["file"] = file_name
+    if "speed" in data:
+        speed = data["speed"]
+        if isinstance(speed, bool) or not isinstance(speed, (int, float)) or speed < 0:
+            raise ValueError("replay.speed must be a number >= 0 (0 replays as fast as possible)")
+        settings["speed"] = speed
+    if "loop" in data:
+        if not isinstance(data["loop"], bool):
+            raise ValueError("replay.loop must be a boolean")
+        settings["loop"] = data["loop"]
+    return settings
+
+
+def trace_path(file_name):
+    """Path of a trace file, which must exist inside REPLAY_DIRECTORY."""
+    directory = os.path.realpath(REPLAY_DIRECTORY)
+    path = os.path.realpath(os.path.join(directory, file_name))
+    if os.path.commonpath([directory, path]) != directory or not os.path.isfile(path):
+        raise ValueError(f"replay.file must be a file in {REPLAY_DIRECTORY}")
+    return path
+
+
+def open_trace(path):
+    """Open a JSONL trace for streaming, decompressing it on the fly when gzip-compressed."""
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    if compressed:
+        return io.BufferedReader(gzip.open(path, 'rb'), TRACE_READ_BUFFER)
+    return open(path, 'rb', buffering=TRACE_READ_BUFFER)
+
+
+class TimestampParser:
+    """Parses ISO 8601 UTC timestamps, converting the date and time part once per second."""
+
+    def __init__(self):
+        self.prefix = None
+        self.seconds = 0
+
+    def __call__(self, prefix, fraction):
+        if prefix != self.prefix:
+            self.seconds = calendar.timegm(time.strptime(prefix.decode('ascii'), "%Y-%m-%dT%H:%M:%S"))
+            self.prefix = prefix
+        return self.seconds + (float(fraction) if fraction else 0.0)
+
+
+def render_timestamp(seconds, fraction):
+    """A rewritten timestamp, with microseconds when the captured one had a fraction."""
+    text = format_timestamp(seconds)
+    if not fraction:
+        return text.encode('ascii')
+    return f"{text[:-1]}.{int(seconds % 1 * 1000000):06d}Z".encode('ascii')
+
+
+class ReplayGenerator:
+    """
+    Event source that re-emits a captured reader event log (JSONL, one
+    event per line, optionally gzip-compressed). The file is streamed line
+    by line, so traces of any size replay in constant memory. Events are
+    released when their original offset from the first event, divided by
+    `speed`, has elapsed (speed 0 releases them as fast as possible), and
+    their timestamps are rewritten to the time of the replay. The rest of
+    each line is passed on unchanged, without decoding the JSON.
+    """
+
+    def __init__(self, settings, hostname=None, sleep=time.sleep, clock=time.monotonic, wall_clock=time.time):
+        replay = settings["replay"]
+        self.settings = settings
+        self.path = trace_path(replay["file"])
+        self.speed = replay["speed"]
+        self.loop = replay["loop"]
+        self.max_batch = settings["maxBatchSize"]
+        self.hostname = hostname
+        self.sleep = sleep
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.parse_timestamp = TimestampParser()
+        self.last_render = (None, None, b"")
+        self.meter = RateMeter(clock=clock)
+        self.replayed = 0
+        self.skipped = 0
+        self.passes = 0
+        self.finished = False
+        self.trace = None
+        self.pending = None
+        self.rewind()
+
+    def rewind(self):
+        if self.trace is not None:
+            self.trace.close()
+        self.trace = open_trace(self.path)
+        self.passes += 1
+        self.first_offset = None
+        self.last_offset = 0.0
+        self.started = self.clock()
+        self.wall_started = self.wall_clock()
+
+    def read(self):
+        """Next (offset, line, timestamp match) of the trace, or None at its end."""
+        for line in self.trace:
+            line = line.strip()
+            if not line.startswith(b"{"):
+                self.skipped += bool(line)
+                continue
+            match = TIMESTAMP_PATTERN.search(line)
+            if match is None:
+                offset = self.last_offset
+            else:
+                offset = self.parse_timestamp(match.group(1), match.group(2))
+                if self.first_offset is None:
+                    self.first_offset = offset
+                offset -= self.first_offset
+            self.last_offset = offset
+            return offset, line, match
+        return None
+
+    def due_at(self, offset):
+        """Seconds since the start of this pass at which an event at `offset` is released."""
+        return offset / self.speed if self.speed else 0.0
+
+    def due_in(self):
+        if self.finished:
+            return MAX_SLEEP_SECONDS
+        if self.pending is None:
+            return 0.0
+        return max(0.0, self.started + self.due_at(self.pending[0]) - self.clock())
+
+    def next_batch(self):
+        """Return the captured events that are due now (possibly none)."""
+        if self.finished:
+            self.sleep(MAX_SLEEP_SECONDS)
+            return []
+        if self.pending is None:
+            self.pending = self.read()
+            if self.pending is None:
+                return self.end_of_trace()
+        delay = self.due_in()
+        if delay > 0:
+            self.sleep(min(delay, MAX_SLEEP_SECONDS))
+            if delay > MAX_SLEEP_SECONDS:
+                return []
+        elapsed = self.clock() - self.started
+        now = self.wall_clock()
+        events = []
+        while self.pending is not None and len(events) < self.max_batch and self.due_at(self.pending[0]) <= elapsed:
+            events.append(self.rewrite(now, *self.pending))
+            self.pending = self.read()
+        self.replayed += len(events)
+        self.meter.add(len(events))
+        return events
+
+    def rewrite(self, now, offset, line, match):
+        """The captured event, stamped with its replay time (`now` when replaying as fast as possible)."""
+        if match is not None:
+            seconds = self.wall_started + offset / self.speed if self.speed else now
+            fraction = match.group(2)
+            # Consecutive reads usually share their timestamp
+            if (seconds, bool(fraction)) != self.last_render[:2]:
+                self.last_render = (seconds, bool(fraction), render_timestamp(seconds, fraction))
+            line = line[:match.start(1)] + self.last_render[2] + line[match.end() - 1:]
+        return EncodedEvent(line, self.hostname)
+
+    def end_of_trace(self):
+        if self.loop and self.replayed:
+            self.rewind()
+        else:
+            self.finished = True
+            self.trace.close()
+        return []
+
+    def stats(self):
+        stats = {"settings": self.settings, "mode": "replay", "eventsReplayed": self.replayed,
+                 "linesSkipped": self.skipped, "passes": self.passes, "finished": self.finished}
+        stats.update(self.meter.to_dict())
+        return stats
@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify
+from app.reader import readers
+
+fleet_bp = Blueprint('fleet', __name__)
+
+@fleet_bp.route('/fleet/readers', methods=['GET'])
+def get_fleet_readers():
+    """
+    List the virtual readers of the fleet.
+    ---
+    responses:
+      200:
+        description: Fleet readers. Each reader serves the reader API under /readers/<name> and, when configured, on its own port.
+    """
+    return jsonify([{
+        "name": reader.name,
+        "serialNumber": reader.serial,
+        "hostname": reader.hostname,
+        "port": reader.port,
+        "status": "running" if reader.streaming else "idle"
+    } for reader in readers.values()])
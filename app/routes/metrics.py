@@ -0,0 +1,38 @@
+from flask import Blueprint, Response
+from app.metrics import registry, CONTENT_TYPE
+from app.reader import all_readers
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def buffer_occupancy():
+    occupancy = {}
+    for reader in all_readers():
+        for buffer in reader.bus.subscribers:
+            key = (buffer.sink,)
+            occupancy[key] = occupancy.get(key, 0) + len(buffer)
+    return occupancy
+
+
+def mqtt_in_flight():
+    return {(reader.name,): len(reader.mqtt.inflight) for reader in all_readers() if reader.mqtt is not None}
+
+
+registry.gauge_function("emulator_buffer_events", "Events waiting in the sink buffers.", ("sink",),
+                        buffer_occupancy)
+registry.gauge_function("emulator_mqtt_in_flight_messages", "MQTT messages awaiting acknowledgement.",
+                        ("reader",), mqtt_in_flight)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Get the emulator metrics in the Prometheus text format.
+    ---
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Counters and histograms of generated and delivered events, latencies and buffers
+    """
+    return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -1,7 +1,7 @@
 from flask import Blueprint, jsonify, request
 from flask_restful import Api, Resource
-from app.utils import save_settings, mqtt_config
-from app.mqtt import start_mqtt_thread
+from app.mqtt import validate_config
+from app.reader import current_reader
 
 mqtt_settings_bp = Blueprint('mqtt_settings', __name__)
 api = Api(mqtt_settings_bp)
@@ -15,7 +15,7 @@ class MqttSettings(Resource):
           200:
             description: MQTT settings
         """
-        return jsonify(mqtt_config)
+        return jsonify(current_reader().mqtt_config)
     
     def put(self):
         """
@@ -43,8 +43,26 @@ class MqttSettings(Resource):
                   type: string
                 disconnectMessage:
                   type: string
+                eventBatchSize:
+                  type: integer
+                  description: Events per MQTT message (emulator extension, default 1)
                 eventBufferSize:
                   type: integer
+                reportFields:
+                  type: array
+                  items:
+                    type: string
+                  description: Fields the events report, e.g. [epcHex, antennaPort] (emulator extension, default all)
+                eventSpill:
+                  type: object
+                  description: Disk-backed queue behind the event buffer (emulator extension)
+                  properties:
+                    active:
+                      type: boolean
+                    maxBytes:
+                      type: integer
+                    segmentBytes:
+                      type: integer
                 eventPendingDeliveryLimit:
                   type: integer
                 eventPerSecondLimit:
@@ -68,27 +86,19 @@ class MqttSettings(Resource):
         responses:
           204:
             description: MQTT settings updated
+          400:
+            description: Invalid settings
         """
-        global mqtt_config, mqtt_client
         data = request.get_json()
         mqtt_config = {key: value for key, value in data.items() if value is not None and value != ""}
-        
-        # Apply MQTT configuration
-        mqtt_client = mqtt.Client(client_id=mqtt_config.get('clientId', ''), clean_session=mqtt_config.get('cleanSession', True))
-        
-        if mqtt_config.get('username'):
-            mqtt_client.username_pw_set(mqtt_config['username'], mqtt_config.get('password', ''))
-        
-        if mqtt_config.get('tlsEnabled', False):
-            mqtt_client.tls_set()
-        
-        if 'willMessage' in mqtt_config and 'willTopic' in mqtt_config:
-            mqtt_client.will_set(mqtt_config['willTopic'], mqtt_config['willMessage'], qos=mqtt_config.get('willQualityOfService', 0))
-        
-        if mqtt_config.get('active', False):
-            start_mqtt_thread(mqtt_config)
-        
-        save_settings()
+        try:
+            validate_config(mqtt_config)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        # The publisher's connection applies the settings, reconnecting only when it has to
+        reader = current_reader()
+        reader.configure_mqtt(mqtt_config)
+        reader.save_settings()
         return '', 204
 
 api.add_resource(MqttSettings, '/api/v1/mqtt')
@@ -1,5 +1,7 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_restful import Api, Resource
+from app.generator import DEFAULT_SETTINGS
+from app.presets import DEFAULT_PRESET, preset_store
 
 profiles_bp = Blueprint('profiles', __name__)
 api = Api(profiles_bp)
@@ -15,6 +17,92 @@ class Profiles(Resource):
         """
         return jsonify(["inventory", "location", "direction"])
 
+class InventoryPresets(Resource):
+    def get(self):
+        """
+        List the inventory presets.
+        ---
+        responses:
+          200:
+            description: Preset ids, starting with the built-in default preset
+        """
+        return jsonify(preset_store.ids())
+
+class InventoryPreset(Resource):
+    def get(self, preset_id):
+        """
+        Get an inventory preset.
+        ---
+        parameters:
+          - in: path
+            name: preset_id
+            required: true
+            type: string
+        responses:
+          200:
+            description: Preset definition
+          404:
+            description: Preset not found
+        """
+        if preset_id == DEFAULT_PRESET:
+            return jsonify(DEFAULT_SETTINGS)
+        preset = preset_store.get(preset_id)
+        if preset is None:
+            return '', 404
+        return jsonify(preset)
+
+    def put(self, preset_id):
+        """
+        Create or replace an inventory preset. It is validated once here,
+        so starting it later skips validation.
+        ---
+        parameters:
+          - in: path
+            name: preset_id
+            required: true
+            type: string
+          - in: body
+            name: body
+            required: true
+            description: The generator settings of POST /api/v1/profiles/inventory/presets/default/start, plus an optional description
+            schema:
+              type: object
+              properties:
+                description:
+                  type: string
+        responses:
+          201:
+            description: Preset created
+          204:
+            description: Preset replaced
+          400:
+            description: Invalid preset
+        """
+        try:
+            created = preset_store.put(preset_id, request.get_json(silent=True))
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        return '', 201 if created else 204
+
+    def delete(self, preset_id):
+        """
+        Delete an inventory preset.
+        ---
+        parameters:
+          - in: path
+            name: preset_id
+            required: true
+            type: string
+        responses:
+          204:
+            description: Preset deleted
+          404:
+            description: Preset not found
+        """
+        if not preset_store.delete(preset_id):
+            return '', 404
+        return '', 204
+
 class StopProfile(Resource):
     def post(self):
         """
@@ -27,4 +115,6 @@ class StopProfile(Resource):
         return '', 204
 
 api.add_resource(Profiles, '/api/v1/profiles')
+api.add_resource(InventoryPresets, '/api/v1/profiles/inventory/presets')
+api.add_resource(InventoryPreset, '/api/v1/profiles/inventory/presets/<string:preset_id>')
 api.add_resource(StopProfile, '/api/v1/profiles/stop')
@@ -1,6 +1,11 @@
-from flask import Blueprint, jsonify, request, abort
+import gzip
+import json
+from flask import Blueprint, Response, request, abort, stream_with_context
 from flask_restful import Api, Resource
-import os
+from app import utils
+from app.reader import reload_lists
+from app.reflist import write_list, append_list, delete_list, invalid_epcs, is_compiling, parse_hex_lines
+from app.upload import UPLOAD_FORMATS, body_chunks, upload_list
 
 reference_lists_bp = Blueprint('reference_lists', __name__)
 api = Api(reference_lists_bp)
@@ -8,23 +13,95 @@ api = Api(reference_lists_bp)
 REFERENCE_LIST_FILE = "reference-list.txt"
 REFERENCE_LIST_UNIQUE_FILE = "reference-list-unique.txt"
 
-def read_file(file_name):
-    if os.path.exists(file_name):
-        with open(file_name, 'r') as f:
-            return [line.strip() for line in f.readlines()]
-    return []
+def stream_file(file_name, offset=0, limit=None):
+    """Stream a page of the open reference list as a JSON array."""
+    lists = utils.refresh_epc_lists()
+    store = lists.epc_list if file_name == REFERENCE_LIST_FILE else lists.unique_epc_list
+    total = len(store) if store else 0
+    stop = total if limit is None else min(total, offset + limit)
+
+    def generate():
+        yield "["
+        separator = ""
+        if store:
+            for epcs in store.iter_hex(offset, stop):
+                yield separator + ",".join(f'"{epc}"' for epc in epcs)
+                separator = ","
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype='application/json',
+                    headers={'X-Total-Count': str(total)})
 
 def write_file(file_name, content):
-    with open(file_name, 'w') as f:
-        f.write("\n".join(content) + "\n")
+    write_list(file_name, content)
+    reload_lists()
 
 def append_to_file(file_name, content):
-    with open(file_name, 'a') as f:
-        f.write("\n".join(content) + "\n")
+    append_list(file_name, content)
+    reload_lists()
 
 def delete_file(file_name):
-    if os.path.exists(file_name):
-        os.remove(file_name)
+    delete_list(file_name)
+    reload_lists()
+
+def is_gzipped():
+    return request.headers.get('Content-Encoding', '').lower() == 'gzip'
+
+def json_body():
+    if not is_gzipped():
+        return request.get_json()
+    try:
+        return json.loads(gzip.decompress(request.get_data()))
+    except (OSError, EOFError, ValueError):
+        abort(400, description="Invalid gzip-compressed JSON body.")
+
+def upload_file(file_name, append):
+    """
+    Write a streamed newline-delimited or CSV body to the list, or return
+    None for JSON bodies.
+    """
+    if request.mimetype == 'application/json':
+        return None
+    upload_format = UPLOAD_FORMATS.get(request.mimetype)
+    if upload_format is None:
+        abort(415, description="Expected a JSON, newline-delimited (text/plain, application/x-ndjson) "
+                               "or CSV (text/csv) body.")
+    try:
+        result = upload_list(file_name, body_chunks(request.stream, is_gzipped()), upload_format, append)
+    except ValueError as e:
+        abort(400, description=str(e))
+    reload_lists()
+    return result, 200
+
+def is_epc_list(data):
+    return data and isinstance(data, list) and all(isinstance(epc, str) for epc in data)
+
+def validate_epc_list(data):
+    if not is_epc_list(data):
+        abort(400, description="Invalid data format. Expected a list of EPCs.")
+    invalid = invalid_epcs(data)
+    if invalid:
+        abort(400, description=f"{len(invalid)} invalid EPCs (first: {invalid[0]!r}). "
+                               "Each EPC must start with 24 hex digits.")
+
+def parse_delta(data):
+    """The packed (replace, add, remove) records of a delta body; replace is None when absent."""
+    if not isinstance(data, dict) or not data or set(data) - {"replace", "add", "remove"}:
+        abort(400, description="Invalid data format. Expected an object with add, remove and/or replace lists.")
+    packed = {}
+    for key in ("replace", "add", "remove"):
+        epcs = data.get(key)
+        if epcs is None:
+            packed[key] = None if key == "replace" else b""
+            continue
+        if not isinstance(epcs, list) or not all(isinstance(epc, str) for epc in epcs):
+            abort(400, description=f"Invalid data format. Expected {key} to be a list of EPCs.")
+        invalid = invalid_epcs(epcs)
+        if invalid:
+            abort(400, description=f"{len(invalid)} invalid EPCs in {key} (first: {invalid[0]!r}). "
+                                   "Each EPC must start with 24 hex digits.")
+        packed[key] = parse_hex_lines(epcs)
+    return packed["replace"], packed["add"], packed["remove"]
 
 class ReferenceList(Resource):
     def get(self, list_type):
@@ -40,18 +117,36 @@ class ReferenceList(Resource):
             enum: [default, unique]
             required: true
             description: The type of the reference list (default or unique).
+          - in: query
+            name: offset
+            type: integer
+            required: false
+            description: Index of the first EPC to return (default 0).
+          - in: query
+            name: limit
+            type: integer
+            required: false
+            description: Maximum number of EPCs to return (default all).
         responses:
           200:
-            description: The content of the reference list.
+            description: The content of the reference list, streamed. The total list size is returned in the X-Total-Count header.
             schema:
               type: array
               items:
                 type: string
           400:
-            description: Invalid list type.
+            description: Invalid list type or paging parameters.
+          503:
+            description: The list file was edited and is still being converted to the binary format.
         """
         file_name = REFERENCE_LIST_FILE if list_type == "default" else REFERENCE_LIST_UNIQUE_FILE
-        return jsonify(read_file(file_name))
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', None, type=int)
+        if offset < 0 or (limit is not None and limit < 0):
+            abort(400, description="offset and limit must be non-negative integers.")
+        if is_compiling(file_name):
+            return {"message": "The reference list is being converted, retry shortly."}, 503, {'Retry-After': '1'}
+        return stream_file(file_name, offset, limit)
 
     def post(self, list_type):
         """
@@ -73,18 +168,37 @@ class ReferenceList(Resource):
               items:
                 type: string
             required: true
-            description: The list of EPCs to create or update the reference list with.
+            description: The list of EPCs to create or update the reference list with. Each EPC must start with 24 hex digits; only the first 96 bits of longer EPCs are stored. Large lists can be streamed as one EPC per line (text/plain or application/x-ndjson) or as CSV with the EPC in the first column (text/csv), optionally with Content-Encoding gzip.
+        consumes:
+          - application/json
+          - text/plain
+          - application/x-ndjson
+          - text/csv
         responses:
+          200:
+            description: A streamed body was written. Invalid lines are skipped and counted.
+            schema:
+              type: object
+              properties:
+                accepted:
+                  type: integer
+                rejected:
+                  type: integer
+                firstRejected:
+                  type: string
           204:
             description: The reference list was created or updated successfully.
           400:
-            description: Invalid input format or list type.
+            description: Invalid input format, invalid EPCs in a JSON body, invalid gzip data or list type. Nothing is written.
+          415:
+            description: Unsupported content type.
         """
         file_name = REFERENCE_LIST_FILE if list_type == "default" else REFERENCE_LIST_UNIQUE_FILE
-        data = request.get_json()
-
-        if not data or not isinstance(data, list):
-            abort(400, description="Invalid data format. Expected a list of EPCs.")
+        uploaded = upload_file(file_name, append=False)
+        if uploaded is not None:
+            return uploaded
+        data = json_body()
+        validate_epc_list(data)
 
         write_file(file_name, data)
         return '', 204
@@ -109,22 +223,97 @@ class ReferenceList(Resource):
               items:
                 type: string
             required: true
-            description: The list of EPCs to append to the reference list.
+            description: The list of EPCs to append to the reference list. Each EPC must start with 24 hex digits; only the first 96 bits of longer EPCs are stored. Large lists can be streamed as one EPC per line (text/plain or application/x-ndjson) or as CSV with the EPC in the first column (text/csv), optionally with Content-Encoding gzip.
+        consumes:
+          - application/json
+          - text/plain
+          - application/x-ndjson
+          - text/csv
         responses:
+          200:
+            description: A streamed body was written. Invalid lines are skipped and counted.
+            schema:
+              type: object
+              properties:
+                accepted:
+                  type: integer
+                rejected:
+                  type: integer
+                firstRejected:
+                  type: string
           204:
             description: The EPCs were appended to the reference list successfully.
           400:
-            description: Invalid input format or list type.
+            description: Invalid input format, invalid EPCs in a JSON body, invalid gzip data or list type. Nothing is written.
+          415:
+            description: Unsupported content type.
         """
         file_name = REFERENCE_LIST_FILE if list_type == "default" else REFERENCE_LIST_UNIQUE_FILE
-        data = request.get_json()
-
-        if not data or not isinstance(data, list):
-            abort(400, description="Invalid data format. Expected a list of EPCs.")
+        uploaded = upload_file(file_name, append=True)
+        if uploaded is not None:
+            return uploaded
+        data = json_body()
+        validate_epc_list(data)
 
         append_to_file(file_name, data)
         return '', 204
 
+    def patch(self, list_type):
+        """
+        Change a reference list in place, also for running streams.
+        ---
+        tags:
+          - Reference List Management
+        parameters:
+          - in: path
+            name: list_type
+            type: string
+            enum: [default, unique]
+            required: true
+            description: The type of the reference list (default or unique).
+          - in: body
+            name: body
+            schema:
+              type: object
+              properties:
+                replace:
+                  type: array
+                  items:
+                    type: string
+                  description: EPCs replacing the whole list, applied first.
+                remove:
+                  type: array
+                  items:
+                    type: string
+                  description: EPCs to remove; EPCs not in the list are ignored.
+                add:
+                  type: array
+                  items:
+                    type: string
+                  description: EPCs to add, applied last; EPCs already in the list are ignored.
+            required: true
+        responses:
+          200:
+            description: The delta was applied.
+            schema:
+              type: object
+              properties:
+                added:
+                  type: integer
+                removed:
+                  type: integer
+                size:
+                  type: integer
+          400:
+            description: Invalid input format, invalid EPCs or list type. Nothing is changed.
+        """
+        file_name = REFERENCE_LIST_FILE if list_type == "default" else REFERENCE_LIST_UNIQUE_FILE
+        replace, added, removed = parse_delta(json_body())
+        result = utils.update_epc_list(file_name, replace, added, removed)
+        # A list created by the delta is handed to the readers' cursors
+        reload_lists()
+        return result, 200
+
     def delete(self, list_type):
         """
         Delete a reference list.
@@ -1,13 +1,9 @@
 from flask import Blueprint, jsonify
 from datetime import datetime
-from app.mqtt import mqtt_client
-import app.config as config
-from app.utils import streaming, mqtt_config, webhook_config, last_http_status, last_http_timestamp
+from app.reader import current_reader
 
 status_bp = Blueprint('status', __name__)
 
-SERIAL_NUMBER = "370-17-16-0022"
-
 @status_bp.route('/api/v1/status', methods=['GET'])
 def get_status():
     """
@@ -17,30 +13,35 @@ def get_status():
       200:
         description: Reader status
     """
+    reader = current_reader()
     current_time = datetime.utcnow().isoformat() + 'Z'
-    
-    print(f"streaming {config.streaming}") 
 
-     # Determine stream status
-    stream_status = "running" if config.streaming else "idle"
+    # Determine stream status
+    stream_status = "running" if reader.streaming else "idle"
     
     # Determine MQTT connection status
-    mqtt_status = "connected" if mqtt_client.is_connected() else "disconnected"
+    mqtt_status = "connected" if reader.mqtt_connected() else "disconnected"
     
     # Determine Webhook status
+    webhook = reader.webhook
     webhook_status = {
-        "status": "enabled" if webhook_config.get('active', False) else "disabled",
-        "httpStatusCode": last_http_status,
-        "timestamp": last_http_timestamp or current_time
+        "status": "enabled" if reader.webhook_config.get('active', False) else "disabled",
+        "httpStatusCode": webhook.last_http_status if webhook else 0,
+        "timestamp": (webhook and webhook.last_http_timestamp) or current_time
     }
     
     # Construct the response
     response = {
         "status": stream_status,
         "time": current_time,
-        "serialNumber": SERIAL_NUMBER,
+        "serialNumber": reader.serial,
+        "hostname": reader.hostname,
         "mqttBrokerConnectionStatus": mqtt_status,
-        "eventWebhookStatus": webhook_status
+        "eventWebhookStatus": webhook_status,
+        "eventGenerator": reader.generator_stats(),
+        "eventBus": reader.bus.stats(),
+        "mqttPublisher": reader.mqtt.stats() if reader.mqtt else None,
+        "webhookPublisher": webhook.stats() if webhook else None
     }
     
     return jsonify(response)
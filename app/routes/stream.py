@@ -1,43 +1,79 @@
+import logging
 from flask import Blueprint, Response, jsonify, request
 from flask_restful import Api, Resource
-import json
-import time
-import threading
-import os
-from app.utils import load_settings, save_settings, mqtt_config, webhook_config, epc_list, unique_epc_list, reference_list_file, reference_list_unique_file
-from app.mqtt import mqtt_client, start_mqtt_thread
-from app.events import TagEvent
-from app.epc import EPC
-import app.config as config
+from app.buffer import EventBuffer, DROP_OLDEST, OVERFLOW_POLICIES
+from app.events import encode_events, parse_report_fields
+from app.metrics import events_delivered
+from app.presets import preset_store
+from app.reader import current_reader
 
 stream_bp = Blueprint('stream', __name__)
 api = Api(stream_bp)
 
-# Initialize global variables
-epc_index = 0
-unique_epc_sent = False
+DEFAULT_STREAM_BUFFER_SIZE = 10000
+MAX_CHUNK_EVENTS = 1000
+
+logger = logging.getLogger(__name__)
+delivered = events_delivered.labels("sse")
+
+def format_events(events, fields=None):
+    """Render a batch of events, projected to `fields` if given, as one text/event-stream chunk."""
+    return b"".join([encoded + b"\n\n" for encoded in encode_events(events, fields)])
+
+def query_fields(value):
+    """The projection of a comma-separated reportFields query parameter, None for all fields."""
+    return parse_report_fields(value.split(",")) if value else None
 
 class DataStream(Resource):
     def get(self):
         """
         Get the streamed tag events.
         ---
+        parameters:
+          - in: query
+            name: bufferSize
+            type: integer
+            required: false
+            description: Events buffered for this client before the overflow policy applies (default 10000).
+          - in: query
+            name: overflow
+            type: string
+            enum: [drop-oldest, block, disconnect]
+            required: false
+            description: What happens when this client falls behind (default drop-oldest).
+          - in: query
+            name: reportFields
+            type: string
+            required: false
+            description: Comma-separated fields the events report, e.g. epcHex,antennaPort (default all).
         responses:
           200:
             description: Streamed tag events
+          400:
+            description: Invalid buffer settings or reportFields
         """
+        buffer_size = request.args.get('bufferSize', DEFAULT_STREAM_BUFFER_SIZE, type=int)
+        policy = request.args.get('overflow', DROP_OLDEST)
+        if buffer_size < 1 or policy not in OVERFLOW_POLICIES:
+            return {"message": f"bufferSize must be positive and overflow one of {', '.join(OVERFLOW_POLICIES)}"}, 400
+        try:
+            fields = query_fields(request.args.get('reportFields'))
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        reader = current_reader()
+
         def generate():
-            while config.streaming:
-                epc = get_next_epc()
-                if epc is None:
-                    break
-                event = TagEvent(epc)
-                event_data = event.to_dict()
-                yield f"{json.dumps(event_data)}\n\n"
-                if mqtt_config.get('active', False):
-                    mqtt_client.publish(mqtt_config.get('eventTopic', 'default/topic'), json.dumps(event_data), qos=mqtt_config.get('eventQualityOfService', 0))
-                time.sleep(2)  # Simulate delay between events
-                
+            subscription = reader.bus.subscribe(EventBuffer(buffer_size, policy))
+            try:
+                while reader.streaming and not subscription.closed:
+                    events = subscription.take(MAX_CHUNK_EVENTS, 0.25)
+                    if events:
+                        delivered.inc(len(events))
+                        yield format_events(events, fields)
+            finally:
+                reader.bus.unsubscribe(subscription)
+
         return Response(generate(), content_type='text/event-stream')
 
 class StartStream(Resource):
@@ -50,21 +86,108 @@ class StartStream(Resource):
             name: preset_id
             required: true
             type: string
+            description: default to start with the settings of the body, or the id of a stored preset
+          - in: body
+            name: body
+            required: false
+            description: Generator settings of the default preset; stored presets ignore the body
+            schema:
+              type: object
+              properties:
+                eventsPerSecond:
+                  type: number
+                  description: Target event rate (ignored in max mode)
+                mode:
+                  type: string
+                  enum: [fixed, burst, poisson, max]
+                burstSize:
+                  type: integer
+                  description: Events emitted together in burst mode
+                maxBatchSize:
+                  type: integer
+                  description: Upper bound of events emitted per generator wake-up
+                seed:
+                  type: integer
+                  description: Makes the generated tags reproducible; the same seed yields the same tags with any number of worker processes
+                durationSeconds:
+                  type: number
+                  description: Stop the run after this many seconds (default none)
+                antennas:
+                  type: array
+                  items:
+                    type: integer
+                  description: Antenna ports (1-32) the events are read on, in turn (default [1])
+                reportFields:
+                  type: array
+                  items:
+                    type: string
+                  description: Top-level and tagInventoryEvent fields the events report (default all)
+                simulation:
+                  type: object
+                  description: Simulate a tag population moving past the antennas instead of pacing events
+                  properties:
+                    tags:
+                      type: integer
+                      description: Tags in the field of view at any time (default 1000)
+                    antennas:
+                      type: integer
+                      description: Antennas spread over the field (default 4)
+                    readsPerSecond:
+                      type: number
+                      description: Reads per second of a tag in range of an antenna (default 4)
+                    dwellSeconds:
+                      type: number
+                      description: Mean time a tag takes to cross the field (default 10)
+                    maxReadsPerSecond:
+                      type: integer
+                      description: Reader read rate cap, 0 for none (default 0)
+                filter:
+                  type: object
+                  description: Filter duplicate reads or aggregate them before they reach the stream, MQTT and webhook
+                  properties:
+                    mode:
+                      type: string
+                      enum: [dedup, aggregate]
+                    key:
+                      type: string
+                      enum: [epc, epcAntenna]
+                    windowSeconds:
+                      type: number
+                      description: Reads of a reported tag are suppressed for this long in dedup mode (default 1)
+                    reportIntervalSeconds:
+                      type: number
+                      description: Interval of the summary events in aggregate mode (default 1)
+                replay:
+                  type: object
+                  description: Re-emit a captured event log (JSONL, optionally gzip-compressed) from the traces directory
+                  properties:
+                    file:
+                      type: string
+                      description: Trace file, relative to the traces directory
+                    speed:
+                      type: number
+                      description: 1 replays with the original timing, N N times faster, 0 as fast as possible (default 1)
+                    loop:
+                      type: boolean
+                      description: Start over at the end of the trace (default false)
         responses:
           204:
             description: Stream started
+          400:
+            description: Invalid generator settings
           404:
             description: Preset not found
         """
-        global epc_index, unique_epc_sent
-        print(f"preset_id {preset_id}")       
-        if preset_id == 'default': 
-            config.streaming = True  # Set streaming to True
-            print(f"streaming {config.streaming}")             
-            epc_index = 0
-            unique_epc_sent = False
-            return '', 204
-        return '', 404
+        try:
+            settings = preset_store.start_settings(preset_id, request.get_json(silent=True))
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        if settings is None:
+            return '', 404
+        reader = current_reader()
+        reader.start(settings)
+        logger.debug("Reader %s started preset %s", reader.name, preset_id)
+        return '', 204
 
 class StopStream(Resource):
     def post(self):
@@ -75,37 +198,9 @@ class StopStream(Resource):
           204:
             description: Stream stopped
         """
-        config.streaming = False  # Set streaming to False
+        current_reader().stop()
         return '', 204
 
-def get_next_epc():
-    global epc_index, unique_epc_sent
-    if os.path.exists(reference_list_unique_file) and not unique_epc_sent:
-        if epc_index < len(unique_epc_list):
-            epc = EPC()
-            epc.header = int(unique_epc_list[epc_index][0:2], 16)
-            epc.manager = int(unique_epc_list[epc_index][2:9], 16)
-            epc.class_ = int(unique_epc_list[epc_index][9:15], 16)
-            epc.serial = int(unique_epc_list[epc_index][15:24], 16)
-            epc_index += 1
-            if epc_index == len(unique_epc_list):
-                unique_epc_sent = True
-            return epc
-        else:
-            return None
-    elif os.path.exists(reference_list_file):
-        if epc_index >= len(epc_list):
-            epc_index = 0
-        epc = EPC()
-        epc.header = int(epc_list[epc_index][0:2], 16)
-        epc.manager = int(epc_list[epc_index][2:9], 16)
-        epc.class_ = int(epc_list[epc_index][9:15], 16)
-        epc.serial = int(epc_list[epc_index][15:24], 16)
-        epc_index += 1
-        return epc
-    else:
-        return EPC()
-
 api.add_resource(DataStream, '/api/v1/data/stream')
 api.add_resource(StartStream, '/api/v1/profiles/inventory/presets/<string:preset_id>/start')
 api.add_resource(StopStream, '/api/v1/profiles/stop')
\ No newline at end of file
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from flask_restful import Api, Resource
-from app.utils import save_settings, webhook_config
+from app.reader import current_reader
+from app.webhook import validate_config
 
 webhook_settings_bp = Blueprint('webhook_settings', __name__)
 api = Api(webhook_settings_bp)
@@ -14,7 +15,7 @@ class WebhookSettings(Resource):
           200:
             description: Webhook settings
         """
-        return jsonify(webhook_config)
+        return jsonify(current_reader().webhook_config)
     
     def put(self):
         """
@@ -34,8 +35,32 @@ class WebhookSettings(Resource):
                   type: integer
                 eventBufferSize:
                   type: integer
+                reportFields:
+                  type: array
+                  items:
+                    type: string
+                  description: Fields the events report, e.g. [epcHex, antennaPort] (emulator extension, default all)
+                eventSpill:
+                  type: object
+                  description: Disk-backed queue behind the event buffer (emulator extension)
+                  properties:
+                    active:
+                      type: boolean
+                    maxBytes:
+                      type: integer
+                    segmentBytes:
+                      type: integer
                 retry:
                   type: object
+                  properties:
+                    maxRetries:
+                      type: integer
+                    initialDelayMilliseconds:
+                      type: integer
+                    maxDelayMilliseconds:
+                      type: integer
+                    backoffMultiplier:
+                      type: number
                 serverConfiguration:
                   type: object
                   properties:
@@ -52,14 +77,24 @@ class WebhookSettings(Resource):
                       type: integer
                     tls:
                       type: object
+                    compression:
+                      type: string
+                      enum: [none, gzip]
         responses:
           204:
             description: Webhook settings updated
+          400:
+            description: Invalid settings
         """
-        global webhook_config
         data = request.get_json()
         webhook_config = {key: value for key, value in data.items() if value is not None and value != ""}
-        save_settings()
+        try:
+            validate_config(webhook_config)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+        reader = current_reader()
+        reader.configure_webhook(webhook_config)
+        reader.save_settings()
         return '', 204
 
 api.add_resource(WebhookSettings, '/api/v1/webhooks/event')
@@ -0,0 +1,74 @@
+import random
+import numpy as np
+from app.epc import EPC, EPC_BYTES
+
+# Random EPCs of a seeded stream are drawn in blocks of this many
+SEED_BLOCK_EPCS = 4096
+
+# Spawn keys of the independent streams derived from a run's seed
+STREAM_EPCS = 0
+STREAM_PACING = 1
+STREAM_SIMULATION = 2
+
+
+def seed_sequence(seed, *key):
+    """The child of `seed` at spawn key `key`, as SeedSequence.spawn would hand it out."""
+    return np.random.SeedSequence(seed, spawn_key=key)
+
+
+def numpy_rng(seed, stream):
+    """A NumPy Generator for one stream of `seed`, or None without a seed."""
+    if seed is None:
+        return None
+    return np.random.Generator(np.random.PCG64(seed_sequence(seed, stream)))
+
+
+def python_rng(seed, stream):
+    """A random.Random for one stream of `seed`, or None without a seed."""
+    if seed is None:
+        return None
+    return random.Random(int(seed_sequence(seed, stream).generate_state(2, np.uint64)[0]))
+
+
+class EpcStream:
+    """
+    Source of the random EPCs of a run. With a seed, the stream is cut into
+    blocks of SEED_BLOCK_EPCS, each drawn from a generator of its own
+    spawned seed, so the EPC at a position of the stream is the same
+    however the stream is split into batches, shards or worker processes.
+    Without a seed, EPCs are drawn from fresh entropy.
+    """
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.position = 0
+        self.cached = (None, b"")
+
+    def take(self, count):
+        """The next `count` EPCs, packed."""
+        return self.range(self.reserve(count), count)
+
+    def reserve(self, count):
+        """Skip the next `count` EPCs, returning their start position, for a worker to draw them with range()."""
+        start = self.position
+        self.position += count
+        return start
+
+    def range(self, start, count):
+        """The `count` EPCs from position `start`, packed."""
+        if self.seed is None:
+            return EPC.generate_batch(count)
+        parts = []
+        end = start + count
+        while start < end:
+            block, offset = divmod(start, SEED_BLOCK_EPCS)
+            taken = min(end - start, SEED_BLOCK_EPCS - offset)
+            parts.append(self.block(block)[offset * EPC_BYTES:(offset + taken) * EPC_BYTES])
+            start += taken
+        return b"".join(parts)
+
+    def block(self, number):
+        if self.cached[0] != number:
+            rng = np.random.Generator(np.random.PCG64(seed_sequence(self.seed, STREAM_EPCS, number)))
+            self.cached = (number, EPC.generate_batch(SEED_BLOCK_EPCS, rng=rng))
+        return self.cached[1]
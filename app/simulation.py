@@ -0,0 +1,180 @@
+import math
+import time
+import numpy as np
+from app.epc import EPC, EPC_BYTES
+from app.events import TagRead, projected, CHANNELS, FIRST_CHANNEL_KHZ, CHANNEL_SPACING_KHZ, DEFAULT_HOSTNAME
+from app.pacing import RateMeter, MAX_SLEEP_SECONDS
+from app.reflist import ReferenceCursor
+from app.seeding import numpy_rng, STREAM_SIMULATION
+
+# Tags cross a field of view of FIELD_LENGTH metres (a portal or conveyor) along x,
+# past antennas spread evenly over it and mounted ANTENNA_HEIGHT metres above them
+FIELD_LENGTH = 10.0
+ANTENNA_HEIGHT = 1.0
+MAX_LATERAL_OFFSET = 3.0
+
+# Log-distance path loss of the two-way link, reads below the sensitivity are lost
+RSSI_AT_1M = -40.0
+PATH_LOSS_EXPONENT = 4.0
+RSSI_SIGMA_DB = 2.0
+SENSITIVITY_DBM = -80.0
+PHASE_SIGMA_DEGREES = 3.0
+SPEED_OF_LIGHT = 299792458.0
+
+# The field is advanced in steps of this many seconds
+STEP_SECONDS = 0.05
+# A stalled loop catches up at most this much simulated time at once
+MAX_STEP_SECONDS = 1.0
+
+DEFAULT_SIMULATION = {
+    "tags": 1000,
+    "antennas": 4,
+    "readsPerSecond": 4.0,
+    "dwellSeconds": 10.0,
+    "maxReadsPerSecond": 0
+}
+
+
+def parse_simulation(data):
+    """Validate the `simulation` generator settings, returning a new settings dict."""
+    if not isinstance(data, dict):
+        raise ValueError("simulation must be an object")
+    simulation = dict(DEFAULT_SIMULATION)
+    for key, minimum, integer in (("tags", 1, True), ("antennas", 1, True), ("readsPerSecond", 0, False),
+                                  ("dwellSeconds", 0.1, False), ("maxReadsPerSecond", 0, True)):
+        if key in data:
+            value = data[key]
+            if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)) or value < minimum:
+                raise ValueError(f"simulation.{key} must be {'an integer' if integer else 'a number'} >= {minimum}")
+            simulation[key] = value
+    return simulation
+
+
+class TagField:
+    """
+    Vectorized model of a tag population moving through the field of view
+    of several antennas. Every step moves all tags at once, replaces the
+    tags that left the field with new ones entering it (churn), and draws
+    which tag/antenna pairs were read together with each read's RSSI,
+    phase and hop channel. Nothing in a step loops over tags in Python.
+    """
+
+    def __init__(self, tags=1000, antennas=4, reads_per_second=4.0, dwell=10.0, max_reads_per_second=0,
+                 cursor=None, rng=None):
+        self.rng = rng or np.random.default_rng()
+        self.cursor = cursor or ReferenceCursor()
+        self.count = tags
+        self.reads_per_second = reads_per_second
+        self.mean_speed = FIELD_LENGTH / dwell
+        self.max_reads_per_second = max_reads_per_second
+        self.antenna_x = (np.arange(antennas) + 0.5) * FIELD_LENGTH / antennas
+        self.epcs = np.empty(tags, dtype="V12")
+        self.x = np.empty(tags)
+        self.lateral = np.empty(tags)
+        self.speed = np.empty(tags)
+        # The initial population is spread over the whole field
+        self.enter(np.arange(tags))
+        self.x = self.rng.uniform(0, FIELD_LENGTH, tags)
+        self.entered = 0
+        self.exited = 0
+
+    def enter(self, slots):
+        """Put new tags into `slots`, taking their EPCs from the reference lists when loaded."""
+        count = len(slots)
+        packed = self.cursor.next_records(count)
+        missing = count - len(packed) // EPC_BYTES
+        if missing:
+            packed += EPC.generate_batch(missing, rng=self.rng)
+        self.epcs[slots] = np.frombuffer(packed, dtype="V12")
+        self.lateral[slots] = self.rng.uniform(0.2, MAX_LATERAL_OFFSET, count) ** 2 + ANTENNA_HEIGHT ** 2
+        self.speed[slots] = self.mean_speed * self.rng.lognormal(0.0, 0.25, count)
+
+    def step(self, seconds):
+        """
+        Advance the field by `seconds` and return its reads as a tuple of
+        (packed EPCs, antenna ports, peak RSSI in cdBm, phase angles, channels).
+        """
+        self.x += self.speed * seconds
+        gone = np.flatnonzero(self.x >= FIELD_LENGTH)
+        if gone.size:
+            self.x[gone] -= FIELD_LENGTH
+            self.enter(gone)
+            self.entered += gone.size
+            self.exited += gone.size
+        # Antenna-major, as the reader cycles through its antennas
+        dx = self.antenna_x[:, None] - self.x[None, :]
+        distance = np.sqrt(dx * dx + self.lateral[None, :])
+        mean_rssi = RSSI_AT_1M - 10.0 * PATH_LOSS_EXPONENT * np.log10(distance)
+        probability = -math.expm1(-self.reads_per_second * seconds)
+        antenna, tag = np.nonzero((mean_rssi > SENSITIVITY_DBM) & (self.rng.random(mean_rssi.shape) < probability))
+        limit = int(self.max_reads_per_second * seconds) if self.max_reads_per_second else None
+        if limit is not None and antenna.size > limit:
+            keep = np.sort(self.rng.choice(antenna.size, limit, replace=False))
+            antenna, tag = antenna[keep], tag[keep]
+        count = antenna.size
+        rssi = mean_rssi[antenna, tag] + self.rng.normal(0.0, RSSI_SIGMA_DB, count)
+        channel = self.rng.integers(0, CHANNELS, count)
+        frequency = (FIRST_CHANNEL_KHZ + channel * CHANNEL_SPACING_KHZ) * 1000.0
+        phase = np.degrees(4 * np.pi * distance[antenna, tag] * frequency / SPEED_OF_LIGHT)
+        phase = (phase + self.rng.normal(0.0, PHASE_SIGMA_DEGREES, count)) % 360.0
+        return (self.epcs[tag].tobytes(), antenna + 1, np.rint(rssi * 100).astype(np.int64),
+                np.round(phase, 2), channel)
+
+    def stats(self):
+        return {"tags": self.count, "antennas": len(self.antenna_x), "tagsEntered": self.entered,
+                "tagsExited": self.exited}
+
+
+class SimulatedGenerator:
+    """
+    Event source backed by a TagField instead of a Pacer: every
+    STEP_SECONDS the field is advanced and its reads become events, so
+    the event rate follows from the population, read rates and antennas.
+    """
+
+    def __init__(self, settings, cursor=None, hostname=DEFAULT_HOSTNAME, sleep=time.sleep,
+                 clock=time.monotonic, rng=None):
+        simulation = settings["simulation"]
+        if rng is None:
+            rng = numpy_rng(settings.get("seed"), STREAM_SIMULATION)
+        self.settings = settings
+        self.hostname = hostname
+        # Antenna n of the field reads on the n-th configured port
+        self.ports = np.array((0,) + tuple(settings.get("antennas", range(1, simulation["antennas"] + 1))))
+        self.event_class = projected(TagRead, settings.get("reportFields"))
+        self.sleep = sleep
+        self.clock = clock
+        self.field = TagField(simulation["tags"], simulation["antennas"], simulation["readsPerSecond"],
+                              simulation["dwellSeconds"], simulation["maxReadsPerSecond"], cursor, rng)
+        self.meter = RateMeter(clock=clock)
+        self.last_step = clock()
+
+    def due_in(self):
+        return max(0.0, self.last_step + STEP_SECONDS - self.clock())
+
+    def next_batch(self):
+        """Return the reads of the next step, or none when it is not due yet."""
+        delay = self.due_in()
+        if delay > 0:
+            self.sleep(min(delay, MAX_SLEEP_SECONDS))
+            if delay > MAX_SLEEP_SECONDS:
+                return []
+        now = self.clock()
+        seconds = min(now - self.last_step, MAX_STEP_SECONDS)
+        if seconds <= 0:
+            return []
+        self.last_step = now
+        packed, antennas, rssi, phases, channels = self.field.step(seconds)
+        timestamp, hostname, event_class = time.time(), self.hostname, self.event_class
+        events = [event_class(packed[index * EPC_BYTES:(index + 1) * EPC_BYTES], antenna, timestamp, hostname,
+                              peak, phase, channel)
+                  for index, (antenna, peak, phase, channel)
+                  in enumerate(zip(self.ports[antennas].tolist(), rssi.tolist(), phases.tolist(), channels.tolist()))]
+        self.meter.add(len(events))
+        return events
+
+    def stats(self):
+        stats = {"settings": self.settings, "mode": "simulation"}
+        stats.update(self.field.stats())
+        stats.update(self.meter.to_dict())
+        return stats
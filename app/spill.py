@@ -0,0 +1,258 @@
+import os
+import struct
+from collections import deque
+from app.events import EncodedEvent
+
+# Spill queues live in SPILL_DIRECTORY/<reader>-<sink>, relative to the working directory
+SPILL_DIRECTORY = os.getenv('SPILL_DIRECTORY', 'spill')
+
+# Defaults for the `eventSpill` settings object of the MQTT and webhook settings
+DEFAULT_SPILL = {
+    "active": False,
+    "maxBytes": 1024 * 1024 * 1024,
+    "segmentBytes": 16 * 1024 * 1024
+}
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+# Largest sequential read when draining
+READ_BYTES = 1024 * 1024
+MIN_READ_BYTES = 64 * 1024
+# Each event is stored as its encoded length followed by the encoding
+RECORD_HEADER = struct.Struct("<I")
+
+
+def spill_settings(data):
+    """The `eventSpill` settings merged over the defaults, ignoring values that are not positive integers."""
+    settings = dict(DEFAULT_SPILL)
+    if isinstance(data, dict):
+        settings["active"] = data.get("active", False) is True
+        for key in ("maxBytes", "segmentBytes"):
+            value = data.get(key)
+            if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+                settings[key] = value
+    return settings
+
+
+def configure_spill(queue, name, data):
+    """
+    The spill queue of sink `name` for the `eventSpill` settings, or None
+    when spilling is off. An open queue is kept and only gets new limits.
+    Turning spilling off closes the queue but leaves its events on disk,
+    to be drained once it is turned on again.
+    """
+    settings = spill_settings(data)
+    if not settings["active"]:
+        if queue is not None:
+            queue.close()
+        return None
+    if queue is None:
+        return SpillQueue(os.path.join(SPILL_DIRECTORY, name), settings["maxBytes"], settings["segmentBytes"])
+    queue.set_limits(settings["maxBytes"], settings["segmentBytes"])
+    return queue
+
+
+class Segment:
+    __slots__ = ("number", "size", "events")
+
+    def __init__(self, number, size=0, events=0):
+        self.number = number
+        self.size = size
+        # Events not read yet
+        self.events = events
+
+
+class SpillQueue:
+    """
+    Append-only event queue on disk, made of numbered segment files of
+    length-prefixed encoded events. Each batch is appended with a single
+    write and draining reads the oldest segment sequentially in large
+    chunks; segments are deleted once read. When the queue outgrows
+    `max_bytes` its oldest segments are deleted and their events counted
+    as dropped, so disk usage stays bounded. The read position is kept in
+    a cursor file, so a queue reopened after a restart resumes where it
+    left off. Callers serialize access; EventBuffer does so with its lock.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_SPILL["maxBytes"], segment_bytes=DEFAULT_SPILL["segmentBytes"]):
+        self.directory = directory
+        self.segments = deque()
+        self.count = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.drained = 0
+        self.read_offset = 0
+        self.reader = None
+        self.writer = None
+        self.next_number = 0
+        self.set_limits(max_bytes, segment_bytes)
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def __len__(self):
+        return self.count
+
+    def set_limits(self, max_bytes, segment_bytes):
+        self.max_bytes = max_bytes
+        # Several segments fit in the limit, so dropping the oldest one frees room
+        self.segment_bytes = max(1, min(segment_bytes, max_bytes // 4))
+
+    def path(self, number):
+        return os.path.join(self.directory, f"{number:010d}{SEGMENT_SUFFIX}")
+
+    def load(self):
+        """Pick up the segments and read position left by a previous run."""
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                         if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        cursor_segment, cursor_offset = self.read_cursor()
+        for number in numbers:
+            if number < cursor_segment:
+                # Read before the previous run stopped
+                os.remove(self.path(number))
+                continue
+            start = cursor_offset if number == cursor_segment else 0
+            size, events = self.scan(number, start)
+            self.segments.append(Segment(number, size, events))
+            self.count += events
+            self.bytes += size
+        if self.segments:
+            head = self.segments[0]
+            self.read_offset = cursor_offset if head.number == cursor_segment else 0
+            self.next_number = self.segments[-1].number + 1
+        else:
+            self.next_number = cursor_segment
+
+    def scan(self, number, start):
+        """Size and unread event count of a segment, cutting off a record torn by a crash."""
+        path = self.path(number)
+        events = 0
+        offset = 0
+        with open(path, 'rb') as f:
+            data = f.read()
+        while offset + RECORD_HEADER.size <= len(data):
+            end = offset + RECORD_HEADER.size + RECORD_HEADER.unpack_from(data, offset)[0]
+            if end > len(data):
+                break
+            if offset >= start:
+                events += 1
+            offset = end
+        if offset < len(data):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return offset, events
+
+    def read_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                number, offset = f.read().split()
+            return int(number), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def write_cursor(self):
+        number = self.segments[0].number if self.segments else self.next_number
+        with open(os.path.join(self.directory, CURSOR_FILE), 'w') as f:
+            f.write(f"{number} {self.read_offset if self.segments else 0}")
+
+    def append(self, events):
+        """Append events, returning how many old events were dropped to stay within max_bytes."""
+        if not events:
+            return 0
+        pack = RECORD_HEADER.pack
+        encoded = [event.encode() for event in events]
+        data = b"".join([part for payload in encoded for part in (pack(len(payload)), payload)])
+        if not self.segments or self.writer is None or self.segments[-1].size >= self.segment_bytes:
+            self.roll()
+        segment = self.segments[-1]
+        self.writer.write(data)
+        self.writer.flush()
+        segment.size += len(data)
+        segment.events += len(events)
+        self.count += len(events)
+        self.bytes += len(data)
+        self.spilled += len(events)
+        dropped = 0
+        while self.bytes > self.max_bytes and len(self.segments) > 1:
+            dropped += self.remove_head()
+        self.dropped += dropped
+        if dropped:
+            self.write_cursor()
+        return dropped
+
+    def roll(self):
+        """Start a new segment for appending."""
+        if self.writer is not None:
+            self.writer.close()
+        self.segments.append(Segment(self.next_number))
+        self.writer = open(self.path(self.next_number), 'ab')
+        self.next_number += 1
+
+    def remove_head(self):
+        """Delete the oldest segment, returning how many of its events were not read."""
+        head = self.segments.popleft()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if not self.segments and self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        os.remove(self.path(head.number))
+        self.count -= head.events
+        self.bytes -= head.size
+        self.read_offset = 0
+        return head.events
+
+    def read(self, limit):
+        """Remove and return up to `limit` of the oldest events, as EncodedEvents."""
+        events = []
+        unpack_from = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        while len(events) < limit and self.segments:
+            head = self.segments[0]
+            if not head.events:
+                if head is self.segments[-1] and head.size < self.segment_bytes:
+                    # Appending goes on in this segment
+                    break
+                self.remove_head()
+                continue
+            if self.reader is None:
+                self.reader = open(self.path(head.number), 'rb')
+            wanted = min(limit - len(events), head.events)
+            average = (head.size - self.read_offset) // head.events + 1
+            self.reader.seek(self.read_offset)
+            data = self.reader.read(max(MIN_READ_BYTES, min(READ_BYTES, wanted * average)))
+            offset = 0
+            count = 0
+            while count < wanted and offset + header_size <= len(data):
+                end = offset + header_size + unpack_from(data, offset)[0]
+                if end > len(data):
+                    break
+                events.append(EncodedEvent(data[offset + header_size:end]))
+                offset = end
+                count += 1
+            if not count:
+                # A record larger than the read size
+                length = unpack_from(data, 0)[0]
+                self.reader.seek(self.read_offset + header_size)
+                events.append(EncodedEvent(self.reader.read(length)))
+                offset = header_size + length
+                count = 1
+            head.events -= count
+            self.read_offset += offset
+            self.count -= count
+            self.drained += count
+        if events:
+            self.write_cursor()
+        return events
+
+    def close(self):
+        for handle in (self.reader, self.writer):
+            if handle is not None:
+                handle.close()
+        self.reader = None
+        self.writer = None
+
+    def stats(self):
+        return {"spilled": self.count, "spillBytes": self.bytes, "spillDropped": self.dropped,
+                "spilledTotal": self.spilled, "drainedTotal": self.drained}
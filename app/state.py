@@ -0,0 +1,41 @@
+import copy
+import threading
+from collections import namedtuple
+
+# The open reference lists and the file signatures they were opened with
+ReferenceLists = namedtuple("ReferenceLists", ("epc_list", "unique_epc_list", "signatures"))
+
+
+class ReaderState:
+    """
+    Streaming flag and settings of one reader. Settings are published as
+    snapshots: a dict is never changed once set, only replaced as a whole,
+    so publishers and the event path read the current one without locking
+    and always see a consistent configuration. Writers hold `lock` while
+    they replace a snapshot and apply it.
+    """
+    __slots__ = ("streaming", "mqtt_config", "webhook_config", "generator_settings", "lock")
+
+    def __init__(self, generator_settings=None):
+        self.streaming = False
+        self.mqtt_config = {}
+        self.webhook_config = {}
+        self.generator_settings = generator_settings
+        self.lock = threading.RLock()
+
+    def swap(self, name, settings):
+        """Replace the `name` snapshot with a private copy of `settings`, returning the copy."""
+        snapshot = copy.deepcopy(settings)
+        setattr(self, name, snapshot)
+        return snapshot
+
+
+class SharedState:
+    """State shared by every reader of the process: the open reference lists."""
+
+    def __init__(self):
+        self.reference_lists = ReferenceLists(None, None, None)
+        self.lock = threading.RLock()
+
+
+shared_state = SharedState()
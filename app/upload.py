@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+import zlib
+from app.epc import EPC_BYTES
+from app.reflist import HEX_CHARS, binary_file_name, install_records
+
+# Request bodies are read, decompressed and parsed in chunks of this many bytes
+UPLOAD_CHUNK_BYTES = 1 << 20
+
+# How the lines of each streamed content type hold their EPC
+LINES = "lines"
+CSV = "csv"
+UPLOAD_FORMATS = {
+    "text/plain": LINES,
+    "application/x-ndjson": LINES,
+    "application/jsonl": LINES,
+    "text/csv": CSV,
+}
+
+# Whitespace and the quotes of NDJSON strings and quoted CSV fields
+FIELD_PADDING = b' \t\r"'
+EPC_FIELD = re.compile(rb"[0-9A-Fa-f]{%d}" % HEX_CHARS)
+
+
+def body_chunks(stream, gzipped=False, size=UPLOAD_CHUNK_BYTES):
+    """Yield the request body in chunks of at most `size` bytes, gunzipped if `gzipped`."""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if gzipped else None
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        if decompressor is None:
+            yield chunk
+            continue
+        try:
+            data = decompressor.decompress(chunk, size)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, size)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip body: {e}")
+    if decompressor is not None:
+        if not decompressor.eof:
+            raise ValueError("Invalid gzip body: truncated")
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+class UploadParser:
+    """
+    Packs the EPCs of a streamed upload into 12-byte records, one chunk of
+    lines at a time, so memory use does not grow with the upload. Each
+    non-blank line holds one EPC: as is or as a JSON string for newline-
+    delimited bodies, in the first column for CSV, where a first row that
+    is not an EPC is taken as the header. As for JSON uploads, an EPC must
+    start with 24 hex digits and only those are stored; other lines are
+    counted as rejected rather than failing the upload.
+    """
+
+    def __init__(self, upload_format=LINES):
+        self.csv = upload_format == CSV
+        self.header = self.csv
+        self.accepted = 0
+        self.rejected = 0
+        self.first_rejected = None
+
+    def records(self, chunks):
+        """Yield the packed records of the body `chunks`."""
+        partial = b""
+        for chunk in chunks:
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            if len(partial) > UPLOAD_CHUNK_BYTES:
+                # Not an EPC line, and not to be buffered without bound
+                lines.append(partial[:HEX_CHARS + 1])
+                partial = b""
+            packed = self.pack(lines)
+            if packed:
+                yield packed
+        packed = self.pack([partial])
+        if packed:
+            yield packed
+
+    def pack(self, lines):
+        if self.csv:
+            lines = [line.split(b",", 1)[0] for line in lines]
+        fields = [field for field in (line.strip(FIELD_PADDING) for line in lines) if field]
+        if self.header and fields:
+            self.header = False
+            if not EPC_FIELD.match(fields[0]):
+                fields = fields[1:]
+        epcs = [field[:HEX_CHARS] for field in fields]
+        try:
+            packed = bytes.fromhex(b"".join(epcs).decode('ascii'))
+            if len(packed) == len(epcs) * EPC_BYTES:
+                self.accepted += len(epcs)
+                return packed
+        except ValueError:
+            pass
+        # Slow path, only taken for chunks with invalid lines
+        records = []
+        for field, epc in zip(fields, epcs):
+            if EPC_FIELD.fullmatch(epc):
+                records.append(bytes.fromhex(epc.decode('ascii')))
+            else:
+                self.rejected += 1
+                if self.first_rejected is None:
+                    self.first_rejected = field[:64].decode('utf-8', 'replace')
+        self.accepted += len(records)
+        return b"".join(records)
+
+    def stats(self):
+        return {"accepted": self.accepted, "rejected": self.rejected, "firstRejected": self.first_rejected}
+
+
+def upload_list(file_name, chunks, upload_format=LINES, append=False):
+    """
+    Replace a reference list with the EPCs of a streamed upload, or append
+    them to it. The records are written to a side file as they are parsed
+    and only take effect once the whole body was read. Returns the
+    accepted and rejected counts. Raises ValueError for a malformed body.
+    """
+    parser = UploadParser(upload_format)
+    temp_file = f"{binary_file_name(file_name)}.{os.getpid()}.{threading.get_ident()}.upload"
+    try:
+        with open(temp_file, 'wb') as f:
+            for packed in parser.records(chunks):
+                f.write(packed)
+        install_records(file_name, temp_file, append)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return parser.stats()
@@ -1,83 +1,114 @@
 import json
+import logging
 import os
+from app.reflist import (ReferenceStore, binary_file_name, log_file_name, compile_in_background, compile_text_list,
+                         compact_in_background, needs_compaction, needs_compile)
+from app.state import ReferenceLists, shared_state
 
 SETTINGS_FILE = "settings.json"
 reference_list_file = "reference-list.txt"
 reference_list_unique_file = "reference-list-unique.txt"
-mqtt_config = {}
-webhook_config = {}
-epc_list = []
-unique_epc_list = []
 
-last_http_status = 0
-last_http_timestamp = None
-streaming = False
+logger = logging.getLogger(__name__)
 
 def load_settings():
-    global mqtt_config, webhook_config
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, 'r') as f:
-            settings = json.load(f)
-            mqtt_config = settings.get("mqtt_config", {})
-            webhook_config = settings.get("webhook_config", {})
-            print("Settings loaded from file")
+    """The saved (mqtt_config, webhook_config), empty when nothing was saved."""
+    if not os.path.exists(SETTINGS_FILE):
+        return {}, {}
+    with open(SETTINGS_FILE, 'r') as f:
+        settings = json.load(f)
+    logger.info("Settings loaded from file")
+    return settings.get("mqtt_config", {}), settings.get("webhook_config", {})
 
-def save_settings():
-    with open(SETTINGS_FILE, 'w') as f:
+def save_settings(mqtt_config, webhook_config):
+    # Written aside and renamed, so a concurrent reader never sees a partial file
+    temporary_file = SETTINGS_FILE + ".tmp"
+    with open(temporary_file, 'w') as f:
         settings = {
             "mqtt_config": mqtt_config,
             "webhook_config": webhook_config
         }
         json.dump(settings, f)
-        print("Settings saved to file")
+    os.replace(temporary_file, SETTINGS_FILE)
+    logger.info("Settings saved to file")
 
 def load_epc_list(file_name):
-    if os.path.exists(file_name):
-        with open(file_name, 'r') as f:
-            return [line.strip() for line in f.readlines()]
-    return []
+    return ReferenceStore.load(file_name)
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def list_signatures():
+    return [(file_signature(binary_file_name(file_name)), file_signature(log_file_name(file_name)))
+            for file_name in (reference_list_file, reference_list_unique_file)]
 
 def init_epc_lists():
-    global epc_list, unique_epc_list
-    epc_list = load_epc_list(reference_list_file)
-    unique_epc_list = load_epc_list(reference_list_unique_file)
+    """
+    Open the reference lists whose files changed and publish them to every
+    reader as one snapshot; unchanged lists are kept open as they are.
+    """
+    with shared_state.lock:
+        current = shared_state.reference_lists
+        signatures = list_signatures()
+        stores = []
+        for position, file_name in enumerate((reference_list_file, reference_list_unique_file)):
+            if current.signatures is not None and current.signatures[position] == signatures[position]:
+                stores.append(current[position])
+            else:
+                stores.append(load_epc_list(file_name))
+        shared_state.reference_lists = ReferenceLists(stores[0], stores[1], signatures)
+        return shared_state.reference_lists
+
+def refresh_epc_lists():
+    """
+    The current reference lists, reopened only if their files changed, so
+    readers share the open lists.
+    """
+    lists = shared_state.reference_lists
+    if lists.signatures is None or list_signatures() != lists.signatures:
+        lists = init_epc_lists()
+    return lists
+
+def adopt_signatures(file_name=None):
+    """Record the list files as current after the open lists wrote them themselves."""
+    with shared_state.lock:
+        shared_state.reference_lists = shared_state.reference_lists._replace(signatures=list_signatures())
+
+def update_epc_list(file_name, replace=None, added=b"", removed=b""):
+    """
+    Apply a delta of packed records to the open list of `file_name`: an
+    optional full replacement, then removals, then additions. The list
+    changes in place, so running streams pick it up without reopening the
+    file. Returns the counts of the delta and the new list size.
+    """
+    with shared_state.lock:
+        if needs_compile(file_name):
+            compile_text_list(file_name)
+        lists = refresh_epc_lists()
+        position = 0 if file_name == reference_list_file else 1
+        store = lists[position]
+        if store is None:
+            store = ReferenceStore(b"", file_name)
+            lists = lists._replace(**{lists._fields[position]: store})
+            shared_state.reference_lists = lists
+        result = {"added": 0, "removed": 0}
+        if replace is not None:
+            result = store.replace(replace)
+        delta = store.apply(added, removed)
+        result = {"added": result["added"] + delta["added"], "removed": result["removed"] + delta["removed"],
+                  "size": delta["size"]}
+        adopt_signatures()
+    log_file = log_file_name(file_name)
+    if os.path.exists(log_file) and needs_compaction(file_name, os.path.getsize(log_file)):
+        compact_in_background(file_name, adopt_signatures)
+    return result
 
-# Modify the webhook function to update these variables
-def webhook_publisher():
-    global last_http_status, last_http_timestamp
-    while True:
-        if webhook_config.get('active', False):
-            events = []
-            linger_ms = webhook_config.get('eventBatchLingerMilliseconds', 1000)
-            start_time = time.time()
-            while time.time() - start_time < linger_ms / 1000.0:
-                if not streaming and not events:
-                    break
-                if streaming:
-                    epc = get_next_epc()
-                    event = TagEvent(epc)
-                    events.append(event.to_dict())
-                time.sleep(0.1)  # Slight delay to simulate event collection
-            
-            if not events and not streaming:
-                events = []  # Send keepalive with empty list
-            
-            if events or not streaming:
-                try:
-                    url = webhook_config['serverConfiguration']['url']
-                    auth = webhook_config['serverConfiguration']['authentication']
-                    headers = {'Content-Type': 'application/json'}
-                    verify_ssl = webhook_config['serverConfiguration'].get('tls', {}).get('verify', True)
-                    response = requests.post(url, json=events, headers=headers, auth=(auth['username'], auth['password']), verify=verify_ssl)
-                    
-                    last_http_status = response.status_code
-                    last_http_timestamp = datetime.utcnow().isoformat() + 'Z'
-                    
-                    if response.status_code == 200:
-                        print("Events successfully sent to webhook")
-                    else:
-                        print(f"Failed to send events to webhook, status code: {response.status_code}, response: {response.text}")
-                except Exception as e:
-                    print(f"Error sending events to webhook: {e}")
-        else:
-            time.sleep(1)  # Sleep if webhook is not active
+def compile_stale_lists(on_done=None):
+    """Convert text lists edited since their last conversion, in the background."""
+    for file_name in (reference_list_file, reference_list_unique_file):
+        if needs_compile(file_name):
+            compile_in_background(file_name, on_done)
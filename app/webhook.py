@@ -0,0 +1,233 @@
+import gzip
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from app.buffer import EventBuffer, DROP_OLDEST, BLOCK
+from app.bus import event_bus
+from app.events import json_array, parse_report_fields
+from app.metrics import events_delivered, webhook_batch_size, webhook_latency
+from app.spill import configure_spill
+
+DEFAULT_BATCH_LIMIT = 10000
+DEFAULT_LINGER_MILLISECONDS = 1000
+DEFAULT_BUFFER_SIZE = 100000
+DEFAULT_TIMEOUT_SECONDS = 10
+MIN_KEEPALIVE_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+delivered_metric = events_delivered.labels("webhook")
+batch_size_metric = webhook_batch_size.labels()
+latency_metric = webhook_latency.labels()
+
+# Defaults for the `retry` settings object
+DEFAULT_RETRY = {
+    "maxRetries": 3,
+    "initialDelayMilliseconds": 100,
+    "maxDelayMilliseconds": 5000,
+    "backoffMultiplier": 2.0
+}
+
+# Numeric settings as (key, minimum, whether it must be an integer), at the top level and in `retry`
+NUMERIC_SETTINGS = (("eventBatchLimit", 1, True), ("eventBatchLingerMilliseconds", 0, False),
+                    ("eventBufferSize", 1, True))
+NUMERIC_RETRY_SETTINGS = (("maxRetries", 0, True), ("initialDelayMilliseconds", 0, False),
+                          ("maxDelayMilliseconds", 0, False), ("backoffMultiplier", 1, False))
+
+
+def validate_config(webhook_config):
+    """Check the types and ranges of the settings the publisher computes with. Raises ValueError."""
+    retry = webhook_config.get('retry')
+    if retry is not None and not isinstance(retry, dict):
+        raise ValueError("retry must be an object")
+    for settings, rules, prefix in ((webhook_config, NUMERIC_SETTINGS, ""),
+                                    (retry or {}, NUMERIC_RETRY_SETTINGS, "retry.")):
+        for key, minimum, integer in rules:
+            value = settings.get(key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)) or value < minimum:
+                raise ValueError(f"{prefix}{key} must be {'an integer' if integer else 'a number'} >= {minimum}")
+    if webhook_config.get('reportFields') is not None:
+        parse_report_fields(webhook_config['reportFields'])
+
+
+def is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class WebhookPublisher:
+    """
+    Delivers tag events from its event bus subscription to the configured
+    webhook URL in batches.
+    A batch is cut when eventBatchLimit events are queued or
+    eventBatchLingerMilliseconds have passed, whichever comes first; the
+    queue holds at most eventBufferSize events. Batches go out over a
+    pooled keep-alive session, optionally gzip-compressed, and failed
+    deliveries are retried with exponential backoff per the `retry` policy.
+    With `reportFields`, batches carry only those fields of each event.
+    With `eventSpill` active, events that overflow the buffer go to disk
+    and a batch that still fails is held and retried, so an outage of the
+    webhook loses nothing while the spill queue has room.
+    """
+
+    def __init__(self, bus=event_bus, name="default"):
+        self.bus = bus
+        self.name = name
+        self.config = {}
+        self.fields = None
+        self.buffer = EventBuffer(DEFAULT_BUFFER_SIZE, sink="webhook")
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.last_http_status = 0
+        self.last_http_timestamp = None
+        self.delivered = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_post = 0.0
+        self.threads = []
+
+    def configure(self, webhook_config):
+        self.config = webhook_config
+        fields = webhook_config.get('reportFields')
+        self.fields = parse_report_fields(fields) if fields else None
+        self.buffer.resize(webhook_config.get('eventBufferSize', DEFAULT_BUFFER_SIZE))
+        # Publishers keep their subscription, so only drop-oldest and block apply
+        self.buffer.policy = BLOCK if webhook_config.get('eventBufferOverflowPolicy') == BLOCK else DROP_OLDEST
+        self.buffer.spill_to(configure_spill(self.buffer.spill, f"{self.name}-webhook",
+                                             webhook_config.get('eventSpill')))
+        if webhook_config.get('active', False):
+            self.bus.subscribe(self.buffer)
+            self.start()
+        else:
+            self.bus.unsubscribe(self.buffer)
+
+    def start(self):
+        if self.threads:
+            return
+        thread = threading.Thread(target=self._send, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def offer(self, events):
+        self.buffer.offer(events)
+
+    def batch_limit(self):
+        return max(1, self.config.get('eventBatchLimit', DEFAULT_BATCH_LIMIT))
+
+    def linger_seconds(self):
+        return max(0, self.config.get('eventBatchLingerMilliseconds', DEFAULT_LINGER_MILLISECONDS)) / 1000.0
+
+    def retry_policy(self, webhook_config=None):
+        policy = dict(DEFAULT_RETRY)
+        policy.update((webhook_config or self.config).get('retry') or {})
+        return policy
+
+    def encode(self, events, server=None):
+        """Return the request body and headers for a batch of events."""
+        body = json_array(events, self.fields)
+        headers = {'Content-Type': 'application/json'}
+        if server is None:
+            server = self.config.get('serverConfiguration', {})
+        if server.get('compression') == 'gzip':
+            body = gzip.compress(body, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        return body, headers
+
+    def post(self, events, give_up=True):
+        """
+        Send one batch, retrying per the retry policy. Returns True on
+        success; a failed batch is counted as failed only if `give_up`.
+        """
+        # One settings snapshot for the whole batch, however often they are replaced meanwhile
+        webhook_config = self.config
+        server = webhook_config.get('serverConfiguration', {})
+        url = server.get('url')
+        if not url:
+            if give_up:
+                self.failed += len(events)
+            return False
+        auth = server.get('authentication') or {}
+        credentials = (auth['username'], auth.get('password', '')) if auth.get('username') else None
+        verify_ssl = (server.get('tls') or {}).get('verify', True)
+        body, headers = self.encode(events, server)
+        self.last_post = time.monotonic()
+        policy = self.retry_policy(webhook_config)
+        delay = policy['initialDelayMilliseconds'] / 1000.0
+        for attempt in range(max(0, policy['maxRetries']) + 1):
+            if attempt:
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * policy['backoffMultiplier'], policy['maxDelayMilliseconds'] / 1000.0)
+            try:
+                response = self.session.post(url, data=body, headers=headers, auth=credentials,
+                                             verify=verify_ssl, timeout=DEFAULT_TIMEOUT_SECONDS)
+            except requests.RequestException as e:
+                logger.warning("Error sending events to webhook: %s", e)
+                self.last_http_status = 0
+                continue
+            self.last_http_status = response.status_code
+            self.last_http_timestamp = datetime.utcnow().isoformat() + 'Z'
+            if response.ok:
+                self.batches += 1
+                self.delivered += len(events)
+                if events:
+                    delivered_metric.inc(len(events))
+                    batch_size_metric.observe(len(events))
+                    latency_metric.observe(time.monotonic() - self.last_post)
+                return True
+            if not is_retryable(response.status_code):
+                break
+        if not give_up:
+            logger.warning("Failed to send %d events to webhook, status code: %s; holding them",
+                           len(events), self.last_http_status)
+            return False
+        logger.error("Failed to send %d events to webhook, status code: %s", len(events), self.last_http_status)
+        self.failed += len(events)
+        return False
+
+    def _send(self):
+        held = []
+        while True:
+            if not self.config.get('active', False):
+                time.sleep(0.1)
+                continue
+            try:
+                held = self.send_batch(held)
+            except Exception:
+                # The thread outlives a bad batch or settings; there is no other sender
+                logger.exception("Error sending events to webhook")
+                time.sleep(0.1)
+
+    def send_batch(self, held):
+        """Send the held batch or the next one from the buffer, returning the batch to hold, if any."""
+        linger = self.linger_seconds()
+        if held:
+            events = held
+        else:
+            events = self.buffer.take_batch(self.batch_limit(), max(linger, 0.01))
+        if events:
+            spilling = self.buffer.spill is not None
+            if not self.post(events, give_up=not spilling) and spilling:
+                # New events back up to disk meanwhile
+                time.sleep(self.retry_policy()['maxDelayMilliseconds'] / 1000.0)
+                return events
+        elif not self.bus.state.streaming and time.monotonic() - self.last_post >= max(linger, MIN_KEEPALIVE_SECONDS):
+            # An empty batch is sent as a keepalive while no stream is running
+            self.post(events)
+        return []
+
+    def stats(self):
+        return {
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "batches": self.batches,
+            "dropped": self.buffer.dropped,
+            "buffered": len(self.buffer),
+            "spilled": len(self.buffer.spill) if self.buffer.spill is not None else 0
+        }
+
+webhook_publisher = WebhookPublisher()
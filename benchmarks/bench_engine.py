@@ -0,0 +1,41 @@
+"""
+Measure unpaced event generation in-process and on 1, 2, 4 and 8 worker
+processes. Each event is generated, JSON encoded and handed out, as the
+event bus would publish it.
+
+    python -m benchmarks.bench_engine [seconds]
+"""
+import sys
+import time
+from app.engine import ShardedGenerator
+from app.generator import EventGenerator, parse_settings
+
+SETTINGS = parse_settings({"mode": "max", "maxBatchSize": 20000})
+WORKER_COUNTS = (1, 2, 4, 8)
+
+
+def measure(event_generator, seconds):
+    # The first batches start the worker processes
+    for _ in range(3):
+        event_generator.next_batch()
+    total = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        events = event_generator.next_batch()
+        for event in events:
+            event.encode()
+        total += len(events)
+    return total / (time.perf_counter() - start)
+
+
+def main(seconds=3.0):
+    results = {"inProcess": measure(EventGenerator(SETTINGS), seconds)}
+    for processes in WORKER_COUNTS:
+        results[f"{processes} workers"] = measure(ShardedGenerator(SETTINGS, processes=processes), seconds)
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:>12,.0f} events/sec ({rate / results['inProcess']:.1f}x)")
+    return results
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0)
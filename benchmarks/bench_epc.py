@@ -0,0 +1,41 @@
+"""
+Compare per-object EPC generation/encoding with the batch API.
+
+    python -m benchmarks.bench_epc [count]
+"""
+import sys
+import time
+from app.epc import EPC
+
+
+def per_object(count):
+    return [(epc.b64(), epc.hex()) for epc in (EPC() for _ in range(count))]
+
+
+def batch(count):
+    return EPC.encode_batch(EPC.generate_batch(count))
+
+
+def measure(func, count, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(count)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+def main(count=100000):
+    results = {
+        "perObject": measure(per_object, count),
+        "batch": measure(batch, count),
+    }
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:>14,.0f} EPCs/sec")
+    print(f"   speedup: {results['batch'] / results['perObject']:.1f}x")
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
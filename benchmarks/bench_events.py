@@ -0,0 +1,81 @@
+"""
+Compare the previous event serialization path with the template path.
+
+The previous path built every event with time.strftime and nested dicts
+and encoded it with json.dumps once for SSE and once for MQTT. The new
+path stamps events from a per-second cache and renders them once from a
+pre-built template. When orjson is installed, dict encoding with it is
+measured as well. The projected path is a sink that only reports the hex
+EPC, rendered from its own template next to the full encoding.
+
+    python -m benchmarks.bench_events [count]
+"""
+import json
+import sys
+import time
+from app.epc import EPC, EPC_BYTES
+from app.events import events_from_records, json_array, orjson, parse_report_fields
+
+SLIM_FIELDS = parse_report_fields(["epcHex"])
+
+
+def legacy_event(epc_b64, epc_hex):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "hostname": "r700-emulator",
+        "eventType": "tagInventory",
+        "tagInventoryEvent": {"epc": epc_b64, "epcHex": epc_hex, "antennaPort": 1, "antennaName": "Antenna 1"}
+    }
+
+
+def legacy(packed):
+    for epc_b64, epc_hex in zip(*EPC.encode_batch(packed)):
+        event = legacy_event(epc_b64, epc_hex)
+        json.dumps(event)
+        json.dumps(event)
+
+
+def orjson_dicts(packed):
+    for epc_b64, epc_hex in zip(*EPC.encode_batch(packed)):
+        event = legacy_event(epc_b64, epc_hex)
+        orjson.dumps(event)
+
+
+def template(packed):
+    events = events_from_records(packed)
+    for event in events:
+        event.encode()
+    # The second sink reuses the cached bytes
+    json_array(events)
+
+
+def projected(packed):
+    events = events_from_records(packed)
+    json_array(events)
+    json_array(events, SLIM_FIELDS)
+
+
+def measure(func, packed, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(packed)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(packed) // EPC_BYTES / best
+
+
+def main(count=100000):
+    packed = EPC.generate_batch(count)
+    results = {"legacy": measure(legacy, packed), "template": measure(template, packed),
+               "projected": measure(projected, packed)}
+    if orjson is not None:
+        results["orjson"] = measure(orjson_dicts, packed)
+    for name, rate in results.items():
+        print(f"{name:>10}: {rate:>14,.0f} events/sec")
+    print(f"   speedup: {results['template'] / results['legacy']:.1f}x")
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,48 @@
+"""
+Measure the disk spill queue: appending events in batches, as a sink
+buffer does when it overflows, and draining them with batched sequential
+reads, as a publisher does once its sink is back.
+
+    python -m benchmarks.bench_spill [count] [batch]
+"""
+import sys
+import tempfile
+import time
+from app.epc import EPC
+from app.events import events_from_records
+from app.spill import SpillQueue
+
+
+def main(count=200000, batch=1000):
+    events = events_from_records(EPC.generate_batch(count))
+    for event in events:
+        event.encode()
+    batches = [events[start:start + batch] for start in range(0, count, batch)]
+    with tempfile.TemporaryDirectory() as directory:
+        queue = SpillQueue(directory)
+        start = time.perf_counter()
+        for chunk in batches:
+            queue.append(chunk)
+        spill_seconds = time.perf_counter() - start
+        size = queue.bytes
+        start = time.perf_counter()
+        drained = 0
+        while True:
+            chunk = queue.read(batch)
+            if not chunk:
+                break
+            drained += len(chunk)
+        drain_seconds = time.perf_counter() - start
+        queue.close()
+    assert drained == count
+    results = {
+        "spill": {"eventsPerSecond": count / spill_seconds, "megabytesPerSecond": size / spill_seconds / 1e6},
+        "drain": {"eventsPerSecond": count / drain_seconds, "megabytesPerSecond": size / drain_seconds / 1e6}
+    }
+    for name, result in results.items():
+        print(f"{name:>6}: {result['eventsPerSecond']:>12,.0f} events/sec {result['megabytesPerSecond']:>8,.1f} MB/sec")
+    return results
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
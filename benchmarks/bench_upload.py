@@ -0,0 +1,52 @@
+"""
+Measure streamed reference list uploads: parsing newline-delimited, CSV
+and gzip-compressed bodies and writing them to the binary list format,
+as POST /manage/ref-lists/<list_type> does with a text/plain, text/csv
+or gzip-encoded body. Bodies are generated up front and read from memory.
+
+    python -m benchmarks.bench_upload [count]
+"""
+import gzip
+import io
+import os
+import sys
+import tempfile
+import time
+from app.epc import EPC
+from app.reflist import binary_file_name
+from app.upload import CSV, LINES, body_chunks, upload_list
+
+
+def make_body(count, upload_format):
+    hex_ = EPC.generate_batch(count).hex().upper()
+    epcs = [hex_[i:i + 24] for i in range(0, len(hex_), 24)]
+    if upload_format == CSV:
+        return ("epc,antenna\n" + "".join(f"{epc},1\n" for epc in epcs)).encode('ascii')
+    return ("\n".join(epcs) + "\n").encode('ascii')
+
+
+def measure(body, upload_format, gzipped, file_name):
+    start = time.perf_counter()
+    result = upload_list(file_name, body_chunks(io.BytesIO(body), gzipped), upload_format)
+    elapsed = time.perf_counter() - start
+    return result["accepted"], elapsed
+
+
+def main(count=1000000):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "reference-list.txt")
+        for name, upload_format, gzipped in (("lines", LINES, False), ("csv", CSV, False),
+                                             ("lines-gzip", LINES, True)):
+            body = make_body(count, upload_format)
+            if gzipped:
+                body = gzip.compress(body, compresslevel=1)
+            accepted, elapsed = measure(body, upload_format, gzipped, file_name)
+            assert accepted == count and os.path.getsize(binary_file_name(file_name)) == count * 12
+            results[name] = {"epcsPerSecond": count / elapsed, "seconds": elapsed, "bodyBytes": len(body)}
+            print(f"{name:>11}: {count / elapsed:>12,.0f} EPCs/sec {elapsed:>7.2f} s for {len(body) / 1e6:,.0f} MB")
+    return results
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
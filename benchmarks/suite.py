@@ -0,0 +1,315 @@
+"""
+Offline load-generation and throughput benchmark suite.
+
+Measures raw event generation and serialization, SSE delivery to 1, 100
+and 1000 concurrent stream clients, MQTT publishing against a stand-in
+broker, webhook delivery against a stand-in HTTP sink and the disk spill
+queue, all in-process on localhost. Results are written as JSON so runs
+can be compared between releases.
+
+    python -m benchmarks.suite [--duration SECONDS] [--only NAME ...] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app import create_app
+from app.asgi import create_asgi_app
+from app.buffer import EventBuffer, BLOCK
+from app.bus import EventBus
+from app.epc import EPC
+from app.events import events_from_records
+from app.generator import EventGenerator, parse_settings
+from app.mqtt import create_publisher
+from app.reader import default_reader
+from app.webhook import WebhookPublisher
+from benchmarks import bench_spill
+
+SSE_CLIENT_COUNTS = (1, 100, 1000)
+SSE_EVENTS_PER_SECOND = 10000
+PUBLISHER_EVENTS = 50000
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def wait_until(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def make_events(count):
+    return events_from_records(EPC.generate_batch(count))
+
+
+def bench_generation(duration):
+    """Unpaced generation with JSON encoding, and encoding alone."""
+    event_generator = EventGenerator(parse_settings({"mode": "max", "maxBatchSize": 5000}))
+    generated = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        events = event_generator.next_batch()
+        for event in events:
+            event.encode()
+        generated += len(events)
+    generation_rate = generated / (time.perf_counter() - start)
+
+    events = make_events(100000)
+    start = time.perf_counter()
+    for event in events:
+        event.encode()
+    return {
+        "eventsPerSecond": round(generation_rate),
+        "serializedEventsPerSecond": round(len(events) / (time.perf_counter() - start)),
+    }
+
+
+class StreamClient:
+    """One SSE client of the ASGI app, recording when each body arrives and which event it starts with."""
+
+    def __init__(self, app):
+        self.app = app
+        self.scope = {"type": "http", "method": "GET", "path": "/api/v1/data/stream", "query_string": b"",
+                      "root_path": "", "http_version": "1.1", "scheme": "http", "headers": [],
+                      "server": ("127.0.0.1", 5000)}
+        self.disconnected = asyncio.Event()
+        self.request_sent = False
+        self.events = 0
+        self.arrivals = []
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        body = message.get("body")
+        if body:
+            self.events += body.count(b"\n\n")
+            self.arrivals.append((time.time(), body[:body.index(b"\n\n")]))
+
+
+def bench_sse(app, duration, clients):
+    """Delivery rate and latency with `clients` concurrent stream clients of the ASGI `app`."""
+    spy = default_reader.bus.subscribe(EventBuffer(SSE_EVENTS_PER_SECOND * int(duration + 5), sink="benchmark"))
+    default_reader.start(parse_settings({"mode": "fixed", "eventsPerSecond": SSE_EVENTS_PER_SECOND,
+                                         "maxBatchSize": 1000}))
+
+    async def scenario():
+        stream_clients = [StreamClient(app) for _ in range(clients)]
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(app(client.scope, client.receive, client.send)) for client in stream_clients]
+        await asyncio.sleep(duration)
+        for client in stream_clients:
+            client.disconnected.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 10)
+        return stream_clients, time.perf_counter() - start
+
+    try:
+        stream_clients, elapsed = asyncio.run(scenario())
+    finally:
+        default_reader.stop()
+        created = {event.encode(): event.timestamp for event in spy.take(len(spy), 0)}
+        default_reader.bus.unsubscribe(spy)
+    latencies = [(arrival - created[first]) * 1000 for client in stream_clients
+                 for arrival, first in client.arrivals if first in created]
+    delivered = [client.events for client in stream_clients]
+    return {
+        "clients": clients,
+        "eventsGenerated": len(created),
+        "eventsPerSecondPerClient": round(sum(delivered) / clients / elapsed),
+        "aggregateEventsPerSecond": round(sum(delivered) / elapsed),
+        "latencyMillisecondsP50": round(percentile(latencies, 0.5), 2) if latencies else None,
+        "latencyMillisecondsP99": round(percentile(latencies, 0.99), 2) if latencies else None,
+    }
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    """Just enough MQTT 3.1.1 to accept a publisher: CONNECT, PUBLISH (QoS 0-2), PINGREQ and DISCONNECT."""
+
+    def read_packet(self, stream):
+        header = stream.read(1)
+        if not header:
+            return None, None
+        length, multiplier = 0, 1
+        while True:
+            byte = stream.read(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header[0], stream.read(length)
+
+    def handle(self):
+        stream = self.request.makefile('rb')
+        broker = self.server
+        while True:
+            header, body = self.read_packet(stream)
+            kind = None if header is None else header >> 4
+            if kind is None or kind == 14:
+                return
+            if kind == 1:
+                self.request.sendall(b"\x20\x02\x00\x00")
+            elif kind == 3:
+                qos = (header >> 1) & 3
+                topic_length = struct.unpack("!H", body[:2])[0]
+                payload_start = 2 + topic_length + (2 if qos else 0)
+                with broker.lock:
+                    broker.messages += 1
+                    broker.events += body.count(b'"eventType"', payload_start)
+                if qos:
+                    packet_id = body[2 + topic_length:payload_start]
+                    self.request.sendall((b"\x40\x02" if qos == 1 else b"\x50\x02") + packet_id)
+            elif kind == 6:
+                self.request.sendall(b"\x70\x02" + body[:2])
+            elif kind == 12:
+                self.request.sendall(b"\xd0\x00")
+
+
+class StandInBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), BrokerHandler)
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.events = 0
+
+
+def bench_mqtt(qos, batch_size, count=PUBLISHER_EVENTS):
+    """Publish `count` events through an MqttPublisher to the stand-in broker."""
+    broker = StandInBroker()
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    publisher = create_publisher(f"benchmark-{qos}-{batch_size}", EventBus(), spread=0)
+    mqtt_config = {"active": True, "brokerHostname": "127.0.0.1", "brokerPort": broker.server_address[1],
+                   "eventQualityOfService": qos, "eventBatchSize": batch_size, "eventBufferSize": count,
+                   "eventBufferOverflowPolicy": BLOCK, "eventPendingDeliveryLimit": 100}
+    publisher.configure(mqtt_config)
+    wait_until(publisher.client.is_connected, 5)
+    events = make_events(count)
+    start = time.perf_counter()
+    publisher.offer(events)
+    delivered = wait_until(lambda: broker.events >= count, 60)
+    elapsed = time.perf_counter() - start
+    publisher.configure({"active": False})
+    wait_until(lambda: publisher.client.socket() is None, 5)
+    broker.shutdown()
+    broker.server_close()
+    return {
+        "qos": qos,
+        "eventBatchSize": batch_size,
+        "events": broker.events,
+        "complete": delivered,
+        "eventsPerSecond": round(broker.events / elapsed),
+        "messagesPerSecond": round(broker.messages / elapsed),
+    }
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.events += body.count(b'"eventType"')
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_webhook(batch_limit, count=PUBLISHER_EVENTS):
+    """Deliver `count` events through a WebhookPublisher to the stand-in HTTP sink."""
+    sink = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+    sink.daemon_threads = True
+    sink.lock = threading.Lock()
+    sink.requests = 0
+    sink.events = 0
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    bus = EventBus()
+    bus.state.streaming = True
+    publisher = WebhookPublisher(bus)
+    events = make_events(count)
+    start = time.perf_counter()
+    publisher.configure({"active": True, "eventBatchLimit": batch_limit, "eventBatchLingerMilliseconds": 10,
+                         "eventBufferSize": count, "eventBufferOverflowPolicy": BLOCK,
+                         "serverConfiguration": {"url": f"http://127.0.0.1:{sink.server_address[1]}/events"}})
+    publisher.offer(events)
+    delivered = wait_until(lambda: sink.events >= count, 60)
+    elapsed = time.perf_counter() - start
+    publisher.configure({"active": False})
+    sink.shutdown()
+    sink.server_close()
+    return {
+        "eventBatchLimit": batch_limit,
+        "events": sink.events,
+        "complete": delivered,
+        "eventsPerSecond": round(sink.events / elapsed),
+        "requestsPerSecond": round(sink.requests / elapsed),
+    }
+
+
+BENCHMARKS = {
+    "generation": lambda duration: bench_generation(duration),
+    "sse": lambda duration: [bench_sse(app, duration, clients)
+                             for app in [create_asgi_app(create_app())] for clients in SSE_CLIENT_COUNTS],
+    "mqtt": lambda duration: [bench_mqtt(qos, batch) for qos, batch in ((0, 1), (1, 1), (0, 100), (1, 100))],
+    "webhook": lambda duration: [bench_webhook(limit) for limit in (100, 1000)],
+    "spill": lambda duration: bench_spill.main(),
+}
+
+
+def run(duration=3.0, only=None):
+    results = {
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "durationSeconds": duration,
+        "benchmarks": {},
+    }
+    for name, benchmark in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        print(f"running {name}...", file=sys.stderr)
+        results["benchmarks"][name] = benchmark(duration)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per timed run (default 3)")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="benchmarks to run (default all)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    results = run(args.duration, args.only)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 from app import create_app
+from app.fleet import create_fleet, DEFAULT_WORKERS
+from app.utils import compile_stale_lists
+import app.config as config
+import logging
 import os
+import threading
 from flask import request, Response
 from functools import wraps
+from werkzeug.serving import make_server
 
 app = create_app()
 
@@ -10,6 +16,17 @@ USE_HTTPS = os.getenv('USE_HTTPS', 'True') == 'True'
 USE_BASIC_AUTH = os.getenv('USE_BASIC_AUTH', 'False') == 'True'
 USERNAME = os.getenv('BASIC_AUTH_USERNAME', 'admin')
 PASSWORD = os.getenv('BASIC_AUTH_PASSWORD', 'password')
+# 'flask' runs the development server, 'asgi' runs Hypercorn with the asyncio event stream
+SERVER_MODE = os.getenv('SERVER_MODE', 'flask')
+# Fleet mode: number of extra virtual readers, generation threads shared by them and
+# an optional base port (reader N is also served on FLEET_BASE_PORT + N)
+FLEET_SIZE = int(os.getenv('FLEET_SIZE', '0'))
+FLEET_WORKERS = int(os.getenv('FLEET_WORKERS', str(DEFAULT_WORKERS)))
+FLEET_BASE_PORT = int(os.getenv('FLEET_BASE_PORT', '0')) or None
+# Worker processes that build and encode the default reader's events (0 keeps it in-process)
+GENERATION_PROCESSES = int(os.getenv('GENERATION_PROCESSES', '0'))
+# DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 
 def check_auth(username, password):
     """Check if a username/password combination is valid."""
@@ -37,9 +54,31 @@ if USE_BASIC_AUTH:
         if rule.endpoint != 'static':
             app.view_functions[rule.endpoint] = requires_auth(app.view_functions[rule.endpoint])
 
+def serve_fleet_ports(ports, ssl_context=None):
+    """Serve the fleet readers' own ports next to the Flask development server."""
+    for port in ports:
+        server = make_server('0.0.0.0', port, app, threaded=True, ssl_context=ssl_context)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
 if __name__ == '__main__':
-    if USE_HTTPS:
-        context = ('cert.pem', 'key.pem')
-        app.run(debug=True, ssl_context=context, host='0.0.0.0')
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # Text reference lists edited while the emulator was down are converted off the request path
+    compile_stale_lists()
+    config.generation_processes = GENERATION_PROCESSES
+    fleet_ports = [reader.port for reader in create_fleet(FLEET_SIZE, FLEET_WORKERS, FLEET_BASE_PORT) if reader.port]
+    if SERVER_MODE == 'asgi':
+        from app.asgi import serve
+        serve(app,
+              certfile='cert.pem' if USE_HTTPS else None,
+              keyfile='key.pem' if USE_HTTPS else None,
+              credentials=(USERNAME, PASSWORD) if USE_BASIC_AUTH else None,
+              extra_ports=fleet_ports)
     else:
-        app.run(debug=True, host='0.0.0.0')
+        # The debug reloader runs this module twice; only its child process serves requests
+        if fleet_ports and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            serve_fleet_ports(fleet_ports, ('cert.pem', 'key.pem') if USE_HTTPS else None)
+        if USE_HTTPS:
+            context = ('cert.pem', 'key.pem')
+            app.run(debug=True, ssl_context=context, host='0.0.0.0')
+        else:
+            app.run(debug=True, host='0.0.0.0')
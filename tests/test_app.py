@@ -1,13 +1,17 @@
 import unittest
 from flask import Flask
 from flask_testing import TestCase
-from app import app, mqtt_config, webhook_config, SETTINGS_FILE
+import threading
+from app import create_app
+from app.reader import default_reader
+from app.utils import SETTINGS_FILE
 import os
 import json
 
 class TestIoTDeviceEmulator(TestCase):
 
     def create_app(self):
+        app = create_app()
         app.config['TESTING'] = True
         return app
 
@@ -17,6 +21,9 @@ class TestIoTDeviceEmulator(TestCase):
             os.remove(SETTINGS_FILE)
 
     def tearDown(self):
+        default_reader.stop()
+        default_reader.configure_mqtt({})
+        default_reader.configure_webhook({})
         # Clean up any created files
         if os.path.exists(SETTINGS_FILE):
             os.remove(SETTINGS_FILE)
@@ -33,7 +40,7 @@ class TestIoTDeviceEmulator(TestCase):
     def test_get_mqtt_settings(self):
         response = self.client.get('/api/v1/mqtt')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json, mqtt_config)
+        self.assertEqual(response.json, default_reader.mqtt_config)
 
     def test_update_mqtt_settings(self):
         data = {
@@ -45,13 +52,17 @@ class TestIoTDeviceEmulator(TestCase):
         }
         response = self.client.put('/api/v1/mqtt', data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 204)
-        self.assertEqual(mqtt_config['brokerHostname'], "mqtt.example.com")
-        self.assertTrue(mqtt_config['active'])
+        self.assertEqual(default_reader.mqtt_config['brokerHostname'], "mqtt.example.com")
+        self.assertTrue(default_reader.mqtt_config['active'])
+        # GET sees the update
+        self.assertEqual(self.client.get('/api/v1/mqtt').json, data)
+        with open(SETTINGS_FILE) as f:
+            self.assertEqual(json.load(f)["mqtt_config"], data)
 
     def test_get_webhook_settings(self):
         response = self.client.get('/api/v1/webhooks/event')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json, webhook_config)
+        self.assertEqual(response.json, default_reader.webhook_config)
 
     def test_update_webhook_settings(self):
         data = {
@@ -69,8 +80,63 @@ class TestIoTDeviceEmulator(TestCase):
         }
         response = self.client.put('/api/v1/webhooks/event', data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 204)
-        self.assertTrue(webhook_config['active'])
-        self.assertEqual(webhook_config['serverConfiguration']['url'], "https://example.com")
+        self.assertTrue(default_reader.webhook_config['active'])
+        self.assertEqual(default_reader.webhook_config['serverConfiguration']['url'], "https://example.com")
+        self.assertEqual(self.client.get('/api/v1/webhooks/event').json, data)
+        self.assertEqual(self.client.get('/api/v1/status').json["eventWebhookStatus"]["status"], "enabled")
+
+    def test_invalid_sink_settings_are_rejected(self):
+        for url, data in (('/api/v1/webhooks/event', {"eventBatchLimit": "5"}),
+                          ('/api/v1/webhooks/event', {"retry": {"maxRetries": "3"}}),
+                          ('/api/v1/webhooks/event', {"retry": {"maxDelayMilliseconds": -1}}),
+                          ('/api/v1/webhooks/event', {"reportFields": ["epcHex", "rssi"]}),
+                          ('/api/v1/mqtt', {"eventBatchSize": 0}),
+                          ('/api/v1/mqtt', {"eventBufferSize": 1.5}),
+                          ('/api/v1/mqtt', {"eventPendingDeliveryLimit": "20"}),
+                          ('/api/v1/mqtt', {"reportFields": ["epcHex", "rssi"]})):
+            response = self.client.put(url, json=dict(data, active=False))
+            self.assertEqual(response.status_code, 400, data)
+        self.assertEqual(default_reader.webhook_config, {})
+        self.assertEqual(self.client.get('/api/v1/data/stream?reportFields=rssi').status_code, 400)
+
+    def test_saved_settings_are_restored(self):
+        mqtt_config = {"brokerHostname": "mqtt.example.com", "eventTopic": "l", "active": False}
+        with open(SETTINGS_FILE, 'w') as f:
+            json.dump({"mqtt_config": mqtt_config, "webhook_config": {"eventBatchLimit": "5"}}, f)
+        default_reader.load_settings()
+        self.assertEqual(default_reader.mqtt_config, mqtt_config)
+        # Settings that no longer validate are left out
+        self.assertEqual(default_reader.webhook_config, {})
+        with open(SETTINGS_FILE, 'w') as f:
+            f.write("{")
+        default_reader.load_settings()
+        self.assertEqual(default_reader.mqtt_config, mqtt_config)
+
+    def test_settings_are_snapshots(self):
+        data = {"active": False, "eventBatchLimit": 5, "retry": {"maxRetries": 1}}
+        self.client.put('/api/v1/webhooks/event', json=data)
+        snapshot = default_reader.webhook_config
+        self.assertIs(default_reader.webhook.config, snapshot)
+        self.client.put('/api/v1/webhooks/event', json={"active": False, "eventBatchLimit": 6})
+        # A replaced snapshot is left as it was, so code holding it stays consistent
+        self.assertEqual(snapshot, data)
+        self.assertEqual(default_reader.webhook_config["eventBatchLimit"], 6)
+
+    def test_concurrent_updates_leave_consistent_settings(self):
+        def put(limit):
+            for _ in range(20):
+                self.app.test_client().put('/api/v1/webhooks/event',
+                                                    json={"active": False, "eventBatchLimit": limit,
+                                                          "eventBufferSize": limit})
+
+        threads = [threading.Thread(target=put, args=(limit,)) for limit in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        settings = self.client.get('/api/v1/webhooks/event').json
+        self.assertEqual(settings["eventBatchLimit"], settings["eventBufferSize"])
+        self.assertIs(default_reader.webhook.config, default_reader.webhook_config)
 
     def test_data_stream(self):
         self.client.post('/api/v1/profiles/inventory/presets/default/start')
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from app import create_app
+from app.asgi import create_asgi_app
+from app.reader import default_reader
+
+
+class ASGIClient:
+    """Drives one request through the ASGI app and records what it sends."""
+
+    def __init__(self, app, path, query=b"", method="GET", headers=()):
+        self.app = app
+        self.scope = {"type": "http", "method": method, "path": path, "query_string": query,
+                      "root_path": "", "http_version": "1.1", "scheme": "http",
+                      "headers": list(headers), "server": ("testserver", 80)}
+        self.messages = []
+        self.disconnected = asyncio.Event()
+        self.request_sent = False
+
+    async def receive(self):
+        if not self.request_sent:
+            self.request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        self.messages.append(message)
+
+    async def run(self):
+        await self.app(self.scope, self.receive, self.send)
+
+    def status(self):
+        return self.messages[0]["status"]
+
+    def body(self):
+        return b"".join(message.get("body", b"") for message in self.messages[1:])
+
+
+class TestASGI(unittest.TestCase):
+
+    def setUp(self):
+        self.flask_app = create_app()
+        self.app = create_asgi_app(self.flask_app)
+        self.flask_app.test_client().post('/api/v1/profiles/inventory/presets/default/start',
+                                          json={"mode": "fixed", "eventsPerSecond": 1000})
+
+    def tearDown(self):
+        default_reader.stop()
+
+    def test_flask_routes_are_served(self):
+        async def scenario():
+            client = ASGIClient(self.app, "/api/v1/status")
+            await client.run()
+            return client
+        client = asyncio.run(scenario())
+        self.assertEqual(client.status(), 200)
+        self.assertEqual(json.loads(client.body())["status"], "running")
+        spec = ASGIClient(self.app, "/apispec_1.json")
+        asyncio.run(spec.run())
+        self.assertIn("/api/v1/data/stream", json.loads(spec.body())["paths"])
+
+    def test_many_stream_clients_share_events(self):
+        async def scenario():
+            clients = [ASGIClient(self.app, "/api/v1/data/stream") for _ in range(200)]
+            tasks = [asyncio.create_task(client.run()) for client in clients]
+            await asyncio.sleep(0.5)
+            self.assertEqual(self.app.bridge.stats()["subscribers"], 200)
+            for client in clients:
+                client.disconnected.set()
+            await asyncio.wait_for(asyncio.gather(*tasks), 2)
+            return clients
+        clients = asyncio.run(scenario())
+        events = [chunk for chunk in clients[0].body().split(b"\n\n") if chunk]
+        self.assertGreater(len(events), 50)
+        self.assertEqual(json.loads(events[0])["eventType"], "tagInventory")
+        self.assertTrue(all(client.status() == 200 for client in clients))
+        self.assertEqual(self.app.bridge.stats()["subscribers"], 0)
+
+    def test_stream_clients_get_their_own_projection(self):
+        async def scenario():
+            clients = [ASGIClient(self.app, "/api/v1/data/stream", query=query)
+                       for query in (b"", b"reportFields=epcHex", b"reportFields=epcHex")]
+            tasks = [asyncio.create_task(client.run()) for client in clients]
+            await asyncio.sleep(0.3)
+            for client in clients:
+                client.disconnected.set()
+            await asyncio.wait_for(asyncio.gather(*tasks), 2)
+            return clients
+        clients = asyncio.run(scenario())
+        full, slim, other = ([json.loads(chunk) for chunk in client.body().split(b"\n\n") if chunk]
+                             for client in clients)
+        self.assertTrue(full and slim)
+        self.assertIn("antennaPort", full[0]["tagInventoryEvent"])
+        self.assertTrue(all(list(event["tagInventoryEvent"]) == ["epcHex"] for event in slim + other))
+
+    def test_streams_leave_the_default_executor_to_flask_routes(self):
+        take = self.app.bridge.buffer.take
+        threads = set()
+
+        def recording_take(*args):
+            threads.add(threading.current_thread().name)
+            return take(*args)
+
+        async def scenario():
+            # A single default thread would be pinned by a pump waiting on it
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(1))
+            stream = ASGIClient(self.app, "/api/v1/data/stream")
+            task = asyncio.create_task(stream.run())
+            await asyncio.sleep(0.3)
+            status = ASGIClient(self.app, "/api/v1/status")
+            await asyncio.wait_for(status.run(), 0.2)
+            stream.disconnected.set()
+            await asyncio.wait_for(task, 2)
+            return status
+        with mock.patch.object(self.app.bridge.buffer, 'take', recording_take):
+            status = asyncio.run(scenario())
+        self.assertEqual(status.status(), 200)
+        self.assertTrue(any(name.startswith("stream-bridge") for name in threads))
+        self.assertFalse(any(name.startswith("ThreadPoolExecutor") for name in threads))
+
+    def test_invalid_stream_settings(self):
+        for query in (b"overflow=bogus", b"reportFields=epcHex,rssi"):
+            client = ASGIClient(self.app, "/api/v1/data/stream", query=query)
+            asyncio.run(client.run())
+            self.assertEqual(client.status(), 400)
+
+    def test_stream_requires_credentials_when_configured(self):
+        app = create_asgi_app(self.flask_app, credentials=("admin", "password"))
+        client = ASGIClient(app, "/api/v1/data/stream")
+        asyncio.run(client.run())
+        self.assertEqual(client.status(), 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from app.buffer import EventBuffer, BLOCK, DISCONNECT
+from app.bus import EventBus
+from app.events import TagEvent, EventTemplate
+import app.generator as generator
+from app.routes.stream import format_events
+
+
+def make_events(count):
+    return [TagEvent(i.to_bytes(12, "big")) for i in range(count)]
+
+
+class TestEventBuffer(unittest.TestCase):
+
+    def test_disconnect_policy_closes_on_overflow(self):
+        buffer = EventBuffer(3, DISCONNECT)
+        self.assertTrue(buffer.offer(make_events(3)))
+        self.assertFalse(buffer.offer(make_events(1)))
+        self.assertTrue(buffer.closed)
+
+    def test_block_policy_waits_for_consumer(self):
+        buffer = EventBuffer(2, BLOCK)
+        buffer.offer(make_events(2))
+        producer = threading.Thread(target=buffer.offer, args=(make_events(1),))
+        producer.start()
+        time.sleep(0.1)
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(len(buffer.take(1)), 1)
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.dropped, 0)
+
+
+class TestEventBus(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = generator.parse_settings({"mode": "fixed", "eventsPerSecond": 2000})
+        self.bus = EventBus()
+        self.bus.state.streaming = True
+
+    def tearDown(self):
+        self.bus.state.streaming = False
+        time.sleep(0.1)
+
+    def start(self):
+        return self.bus.start(generator.EventGenerator(self.settings))
+
+    def test_subscribers_receive_the_same_events(self):
+        first = self.bus.subscribe(EventBuffer(100000))
+        second = self.bus.subscribe(EventBuffer(100000))
+        self.start()
+        time.sleep(0.3)
+        self.bus.state.streaming = False
+        time.sleep(0.1)
+        first_events = first.take(100000)
+        self.assertGreater(len(first_events), 100)
+        self.assertEqual(first_events, second.take(100000))
+
+    def test_slow_subscriber_does_not_stall_others(self):
+        fast = self.bus.subscribe(EventBuffer(100000))
+        slow = self.bus.subscribe(EventBuffer(10))
+        self.start()
+        time.sleep(0.3)
+        self.assertEqual(len(slow), 10)
+        self.assertGreater(slow.dropped, 0)
+        self.assertGreater(len(fast), 100)
+
+    def test_unsubscribing_a_full_blocking_buffer_releases_the_producer(self):
+        fast = self.bus.subscribe(EventBuffer(100000))
+        blocked = self.bus.subscribe(EventBuffer(10, BLOCK))
+        producer = self.start()
+        time.sleep(0.2)
+        # The producer is stuck on the full buffer
+        stalled = len(fast)
+        time.sleep(0.1)
+        self.assertEqual(len(fast), stalled)
+        fast.take(100000, 0)
+        self.bus.unsubscribe(blocked)
+        self.assertTrue(blocked.closed)
+        time.sleep(0.3)
+        self.assertGreater(len(fast), 100)
+        self.bus.state.streaming = False
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+
+    def test_blocked_producer_stops_with_the_stream(self):
+        self.bus.subscribe(EventBuffer(10, BLOCK))
+        producer = self.start()
+        time.sleep(0.2)
+        self.bus.state.streaming = False
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+
+    def test_resubscribing_reopens_the_buffer(self):
+        buffer = self.bus.subscribe(EventBuffer(10))
+        self.bus.unsubscribe(buffer)
+        self.assertFalse(buffer.offer(make_events(1)))
+        self.bus.subscribe(buffer)
+        self.assertTrue(buffer.offer(make_events(1)))
+
+    def test_events_are_encoded_once_for_all_clients(self):
+        events = make_events(5)
+        with mock.patch.object(EventTemplate, 'render', autospec=True, side_effect=EventTemplate.render) as render:
+            chunks = [format_events(events) for _ in range(3)]
+        self.assertEqual(render.call_count, 5)
+        self.assertEqual(len(set(chunks)), 1)
+        self.assertEqual(json.loads(chunks[0].split(b"\n\n")[1])["tagInventoryEvent"]["epcHex"], f"{1:024X}")
+
+    def test_closed_subscribers_are_removed(self):
+        self.bus.subscribe(EventBuffer(1, DISCONNECT))
+        self.start()
+        time.sleep(0.2)
+        self.assertEqual(self.bus.stats()["subscribers"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
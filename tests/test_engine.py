@@ -0,0 +1,48 @@
+import json
+import unittest
+from app.engine import ShardedGenerator, MIN_SHARD_EVENTS
+from app.epc import EPC
+from app.generator import EventGenerator, parse_settings
+from app.reflist import ReferenceCursor, ReferenceStore
+
+
+class TestShardedGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = parse_settings({"mode": "max", "maxBatchSize": 1000})
+
+    def test_workers_return_encoded_events_in_list_order(self):
+        packed = EPC.generate_batch(1500)
+        store = ReferenceStore(packed)
+        generator = ShardedGenerator(self.settings, ReferenceCursor(store), "reader-7", processes=2)
+        events = generator.next_batch() + generator.next_batch()
+        self.assertEqual(len(events), 2000)
+        expected = [pair[1] for pair in store.pairs(0, 1500)] + [pair[1] for pair in store.pairs(0, 500)]
+        self.assertEqual([json.loads(event.encode())["tagInventoryEvent"]["epcHex"] for event in events], expected)
+        self.assertTrue(all(event.hostname == "reader-7" for event in events))
+        self.assertEqual(generator.stats()["processes"], 2)
+
+    def test_small_batches_are_built_in_process(self):
+        generator = ShardedGenerator(self.settings, processes=2)
+        events = generator.events(MIN_SHARD_EVENTS - 1)
+        self.assertEqual(len(events), MIN_SHARD_EVENTS - 1)
+        self.assertFalse(generator.pending)
+        self.assertEqual(len(json.loads(events[0].encode())["tagInventoryEvent"]["epc"]), 16)
+
+    def test_seeded_runs_match_with_any_number_of_processes(self):
+        settings = parse_settings({"mode": "max", "maxBatchSize": 700, "seed": 7})
+        store = ReferenceStore(EPC.generate_batch(300))
+
+        def epcs(generator):
+            events = [event for _ in range(4) for event in generator.next_batch()]
+            return [json.loads(event.encode())["tagInventoryEvent"]["epcHex"] for event in events]
+
+        expected = epcs(EventGenerator(settings, ReferenceCursor(None, store)))
+        self.assertEqual(len(expected), 2800)
+        for processes in (1, 3):
+            generator = ShardedGenerator(settings, ReferenceCursor(None, store), processes=processes)
+            self.assertEqual(epcs(generator), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+from app.epc import EPC
+from app.seeding import EpcStream, SEED_BLOCK_EPCS
+
+
+class TestEPCBatch(unittest.TestCase):
+
+    def test_batch_matches_per_object_encoding(self):
+        packed = EPC.generate_batch(1000, rng=np.random.default_rng(7))
+        self.assertEqual(len(packed), 1000 * 12)
+        b64_column, hex_column = EPC.encode_batch(packed)
+        for epc_b64, epc_hex in zip(b64_column, hex_column):
+            epc = EPC(int(epc_hex[0:2], 16), int(epc_hex[2:9], 16), int(epc_hex[9:15], 16), int(epc_hex[15:24], 16))
+            self.assertEqual(epc.hex(), epc_hex)
+            self.assertEqual(epc.b64(), epc_b64)
+
+    def test_batch_uses_header_and_manager(self):
+        packed = EPC.generate_batch(10, header=0xE2, manager=EPC.MaxManager)
+        _, hex_column = EPC.encode_batch(packed)
+        self.assertTrue(all(epc_hex.startswith("E2FFFFFFF") for epc_hex in hex_column))
+
+    def test_empty_batch(self):
+        self.assertEqual(EPC.encode_batch(EPC.generate_batch(0)), ([], []))
+
+
+class TestEpcStream(unittest.TestCase):
+
+    def test_seeded_stream_does_not_depend_on_how_it_is_split(self):
+        whole = EpcStream(42).take(3 * SEED_BLOCK_EPCS)
+        stream = EpcStream(42)
+        parts = [stream.take(count) for count in (1, SEED_BLOCK_EPCS, 7, 2 * SEED_BLOCK_EPCS - 8)]
+        self.assertEqual(b"".join(parts), whole)
+        self.assertEqual(EpcStream(42).range(SEED_BLOCK_EPCS - 3, 10), whole[(SEED_BLOCK_EPCS - 3) * 12:][:120])
+        self.assertNotEqual(EpcStream(43).take(100), whole[:1200])
+        self.assertNotEqual(EpcStream().take(100), EpcStream().take(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
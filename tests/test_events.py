@@ -0,0 +1,100 @@
+import json
+import sys
+import tracemalloc
+import unittest
+from unittest import mock
+from app.epc import EPC
+from app.events import (TagEvent, TagRead, TagSummary, EncodedEvent, events_from_records, format_timestamp,
+                        json_array, dumps, parse_report_fields, projected)
+import app.events as events
+
+EPC_RAW = bytes.fromhex("3500B6D9801234567890ABCD")
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_template_matches_dict_encoding(self):
+        for hostname in ("r700-emulator", 'odd "100%" host\n', "lecteur-é"):
+            event = TagEvent(EPC_RAW, antenna=3, timestamp=1700000000.5, hostname=hostname)
+            self.assertEqual(event.encode(), json.dumps(event.to_dict()).encode('utf-8'))
+        tag = json.loads(event.encode())["tagInventoryEvent"]
+        self.assertEqual(tag["epcHex"], "3500B6D9801234567890ABCD")
+        self.assertEqual(tag["epc"], "NQC22YASNFZ4kKvN")
+        self.assertEqual(tag["antennaName"], "Antenna 3")
+
+    def test_projected_events_render_only_their_fields(self):
+        fields = ("epcHex", "antennaPort", "peakRssiCdbm", "tagSeenCount")
+        for event, reported in (
+                (projected(TagEvent, fields)(EPC_RAW, 2, 1700000000.5, "r700"), ["epcHex", "antennaPort"]),
+                (projected(TagRead, fields)(EPC_RAW, 2, 1700000000.5, "r700", -6150, 12.25, 3),
+                 ["epcHex", "antennaPort", "peakRssiCdbm"]),
+                (projected(TagSummary, fields)(EPC_RAW, 2, 1700000000.5, "r700", 1700000000.1, 1700000000.4, 7),
+                 ["epcHex", "antennaPort", "tagSeenCount"])):
+            self.assertEqual(event.encode(), json.dumps(event.to_dict()).encode('utf-8'))
+            self.assertEqual(list(event.to_dict()["tagInventoryEvent"]), reported)
+            self.assertFalse(hasattr(event, '__dict__'))
+        self.assertIs(projected(TagEvent, fields), projected(TagEvent, fields))
+        self.assertIs(projected(TagEvent), TagEvent)
+
+    def test_sinks_render_their_own_projection(self):
+        event = TagRead(EPC_RAW, 2, 1700000000.5, "r700", -6150, 12.25, 3)
+        full = event.encode()
+        for fields in (["epcHex"], ["timestamp", "epcHex", "channel"], ["hostname"]):
+            fields = parse_report_fields(fields)
+            expected = {key: value for key, value in event.to_dict().items() if key in fields}
+            expected["tagInventoryEvent"] = {key: value for key, value in event.to_dict()["tagInventoryEvent"].items()
+                                             if key in fields}
+            self.assertEqual(event.encode_fields(fields), json.dumps(expected).encode('utf-8'))
+            self.assertEqual(json.loads(EncodedEvent(full).encode_fields(fields)), expected)
+            self.assertEqual(json.loads(json_array([event], fields)), [expected])
+        # The event keeps its own encoding, and a sink cannot widen a projection
+        self.assertIs(event.encode(), full)
+        narrow = projected(TagEvent, parse_report_fields(["epcHex"]))(EPC_RAW, 1, 1700000000.5, "r700")
+        self.assertIs(narrow.encode_fields(parse_report_fields(["epc", "epcHex"])), narrow.encode())
+        self.assertIs(event.encode_fields(None), full)
+        for invalid in ([], ["rssi"], "epcHex"):
+            with self.assertRaises(ValueError):
+                parse_report_fields(invalid)
+
+    def test_events_rotate_through_antenna_ports(self):
+        batch = events_from_records(EPC.generate_batch(5), [1, 3, 1, 3, 1])
+        self.assertEqual([event.antenna for event in batch], [1, 3, 1, 3, 1])
+
+    def test_epc_objects_are_stored_raw(self):
+        epc = EPC(class_=1, serial=2)
+        event = TagEvent(epc)
+        self.assertEqual(event.epc, bytes.fromhex(epc.hex()))
+        self.assertEqual((event.epc_b64, event.epc_hex), (epc.b64(), epc.hex()))
+
+    def test_event_is_encoded_once(self):
+        event = TagEvent(EPC_RAW)
+        self.assertIs(event.encode(), event.encode())
+        self.assertEqual(json.loads(json_array([event, EncodedEvent(event.encode())])), [event.to_dict()] * 2)
+
+    def test_timestamp_is_formatted_once_per_second(self):
+        events.last_timestamp = (None, "", b"")
+        with mock.patch('app.events.time.strftime', wraps=events.time.strftime) as strftime:
+            stamps = {format_timestamp(1700000000 + offset / 10) for offset in range(10)}
+            format_timestamp(1700000001)
+        self.assertEqual(stamps, {"2023-11-14T22:13:20Z"})
+        self.assertEqual(strftime.call_count, 2)
+
+    def test_dumps_returns_bytes(self):
+        self.assertEqual(json.loads(dumps({"message": "ok"})), {"message": "ok"})
+
+    def test_buffered_event_footprint(self):
+        packed = EPC.generate_batch(100000)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        batch = events_from_records(packed)
+        per_event = (tracemalloc.get_traced_memory()[0] - before) / len(batch)
+        tracemalloc.stop()
+        # Slotted object, its 12-byte EPC and a list slot; strings and dicts are not built
+        self.assertLess(per_event, 150)
+        self.assertFalse(hasattr(batch[0], '__dict__'))
+        self.assertIsNone(batch[0].encoded)
+        self.assertLess(sys.getsizeof(batch[0]), 80)
+
+
+if __name__ == '__main__':
+    unittest.main()
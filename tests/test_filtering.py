@@ -0,0 +1,80 @@
+import json
+import time
+import unittest
+from app.events import TagEvent
+from app.filtering import ExpiringIndex, DuplicateFilter, ReadAggregator, parse_filter
+from app.generator import parse_settings
+
+
+def reads(tags, timestamp, antenna=1):
+    return [TagEvent(tag.to_bytes(12, "big"), antenna, timestamp) for tag in tags]
+
+
+class TestExpiringIndex(unittest.TestCase):
+
+    def test_keys_expire_after_the_window(self):
+        index = ExpiringIndex(1.0)
+        index.add("a", 100.0)
+        index.add("b", 100.5)
+        index.expire(100.9)
+        self.assertIn("a", index)
+        index.expire(101.2)
+        self.assertNotIn("a", index)
+        self.assertIn("b", index)
+        index.add("b", 101.3)
+        index.expire(102.0)
+        # Re-added keys live on in their newer bucket
+        self.assertIn("b", index)
+        index.expire(102.5)
+        self.assertEqual(len(index), 0)
+
+
+class TestDuplicateFilter(unittest.TestCase):
+
+    def test_reads_within_the_window_are_suppressed(self):
+        stage = DuplicateFilter(parse_filter({"windowSeconds": 2}))
+        self.assertEqual(len(stage.process(reads([1, 2, 1], 10.0))), 2)
+        self.assertEqual(stage.process(reads([1, 2], 11.0)), [])
+        self.assertEqual(len(stage.process(reads([1, 2, 3], 12.5))), 3)
+        self.assertEqual(stage.stats()["suppressed"], 3)
+
+    def test_epc_and_antenna_key(self):
+        stage = DuplicateFilter(parse_filter({"key": "epcAntenna"}))
+        self.assertEqual(len(stage.process(reads([1], 10.0, 1) + reads([1], 10.0, 2) + reads([1], 10.0, 2))), 2)
+
+    def test_cost_per_read_does_not_grow_with_unique_tags(self):
+        def rate(unique):
+            stage = DuplicateFilter(parse_filter({"windowSeconds": 1}))
+            batches = [reads(range(unique), 10.0 + step * 0.1) for step in range(3)]
+            start = time.perf_counter()
+            for batch in batches:
+                stage.process(batch)
+            return 3 * unique / (time.perf_counter() - start)
+        self.assertGreater(rate(100000), rate(1000) / 3)
+
+
+class TestReadAggregator(unittest.TestCase):
+
+    def test_reads_are_summarized_per_interval(self):
+        now = [100.0]
+        stage = ReadAggregator(parse_filter({"mode": "aggregate", "reportIntervalSeconds": 1}), "dock", lambda: now[0])
+        self.assertEqual(stage.process(reads([1, 2], 100.2) + reads([1], 100.4, antenna=3)), [])
+        self.assertAlmostEqual(stage.due_in(), 1.0)
+        now[0] = 101.0
+        summaries = stage.process(reads([1], 100.9))
+        self.assertEqual(len(summaries), 2)
+        tag = json.loads(summaries[0].encode())["tagInventoryEvent"]
+        self.assertEqual(tag["tagSeenCount"], 3)
+        self.assertEqual(tag["antennaPort"], 1)
+        self.assertEqual(json.loads(summaries[0].encode()), summaries[0].to_dict())
+        self.assertEqual(stage.stats()["trackedTags"], 0)
+
+    def test_settings_are_validated(self):
+        self.assertEqual(parse_settings({"filter": {"mode": "aggregate"}})["filter"]["mode"], "aggregate")
+        for data in ({"mode": "sample"}, {"key": "tid"}, {"windowSeconds": 0}, "dedup"):
+            with self.assertRaises(ValueError):
+                parse_settings({"filter": data})
+
+
+if __name__ == '__main__':
+    unittest.main()
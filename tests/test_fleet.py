@@ -0,0 +1,86 @@
+import threading
+import time
+import tracemalloc
+import unittest
+from app import create_app
+from app.buffer import EventBuffer
+from app.fleet import create_fleet
+from app.generator import parse_settings
+from app.reader import default_reader, readers, readers_by_port
+
+
+class TestFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = create_fleet(3, workers=2, base_port=7000)
+        self.client = create_app().test_client()
+
+    def tearDown(self):
+        for reader in readers.values():
+            reader.stop()
+        readers.clear()
+        readers_by_port.clear()
+        default_reader.stop()
+
+    def test_readers_have_their_own_identity_and_settings(self):
+        status = self.client.get('/readers/reader-0002/api/v1/status').json
+        self.assertEqual(status["serialNumber"], self.fleet[1].serial)
+        self.assertEqual(status["hostname"], "r700-emulator-0002")
+        self.assertNotEqual(self.client.get('/api/v1/status').json["serialNumber"], self.fleet[1].serial)
+
+        settings = {"active": False, "eventBatchLimit": 7}
+        response = self.client.put('/readers/reader-0002/api/v1/webhooks/event', json=settings)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/readers/reader-0002/api/v1/webhooks/event').json, settings)
+        self.assertEqual(self.client.get('/readers/reader-0001/api/v1/webhooks/event').json, {})
+        self.assertEqual(self.client.get('/readers/reader-0042/api/v1/status').status_code, 404)
+
+    def test_readers_are_addressable_by_port(self):
+        status = self.client.get('/api/v1/status', environ_overrides={'SERVER_PORT': '7003'}).json
+        self.assertEqual(status["serialNumber"], self.fleet[2].serial)
+        listing = self.client.get('/fleet/readers').json
+        self.assertEqual([reader["port"] for reader in listing], [7001, 7002, 7003])
+
+    def test_reader_streams_are_independent(self):
+        reader = self.fleet[0]
+        buffer = reader.bus.subscribe(EventBuffer(100000))
+        response = self.client.post('/readers/reader-0001/api/v1/profiles/inventory/presets/default/start',
+                                    json={"mode": "fixed", "eventsPerSecond": 1000})
+        self.assertEqual(response.status_code, 204)
+        self.assertTrue(reader.streaming)
+        self.assertFalse(default_reader.streaming)
+        time.sleep(0.3)
+        events = buffer.take(100000)
+        self.assertGreater(len(events), 50)
+        self.assertTrue(all(event.hostname == "r700-emulator-0001" for event in events))
+        self.client.post('/readers/reader-0001/api/v1/profiles/stop')
+        self.assertFalse(reader.streaming)
+
+    def test_shared_workers_drive_many_readers(self):
+        threads = threading.active_count()
+        fleet = create_fleet(200, workers=2)
+        buffers = [reader.bus.subscribe(EventBuffer(1000)) for reader in fleet]
+        settings = parse_settings({"mode": "fixed", "eventsPerSecond": 50})
+        for reader in fleet:
+            reader.start(settings)
+        time.sleep(0.5)
+        self.assertTrue(all(len(buffer) > 0 for buffer in buffers))
+        self.assertLessEqual(threading.active_count() - threads, 2)
+
+    def test_per_reader_footprint(self):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        fleet = create_fleet(1000, workers=1)
+        idle = (tracemalloc.get_traced_memory()[0] - before) / len(fleet)
+        settings = parse_settings({"eventsPerSecond": 1})
+        for reader in fleet:
+            reader.start(settings)
+        streaming = (tracemalloc.get_traced_memory()[0] - before) / len(fleet)
+        tracemalloc.stop()
+        # The sizes given in the Reader docstring, with some headroom
+        self.assertLess(idle, 1536)
+        self.assertLess(streaming, 3072)
+
+
+if __name__ == '__main__':
+    unittest.main()
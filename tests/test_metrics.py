@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from app import create_app
+from app.buffer import EventBuffer
+from app.events import TagEvent
+from app.metrics import Registry, events_dropped
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_sums_the_threads_that_recorded(self):
+        counter = self.registry.counter("test_events_total", "Events.", ("sink",)).labels("mqtt")
+
+        def record():
+            for _ in range(1000):
+                counter.inc(2)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc()
+        self.assertEqual(counter.cells.totals(), [16001])
+        # Cells of ended threads are folded into the total
+        self.assertEqual(len(counter.cells.cells), 1)
+        self.assertIn('test_events_total{sink="mqtt"} 16001', self.registry.render())
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = self.registry.histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0)).labels()
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+        text = self.registry.render()
+        self.assertIn("# TYPE test_latency_seconds histogram", text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("test_latency_seconds_sum 6.05", text)
+        self.assertIn("test_latency_seconds_count 4", text)
+
+    def test_recording_is_cheap(self):
+        counter = self.registry.counter("test_cheap_total", "Events.").labels()
+        counter.inc()
+        start = time.perf_counter()
+        for _ in range(100000):
+            counter.inc()
+        self.assertLess((time.perf_counter() - start) / 100000, 2e-6)
+
+    def test_buffer_drops_are_counted_per_sink(self):
+        dropped = events_dropped.labels("webhook")
+        before = dropped.cells.totals()[0]
+        buffer = EventBuffer(2, sink="webhook")
+        buffer.offer([TagEvent(i.to_bytes(12, "big")) for i in range(5)])
+        self.assertEqual(buffer.dropped, 3)
+        self.assertEqual(dropped.cells.totals()[0] - before, 3)
+
+    def test_metrics_endpoint(self):
+        response = create_app().test_client().get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        for name in ("emulator_events_generated_total", "emulator_events_delivered_total",
+                     "emulator_mqtt_publish_latency_seconds", "emulator_webhook_batch_size_events",
+                     "emulator_buffer_events", "emulator_mqtt_in_flight_messages"):
+            self.assertIn(f"# TYPE {name} ", text)
+
+
+if __name__ == '__main__':
+    unittest.main()
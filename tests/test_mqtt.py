@@ -0,0 +1,279 @@
+import json
+import socketserver
+import struct
+import threading
+import time
+import unittest
+import paho.mqtt.client as mqtt
+from app.bus import EventBus
+from app.events import TagEvent
+from app.mqtt import MqttPublisher, backoff_delay, create_publisher
+
+
+class FakeInfo:
+    def __init__(self, mid, rc=mqtt.MQTT_ERR_SUCCESS):
+        self.mid = mid
+        self.rc = rc
+
+
+class FakeClient:
+    def __init__(self):
+        self.messages = []
+        self.mid = 0
+
+    def is_connected(self):
+        return True
+
+    def max_inflight_messages_set(self, inflight):
+        self.max_inflight = inflight
+
+    def publish(self, topic, payload, qos=0):
+        self.mid += 1
+        self.messages.append((topic, payload, qos, self.mid))
+        return FakeInfo(self.mid)
+
+
+class AckingClient(FakeClient):
+    """Acknowledges from a network thread while holding its message lock, like paho."""
+
+    def __init__(self):
+        super().__init__()
+        self.mutex = threading.Lock()
+        self.unacked = []
+        self.on_publish = None
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def publish(self, topic, payload, qos=0):
+        with self.mutex:
+            info = super().publish(topic, payload, qos)
+            self.unacked.append(info.mid)
+            return info
+
+    def loop(self):
+        while True:
+            with self.mutex:
+                while self.unacked:
+                    time.sleep(0.001)
+                    self.on_publish(self.unacked.pop(0))
+            time.sleep(0.001)
+
+
+def make_events(count):
+    return [TagEvent(i.to_bytes(12, "big")) for i in range(count)]
+
+
+class TestMqttPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.publisher = MqttPublisher(self.client)
+
+    def test_buffer_drops_oldest_on_overflow(self):
+        self.publisher.configure({"eventBufferSize": 3})
+        self.publisher.offer(make_events(5))
+        events = self.publisher.take(10)
+        self.assertEqual([int.from_bytes(event.epc, "big") for event in events], [2, 3, 4])
+        self.assertEqual(self.publisher.stats()["dropped"], 2)
+
+    def test_batches_events_per_message(self):
+        self.publisher.configure({"eventBatchSize": 4, "eventTopic": "tags"})
+        self.publisher.publish(make_events(4))
+        topic, payload, qos, _ = self.client.messages[0]
+        self.assertEqual(topic, "tags")
+        self.assertEqual(len(json.loads(payload)), 4)
+        self.assertEqual(self.publisher.stats()["published"], 4)
+
+    def test_messages_carry_only_the_report_fields(self):
+        self.publisher.configure({"eventBatchSize": 2, "reportFields": ["epcHex"]})
+        self.publisher.publish(make_events(1))
+        self.publisher.publish(make_events(2))
+        single, batch = (json.loads(message[1]) for message in self.client.messages)
+        self.assertEqual(single["tagInventoryEvent"], {"epcHex": f"{0:024X}"})
+        self.assertEqual(set(single), {"timestamp", "hostname", "eventType", "tagInventoryEvent"})
+        self.assertEqual([event["tagInventoryEvent"] for event in batch],
+                         [{"epcHex": f"{0:024X}"}, {"epcHex": f"{1:024X}"}])
+
+    def test_inflight_window_blocks_until_delivered(self):
+        self.publisher.configure({"eventQualityOfService": 1, "eventPendingDeliveryLimit": 2})
+        self.assertEqual(self.client.max_inflight, 2)
+        self.publisher.publish(make_events(1))
+        self.publisher.publish(make_events(1))
+        blocked = threading.Thread(target=self.publisher.publish, args=(make_events(1),))
+        blocked.start()
+        time.sleep(0.1)
+        self.assertEqual(len(self.client.messages), 2)
+        self.publisher.delivered(1)
+        blocked.join(2)
+        self.assertEqual(len(self.client.messages), 3)
+        self.assertEqual(self.publisher.stats()["inFlight"], 2)
+
+    def test_acknowledgements_under_client_lock_do_not_deadlock(self):
+        client = AckingClient()
+        publisher = MqttPublisher(client)
+        client.on_publish = publisher.delivered
+        publisher.configure({"eventQualityOfService": 1, "eventPendingDeliveryLimit": 2})
+        sender = threading.Thread(target=lambda: [publisher.publish(make_events(1)) for _ in range(200)], daemon=True)
+        sender.start()
+        sender.join(5)
+        self.assertFalse(sender.is_alive())
+        self.assertEqual(publisher.stats()["published"], 200)
+
+    def test_rate_limit(self):
+        self.publisher.configure({"eventPerSecondLimit": 100})
+        start = time.monotonic()
+        for _ in range(30):
+            self.publisher.publish(make_events(1))
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+
+class BrokerHandler(socketserver.BaseRequestHandler):
+    """MQTT 3.1.1 broker stand-in that records connections and publishes."""
+
+    def read_packet(self, stream):
+        header = stream.read(1)
+        if not header:
+            return None, None
+        length, multiplier = 0, 1
+        while True:
+            byte = stream.read(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header[0], stream.read(length)
+
+    def handle(self):
+        broker = self.server
+        stream = self.request.makefile('rb')
+        while True:
+            header, body = self.read_packet(stream)
+            kind = None if header is None else header >> 4
+            if kind is None or kind == 14:
+                broker.record(("disconnect", kind == 14))
+                return
+            if kind == 1:
+                # Protocol name (6 bytes), level, flags, keepalive, then the client id
+                flags = body[7]
+                client_id_length = struct.unpack("!H", body[10:12])[0]
+                broker.record(("connect", body[12:12 + client_id_length].decode(), bool(flags & 0x02),
+                               bool(flags & 0x04)))
+                self.request.sendall(b"\x20\x02\x00\x00")
+            elif kind == 3:
+                qos = (header >> 1) & 3
+                topic_length = struct.unpack("!H", body[:2])[0]
+                topic = body[2:2 + topic_length].decode()
+                payload = body[2 + topic_length + (2 if qos else 0):]
+                broker.record(("publish", topic, payload, qos, bool(header & 0x08)))
+                if broker.drop_unacked and qos:
+                    broker.drop_unacked = False
+                    self.request.close()
+                    return
+                if qos and not broker.withhold_acks:
+                    self.request.sendall(b"\x40\x02" + body[2 + topic_length:4 + topic_length])
+            elif kind == 12:
+                self.request.sendall(b"\xd0\x00")
+
+
+class StandInBroker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), BrokerHandler)
+        self.packets = []
+        self.drop_unacked = False
+        self.withhold_acks = False
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def record(self, packet):
+        self.packets.append(packet)
+
+    def of_kind(self, kind):
+        return [packet for packet in self.packets if packet[0] == kind]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestMqttConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = StandInBroker()
+        self.publisher = create_publisher("reader-0001", EventBus(), spread=0)
+        self.publisher.connection.reconnect_delays = (0.05, 0.2)
+        self.settings = {"active": True, "brokerHostname": "127.0.0.1", "brokerPort": self.broker.server_address[1],
+                         "eventTopic": "tags", "eventQualityOfService": 1, "clientId": "reader-1",
+                         "cleanSession": False, "connectMessage": "online", "disconnectMessage": "offline",
+                         "willTopic": "status", "willMessage": "gone"}
+
+    def tearDown(self):
+        self.publisher.configure({"active": False})
+        wait_until(lambda: self.publisher.client.socket() is None)
+        self.broker.shutdown()
+        self.broker.server_close()
+
+    def test_backoff_is_jittered_and_capped(self):
+        delays = [backoff_delay(attempt, 1.0, 8.0) for attempt in range(6) for _ in range(20)]
+        self.assertTrue(all(0.5 <= delay <= 8.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 100)
+        self.assertTrue(all(4.0 <= backoff_delay(50, 1.0, 8.0) <= 8.0 for _ in range(20)))
+
+    def test_connect_message_will_and_session(self):
+        self.publisher.configure(self.settings)
+        self.assertTrue(wait_until(lambda: self.broker.of_kind("publish")))
+        self.assertEqual(self.broker.of_kind("connect"), [("connect", "reader-1", False, True)])
+        self.assertEqual(self.broker.of_kind("publish")[0][1:3], ("status", b"online"))
+
+    def test_event_settings_apply_without_reconnecting(self):
+        client = self.publisher.client
+        self.publisher.configure(self.settings)
+        self.assertTrue(wait_until(client.is_connected))
+        self.publisher.configure(dict(self.settings, eventTopic="other", eventBatchSize=10))
+        self.publisher.offer(make_events(1))
+        self.assertTrue(wait_until(lambda: any(p[1] == "other" for p in self.broker.of_kind("publish"))))
+        self.assertEqual(len(self.broker.of_kind("connect")), 1)
+
+        self.publisher.configure(dict(self.settings, clientId="reader-2"))
+        self.assertTrue(wait_until(lambda: len(self.broker.of_kind("connect")) == 2))
+        # The old session ended cleanly with its disconnect message, on the same client object
+        self.assertIn(("publish", "status", b"offline", 0, False), self.broker.packets)
+        self.assertIn(("disconnect", True), self.broker.packets)
+        self.assertEqual(self.broker.of_kind("connect")[1][1], "reader-2")
+        self.assertIs(self.publisher.client, client)
+
+    def test_unacknowledged_messages_move_to_the_new_session(self):
+        self.publisher.configure(dict(self.settings, connectMessage=None))
+        self.assertTrue(wait_until(self.publisher.client.is_connected))
+        self.broker.withhold_acks = True
+        self.publisher.offer(make_events(1))
+        self.assertTrue(wait_until(lambda: len(self.broker.of_kind("publish")) == 1))
+        self.assertEqual(self.publisher.stats()["inFlight"], 1)
+        self.broker.withhold_acks = False
+        self.publisher.configure(dict(self.settings, connectMessage=None, clientId="reader-2"))
+        self.assertTrue(wait_until(lambda: len(self.broker.of_kind("connect")) == 2))
+        self.assertTrue(wait_until(lambda: len([p for p in self.broker.of_kind("publish") if p[1] == "tags"]) == 2))
+        first, resent = [p for p in self.broker.of_kind("publish") if p[1] == "tags"]
+        self.assertEqual(first[2:4], resent[2:4])
+        self.assertTrue(wait_until(lambda: self.publisher.stats()["inFlight"] == 0))
+        self.assertTrue(self.publisher.connection.thread.is_alive())
+
+    def test_unacknowledged_messages_are_resent_after_reconnecting(self):
+        self.publisher.configure(dict(self.settings, connectMessage=None))
+        self.assertTrue(wait_until(self.publisher.client.is_connected))
+        self.broker.drop_unacked = True
+        self.publisher.offer(make_events(1))
+        self.assertTrue(wait_until(lambda: len(self.broker.of_kind("connect")) == 2))
+        self.assertTrue(wait_until(lambda: len(self.broker.of_kind("publish")) == 2))
+        first, resent = self.broker.of_kind("publish")
+        self.assertEqual(first[1:4], resent[1:4])
+        self.assertTrue(resent[4])
+        self.assertTrue(wait_until(lambda: self.publisher.stats()["inFlight"] == 0))
+        self.assertEqual(self.publisher.stats()["connects"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
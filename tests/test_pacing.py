@@ -0,0 +1,83 @@
+import unittest
+from app.pacing import Pacer, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestPacing(unittest.TestCase):
+
+    def run_for(self, pacer, clock, seconds):
+        total = 0
+        while clock.now < seconds:
+            total += pacer.next_batch()
+        return total
+
+    def test_token_bucket_grants_whole_tokens(self):
+        clock = FakeClock()
+        bucket = TokenBucket(10, capacity=5, clock=clock)
+        clock.now = 0.35
+        self.assertEqual(bucket.take(100), 3)
+        clock.now = 10
+        self.assertEqual(bucket.take(100), 5)
+
+    def test_fixed_rate_holds_target(self):
+        clock = FakeClock()
+        pacer = Pacer(rate=5000, clock=clock, sleep=clock.sleep)
+        total = self.run_for(pacer, clock, 2.0)
+        self.assertAlmostEqual(total, 10000, delta=10000 * 0.01)
+
+    def test_slow_rate_matches_legacy_interval(self):
+        clock = FakeClock()
+        pacer = Pacer(rate=0.5, clock=clock, sleep=clock.sleep)
+        total = self.run_for(pacer, clock, 10.0)
+        self.assertIn(total, (4, 5))
+
+    def test_burst_mode_emits_full_bursts(self):
+        clock = FakeClock()
+        pacer = Pacer(rate=100, mode="burst", burst=50, clock=clock, sleep=clock.sleep)
+        batches = []
+        while clock.now < 2.0:
+            count = pacer.next_batch()
+            if count:
+                batches.append(count)
+        self.assertTrue(all(count == 50 for count in batches))
+        self.assertAlmostEqual(sum(batches), 200, delta=50)
+
+    def test_poisson_mode_average_rate(self):
+        clock = FakeClock()
+        pacer = Pacer(rate=1000, mode="poisson", clock=clock, sleep=clock.sleep)
+        pacer.rng.seed(1)
+        total = self.run_for(pacer, clock, 5.0)
+        self.assertAlmostEqual(total, 5000, delta=5000 * 0.05)
+
+    def test_max_mode_returns_full_batches(self):
+        pacer = Pacer(mode="max", max_batch=256)
+        self.assertEqual(pacer.next_batch(), 256)
+        self.assertIsNone(pacer.stats()["targetEventsPerSecond"])
+
+    def test_stats_report_achieved_rate(self):
+        clock = FakeClock()
+        pacer = Pacer(rate=200, clock=clock, sleep=clock.sleep)
+        self.run_for(pacer, clock, 3.0)
+        stats = pacer.stats()
+        self.assertAlmostEqual(stats["averageEventsPerSecond"], 200, delta=5)
+        self.assertAlmostEqual(stats["currentEventsPerSecond"], 200, delta=20)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            Pacer(rate=0)
+        with self.assertRaises(ValueError):
+            Pacer(rate=10, mode="bogus")
+
+
+if __name__ == '__main__':
+    unittest.main()
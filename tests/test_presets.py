@@ -0,0 +1,155 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from flask_testing import TestCase
+from app import create_app
+from app.engine import encode_shard
+from app.epc import EPC
+from app.generator import EventGenerator, parse_settings
+from app.presets import PresetStore
+from app.reader import default_reader
+from app.reflist import ReferenceCursor
+from app.simulation import SimulatedGenerator
+
+PRESET = {
+    "description": "Dock door",
+    "eventsPerSecond": 100,
+    "antennas": [2, 4, 6],
+    "reportFields": ["antennaPort", "epcHex"],
+    "durationSeconds": 30
+}
+
+
+def no_sleep(seconds):
+    pass
+
+
+class TestPresetStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, "presets.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_presets_are_validated_once_and_persisted(self):
+        store = PresetStore(self.file_name)
+        self.assertTrue(store.put("dock", PRESET))
+        self.assertFalse(store.put("dock", PRESET))
+        with mock.patch('app.presets.parse_settings') as parse:
+            settings = store.start_settings("dock")
+            self.assertIs(store.start_settings("dock"), settings)
+        parse.assert_not_called()
+        self.assertEqual(settings["antennas"], (2, 4, 6))
+        self.assertEqual(settings["reportFields"], ("timestamp", "hostname", "eventType", "epcHex", "antennaPort"))
+        reloaded = PresetStore(self.file_name)
+        self.assertEqual(reloaded.ids(), ["default", "dock"])
+        self.assertEqual(reloaded.get("dock"), PRESET)
+        self.assertEqual(reloaded.start_settings("dock"), settings)
+        self.assertTrue(reloaded.delete("dock"))
+        self.assertIsNone(reloaded.start_settings("dock"))
+        self.assertFalse(reloaded.delete("dock"))
+
+    def test_invalid_presets_are_rejected(self):
+        store = PresetStore(self.file_name)
+        for preset_id, data in (("default", PRESET), ("a/b", PRESET), ("dock", []),
+                                ("dock", {"antennas": [0]}), ("dock", {"antennas": [1, 1]}),
+                                ("dock", {"reportFields": ["rssi"]}), ("dock", {"durationSeconds": 0}),
+                                ("dock", {"antennas": [1], "replay": {"file": "trace.jsonl"}})):
+            with self.assertRaises(ValueError):
+                store.put(preset_id, data)
+        self.assertEqual(store.ids(), ["default"])
+        self.assertFalse(os.path.exists(self.file_name))
+
+    def test_default_bodies_are_validated_once(self):
+        store = PresetStore(self.file_name)
+        settings = store.start_settings("default", {"eventsPerSecond": 5, "mode": "burst"})
+        self.assertIs(store.start_settings("default", {"mode": "burst", "eventsPerSecond": 5}), settings)
+        self.assertEqual(store.start_settings("default"), parse_settings(None))
+
+
+class TestPresetSettings(unittest.TestCase):
+
+    def test_events_rotate_through_the_antennas(self):
+        generator = EventGenerator(parse_settings(PRESET), ReferenceCursor(), sleep=no_sleep)
+        ports = [event.antenna for event in generator.events(4) + generator.events(3)]
+        self.assertEqual(ports, [2, 4, 6, 2, 4, 6, 2])
+        event = json.loads(generator.events(1)[0].encode())
+        self.assertEqual(event["tagInventoryEvent"], {"epcHex": event["tagInventoryEvent"]["epcHex"],
+                                                      "antennaPort": 4})
+
+    def test_worker_shards_match_in_process_events(self):
+        packed = EPC.generate_batch(5)
+        encoded = encode_shard(packed, 0, "reader", antennas=(2, 4, 6), antenna_start=1,
+                               fields=("epcHex", "antennaPort")).split(b"\n")
+        ports = [json.loads(event)["tagInventoryEvent"] for event in encoded]
+        self.assertEqual([tag["antennaPort"] for tag in ports], [4, 6, 2, 4, 6])
+        self.assertEqual({tuple(tag) for tag in ports}, {("epcHex", "antennaPort")})
+
+    def test_simulated_reads_use_the_configured_ports(self):
+        settings = parse_settings({"antennas": [3, 7], "reportFields": ["antennaPort", "peakRssiCdbm"],
+                                   "simulation": {"tags": 200, "antennas": 4, "readsPerSecond": 20}})
+        self.assertEqual(settings["simulation"]["antennas"], 2)
+        now = [0.0]
+        generator = SimulatedGenerator(settings, sleep=no_sleep, clock=lambda: now[0])
+        now[0] = 0.5
+        events = generator.next_batch()
+        self.assertTrue(events)
+        self.assertEqual({event.antenna for event in events}, {3, 7})
+        self.assertEqual(set(json.loads(events[0].encode())["tagInventoryEvent"]), {"antennaPort", "peakRssiCdbm"})
+
+
+class TestPresetApi(TestCase):
+
+    def create_app(self):
+        app = create_app()
+        app.config['TESTING'] = True
+        return app
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        store = PresetStore(os.path.join(self.directory.name, "presets.json"))
+        for module in ('app.routes.profiles', 'app.routes.stream'):
+            patcher = mock.patch(f'{module}.preset_store', store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        default_reader.stop()
+        self.directory.cleanup()
+
+    def test_presets_are_managed_and_started(self):
+        url = '/api/v1/profiles/inventory/presets'
+        self.assertEqual(self.client.put(f'{url}/dock', json=PRESET).status_code, 201)
+        self.assertEqual(self.client.put(f'{url}/dock', json=PRESET).status_code, 204)
+        self.assertEqual(self.client.put(f'{url}/bad', json={"antennas": []}).status_code, 400)
+        self.assertEqual(self.client.get(url).json, ["default", "dock"])
+        self.assertEqual(self.client.get(f'{url}/dock').json, PRESET)
+        self.assertEqual(self.client.get(f'{url}/default').json["eventsPerSecond"], 0.5)
+        self.assertEqual(self.client.post(f'{url}/dock/start').status_code, 204)
+        self.assertEqual(default_reader.generator_settings["antennas"], (2, 4, 6))
+        self.assertEqual(self.client.post(f'{url}/missing/start').status_code, 404)
+        self.assertEqual(self.client.post(f'{url}/default/start', json={"mode": "none"}).status_code, 400)
+        self.assertEqual(self.client.delete(f'{url}/dock').status_code, 204)
+        self.assertEqual(self.client.get(f'{url}/dock').status_code, 404)
+        self.assertEqual(self.client.post(f'{url}/dock/start').status_code, 404)
+
+    def test_runs_stop_after_their_duration(self):
+        self.client.post('/api/v1/profiles/inventory/presets/default/start', json={"durationSeconds": 0.1})
+        self.assertTrue(default_reader.streaming)
+        deadline = time.monotonic() + 5
+        while default_reader.streaming and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertFalse(default_reader.streaming)
+        # A timer of an earlier run leaves a later one running
+        default_reader.start(parse_settings({"eventsPerSecond": 1}))
+        default_reader.stop_run(default_reader.bus.run - 1)
+        self.assertTrue(default_reader.streaming)
+
+
+if __name__ == '__main__':
+    unittest.main()
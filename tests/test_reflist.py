@@ -0,0 +1,204 @@
+import gzip
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app
+from app.epc import EPC
+from app.reader import default_reader
+from app.reflist import (ReferenceStore, ReferenceCursor, BLOCK_RECORDS, binary_file_name, log_file_name, append_list,
+                         write_list, write_records, compact_list, compile_in_background, needs_compile)
+
+
+EPCS = [
+    "3500B6D9801234567890ABCDEF",
+    "3500B6D9800987654321FEDCBA",
+    "3500B6D9801122334455667788",
+]
+
+
+def pair_of(epc_hex):
+    epc = EPC(int(epc_hex[0:2], 16), int(epc_hex[2:9], 16), int(epc_hex[9:15], 16), int(epc_hex[15:24], 16))
+    return epc.b64(), epc.hex()
+
+
+class TestReferenceStore(unittest.TestCase):
+
+    def test_pairs_match_epc_encoding(self):
+        store = ReferenceStore.from_lines(EPCS)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.pairs(0, 10), [pair_of(epc) for epc in EPCS])
+        self.assertEqual(store.pair(1), pair_of(EPCS[1]))
+        self.assertEqual(store.record(2), bytes.fromhex(EPCS[2][:24]))
+
+    def test_invalid_lines_are_skipped(self):
+        store = ReferenceStore.from_lines(["", EPCS[0], "not-an-epc", "3500", "  " + EPCS[1].lower() + "  "])
+        self.assertEqual([epc_hex for _, epc_hex in store.pairs(0, 10)], [EPCS[0][:24], EPCS[1][:24]])
+
+    def test_cursor_sends_unique_once_then_cycles_default(self):
+        cursor = ReferenceCursor(ReferenceStore.from_lines(EPCS[:2]), ReferenceStore.from_lines(EPCS[2:]))
+        hexes = [epc_hex for _, epc_hex in cursor.next_pairs(6)]
+        self.assertEqual(hexes, [EPCS[2][:24]] + [epc[:24] for epc in (EPCS[:2] * 3)][:5])
+        cursor.reset()
+        self.assertEqual(cursor.next_pairs(1)[0][1], EPCS[2][:24])
+
+    def test_cursor_picks_up_reloaded_lists(self):
+        cursor = ReferenceCursor()
+        self.assertEqual(cursor.next_pairs(2), [])
+        cursor.update(ReferenceStore.from_lines(EPCS[:1]), ReferenceStore.from_lines(EPCS[1:2]))
+        self.assertEqual([epc_hex for _, epc_hex in cursor.next_pairs(3)], [EPCS[1][:24]] + [EPCS[0][:24]] * 2)
+
+    def test_deltas_are_deduped_and_seen_by_the_cursor(self):
+        store = ReferenceStore.from_lines(EPCS[:2])
+        cursor = ReferenceCursor(store)
+        self.assertEqual(cursor.next_pairs(1)[0][1], EPCS[0][:24])
+        result = store.apply(added=bytes.fromhex(EPCS[2][:24] + EPCS[1][:24] + EPCS[2][:24]),
+                             removed=bytes.fromhex(EPCS[0][:24] + "00" * 12))
+        self.assertEqual(result, {"added": 1, "removed": 1, "size": 2})
+        # The last EPC moved into the removed one's slot
+        self.assertEqual([epc_hex for _, epc_hex in cursor.next_pairs(3)], [EPCS[2][:24], EPCS[1][:24], EPCS[2][:24]])
+
+    def test_cursor_without_default_list_leaves_shortfall(self):
+        cursor = ReferenceCursor(None, ReferenceStore.from_lines(EPCS))
+        self.assertEqual(len(cursor.next_pairs(5)), 3)
+        self.assertEqual(cursor.next_pairs(5), [])
+        self.assertEqual(ReferenceCursor().next_pairs(5), [])
+
+
+class TestReferenceListFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.epcs = ["%024X" % (0x3500B6D980 << 56 | i) for i in range(BLOCK_RECORDS * 2 + 10)]
+        with open("reference-list.txt", "w") as f:
+            f.write("\n".join(self.epcs) + "\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_loading_never_converts(self):
+        self.assertIsNone(ReferenceStore.load("reference-list.txt"))
+        self.assertFalse(os.path.exists(binary_file_name("reference-list.txt")))
+        self.assertTrue(needs_compile("reference-list.txt"))
+
+    def test_text_list_is_compiled_and_memory_mapped(self):
+        done = []
+        compile_in_background("reference-list.txt", done.append).join()
+        self.assertEqual(done, ["reference-list.txt"])
+        self.assertFalse(needs_compile("reference-list.txt"))
+        store = ReferenceStore.load("reference-list.txt")
+        self.assertEqual(os.path.getsize(binary_file_name("reference-list.txt")), len(self.epcs) * 12)
+        self.assertEqual(len(store), len(self.epcs))
+        start = BLOCK_RECORDS - 3
+        self.assertEqual([epc_hex for _, epc_hex in store.pairs(start, 6)], self.epcs[start:start + 6])
+        self.assertEqual(store.pair(len(self.epcs) - 1), pair_of(self.epcs[-1]))
+        self.assertEqual([epc for chunk in store.iter_hex() for epc in chunk], self.epcs)
+
+    def test_append_and_replace(self):
+        append_list("reference-list.txt", [EPCS[0]])
+        self.assertEqual(len(ReferenceStore.load("reference-list.txt")), len(self.epcs) + 1)
+        write_list("reference-list.txt", EPCS)
+        self.assertFalse(os.path.exists("reference-list.txt"))
+        self.assertEqual(len(ReferenceStore.load("reference-list.txt")), 3)
+
+    def test_change_log_is_replayed_and_compacted(self):
+        compile_in_background("reference-list.txt").join()
+        store = ReferenceStore.load("reference-list.txt")
+        store.apply(added=bytes.fromhex(EPCS[0][:24]), removed=bytes.fromhex(self.epcs[0]))
+        size = os.path.getsize(binary_file_name("reference-list.txt"))
+        # Only the delta is written
+        self.assertEqual(os.path.getsize(log_file_name("reference-list.txt")), 2 * (5 + 12))
+        expected = [epc for chunk in store.iter_hex() for epc in chunk]
+        self.assertEqual([epc for chunk in ReferenceStore.load("reference-list.txt").iter_hex() for epc in chunk],
+                         expected)
+        compact_list("reference-list.txt")
+        self.assertFalse(os.path.exists(log_file_name("reference-list.txt")))
+        self.assertEqual(os.path.getsize(binary_file_name("reference-list.txt")), size)
+        self.assertEqual([epc for chunk in ReferenceStore.load("reference-list.txt").iter_hex() for epc in chunk],
+                         expected)
+
+    def test_reopening_a_changed_list_keeps_it_mapped(self):
+        packed = EPC.generate_batch(200000)
+        write_records("reference-list.txt", packed)
+        live = ReferenceStore.load("reference-list.txt")
+        records = [packed[i:i + 12] for i in range(0, len(packed), 12)]
+        rng = random.Random(7)
+        for _ in range(20):
+            added = b"".join(rng.sample(records, 3)) + EPC.generate_batch(5)
+            removed = b"".join(rng.sample(records, 8))
+            live.apply(added=added, removed=removed)
+        with mock.patch.object(ReferenceStore, '_writable', side_effect=AssertionError("materialized")):
+            reopened = ReferenceStore.load("reference-list.txt")
+            self.assertEqual(len(reopened), len(live))
+            self.assertEqual(reopened.records(0, len(live)), live.records(0, len(live)))
+            self.assertEqual(reopened.pairs(len(live) - 50, 100), live.pairs(len(live) - 50, 100))
+        self.assertIsNotNone(reopened.overlay)
+        # Changing the reopened list continues from the replayed state
+        reopened.apply(removed=live.record(0))
+        self.assertEqual(len(reopened), len(live) - 1)
+        compact_list("reference-list.txt")
+        self.assertEqual(ReferenceStore.load("reference-list.txt").records(0, len(reopened)),
+                         reopened.records(0, len(reopened)))
+
+    def test_delta_endpoint_updates_running_cursors(self):
+        client = create_app().test_client()
+        self.assertEqual(client.patch('/manage/ref-lists/unique', json={"add": ["not-an-epc"]}).status_code, 400)
+        self.assertEqual(client.patch('/manage/ref-lists/unique', json=EPCS).status_code, 400)
+        response = client.patch('/manage/ref-lists/unique', json={"replace": EPCS[:2], "add": EPCS[1:]})
+        self.assertEqual(response.json, {"added": 3, "removed": 0, "size": 3})
+        cursor = default_reader.cursor
+        self.assertEqual(cursor.next_pairs(1)[0][1], EPCS[0][:24])
+        response = client.patch('/manage/ref-lists/unique', json={"remove": [EPCS[1]]})
+        self.assertEqual(response.json, {"added": 0, "removed": 1, "size": 2})
+        self.assertIs(default_reader.cursor, cursor)
+        self.assertEqual(cursor.next_pairs(5)[0][1], EPCS[2][:24])
+        self.assertEqual(client.get('/manage/ref-lists/unique').json, [EPCS[0][:24], EPCS[2][:24]])
+
+    def test_paged_streaming_endpoint(self):
+        compile_in_background("reference-list.txt").join()
+        client = create_app().test_client()
+        response = client.get('/manage/ref-lists/default?offset=5&limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Total-Count'], str(len(self.epcs)))
+        self.assertEqual(response.json, self.epcs[5:8])
+        self.assertEqual(len(client.get('/manage/ref-lists/default').json), len(self.epcs))
+        self.assertEqual(client.get('/manage/ref-lists/unique').json, [])
+        self.assertEqual(client.get('/manage/ref-lists/default?offset=-1').status_code, 400)
+
+    def test_streamed_uploads_are_parsed_incrementally(self):
+        client = create_app().test_client()
+        body = "\n".join(self.epcs[:5] + ["", "not-an-epc", '"%s"' % EPCS[0]]).encode()
+        response = client.post('/manage/ref-lists/default', data=body, content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {"accepted": 6, "rejected": 1, "firstRejected": "not-an-epc"})
+        self.assertFalse(os.path.exists("reference-list.txt"))
+        csv = "epc,antenna\n" + "".join(f"{epc},1\n" for epc in EPCS[1:])
+        response = client.put('/manage/ref-lists/default', data=gzip.compress(csv.encode()),
+                              content_type='text/csv', headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(response.json, {"accepted": 2, "rejected": 0, "firstRejected": None})
+        self.assertEqual(client.get('/manage/ref-lists/default').json,
+                         self.epcs[:5] + [epc[:24] for epc in EPCS])
+        response = client.put('/manage/ref-lists/default', data=b"\x1f\x8b garbage", content_type='text/plain',
+                              headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.post('/manage/ref-lists/default', data=b"<epcs/>",
+                                     content_type='application/xml').status_code, 415)
+        self.assertEqual(len(client.get('/manage/ref-lists/default').json), 8)
+
+    def test_invalid_epcs_are_rejected(self):
+        client = create_app().test_client()
+        response = client.post('/manage/ref-lists/unique', json=[EPCS[0], "3500B6D9"])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(os.path.exists(binary_file_name("reference-list-unique.txt")))
+        self.assertEqual(client.put('/manage/ref-lists/unique', json=["not-an-epc"]).status_code, 400)
+        self.assertEqual(client.post('/manage/ref-lists/unique', json=EPCS).status_code, 204)
+        # Only the first 96 bits of longer EPCs are kept
+        self.assertEqual(client.get('/manage/ref-lists/unique').json, [epc[:24] for epc in EPCS])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import app.replay as replay
+from app.generator import parse_settings
+from app.replay import ReplayGenerator
+
+CAPTURED = [
+    {"timestamp": "2024-03-01T12:00:00.250000Z", "hostname": "dock-1", "eventType": "tagInventory",
+     "tagInventoryEvent": {"epcHex": "3500B6D9801234567890ABCD", "lastSeenTime": "2024-03-01T12:00:00Z"}},
+    {"timestamp": "2024-03-01T12:00:01.250000Z", "hostname": "dock-1", "eventType": "tagInventory",
+     "tagInventoryEvent": {"epcHex": "3500B6D9801234567890ABCE"}},
+    {"timestamp": "2024-03-01T12:00:03.250000Z", "hostname": "dock-1", "eventType": "tagInventory",
+     "tagInventoryEvent": {"epcHex": "3500B6D9801234567890ABCF"}},
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(replay, 'REPLAY_DIRECTORY', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.directory)
+        lines = "\n".join(json.dumps(event) for event in CAPTURED) + "\n\nnot json\n"
+        with gzip.open(os.path.join(self.directory, "dock.jsonl.gz"), "wt") as f:
+            f.write(lines)
+        self.clock = FakeClock()
+
+    def generator(self, **replay_settings):
+        settings = parse_settings({"replay": dict({"file": "dock.jsonl.gz"}, **replay_settings)})
+        return ReplayGenerator(settings, sleep=self.clock.sleep, clock=self.clock,
+                               wall_clock=lambda: 1700000000.0 + self.clock.now)
+
+    def replay_all(self, generator):
+        released = []
+        while not generator.finished:
+            released += [(self.clock.now, json.loads(event.encode())) for event in generator.next_batch()]
+        return released
+
+    def test_original_timing_with_rewritten_timestamps(self):
+        released = self.replay_all(self.generator())
+        self.assertEqual([round(at, 2) for at, _ in released], [0.0, 1.0, 3.0])
+        self.assertEqual([event["timestamp"] for _, event in released],
+                         ["2023-11-14T22:13:20.000000Z", "2023-11-14T22:13:21.000000Z", "2023-11-14T22:13:23.000000Z"])
+        # Everything but the top-level timestamp is passed on as captured
+        self.assertEqual(released[0][1]["tagInventoryEvent"], CAPTURED[0]["tagInventoryEvent"])
+        self.assertEqual(released[2][1]["hostname"], "dock-1")
+
+    def test_accelerated_and_unpaced_replay(self):
+        released = self.replay_all(self.generator(speed=4))
+        self.assertEqual([round(at, 2) for at, _ in released], [0.0, 0.25, 0.75])
+        self.clock.now = 0.0
+        generator = self.generator(speed=0)
+        self.assertEqual(len(generator.next_batch()), 3)
+        self.assertEqual(generator.stats()["linesSkipped"], 1)
+
+    def test_loop_replays_the_trace_again(self):
+        generator = self.generator(speed=0, loop=True)
+        for _ in range(3):
+            generator.next_batch()
+        self.assertEqual(generator.stats()["eventsReplayed"], 6)
+        self.assertEqual(generator.stats()["passes"], 2)
+
+    def test_trace_must_be_in_the_replay_directory(self):
+        for file_name in ("missing.jsonl", "../etc/passwd", None):
+            with self.assertRaises(ValueError):
+                parse_settings({"replay": {"file": file_name}})
+        with self.assertRaises(ValueError):
+            parse_settings({"replay": {"file": "dock.jsonl.gz"}, "filter": {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
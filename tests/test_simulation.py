@@ -0,0 +1,79 @@
+import json
+import time
+import unittest
+import numpy as np
+from app.generator import parse_settings
+from app.simulation import TagField, SimulatedGenerator, STEP_SECONDS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTagField(unittest.TestCase):
+
+    def test_reads_carry_signal_and_cover_all_antennas(self):
+        field = TagField(2000, antennas=4, reads_per_second=10, rng=np.random.default_rng(1))
+        packed, antennas, rssi, phases, channels = field.step(0.5)
+        self.assertEqual(len(packed), 12 * len(antennas))
+        self.assertEqual(set(antennas.tolist()), {1, 2, 3, 4})
+        self.assertTrue(np.all(rssi > -8500) and np.all(rssi < -2000))
+        self.assertTrue(np.all((phases >= 0) & (phases < 360)))
+        self.assertTrue(np.all((channels >= 0) & (channels < 50)))
+        # Tags are read repeatedly, on several antennas
+        self.assertLess(len(set(packed[i:i + 12] for i in range(0, len(packed), 12))), len(antennas))
+
+    def test_population_churns(self):
+        field = TagField(1000, dwell=1.0, rng=np.random.default_rng(2))
+        first = set(field.epcs.tolist())
+        for _ in range(10):
+            field.step(0.1)
+        self.assertGreater(field.stats()["tagsExited"], 500)
+        self.assertEqual(field.stats()["tagsEntered"], field.stats()["tagsExited"])
+        self.assertLess(len(first & set(field.epcs.tolist())), 500)
+
+    def test_read_rate_cap(self):
+        field = TagField(5000, reads_per_second=20, max_reads_per_second=1000, rng=np.random.default_rng(3))
+        self.assertEqual(len(field.step(0.1)[1]), 100)
+
+    def test_large_population_steps_in_real_time(self):
+        field = TagField(50000, antennas=4, reads_per_second=1)
+        start = time.perf_counter()
+        for _ in range(20):
+            field.step(STEP_SECONDS)
+        self.assertLess(time.perf_counter() - start, 20 * STEP_SECONDS)
+
+
+class TestSimulatedGenerator(unittest.TestCase):
+
+    def test_steps_become_read_events(self):
+        clock = FakeClock()
+        settings = parse_settings({"simulation": {"tags": 500, "readsPerSecond": 8}})
+        generator = SimulatedGenerator(settings, hostname="dock-door", sleep=clock.sleep, clock=clock,
+                                       rng=np.random.default_rng(4))
+        events = generator.next_batch()
+        self.assertAlmostEqual(clock.now, STEP_SECONDS)
+        self.assertGreater(len(events), 0)
+        event = json.loads(events[0].encode())
+        self.assertEqual(event, events[0].to_dict())
+        self.assertEqual(event["hostname"], "dock-door")
+        tag = event["tagInventoryEvent"]
+        self.assertEqual(tag["frequency"], 902750 + 500 * tag["channel"])
+        self.assertEqual(tag["antennaName"], f"Antenna {tag['antennaPort']}")
+        self.assertEqual(generator.stats()["eventsGenerated"], len(events))
+
+    def test_invalid_settings_are_rejected(self):
+        for simulation in ({"tags": 0}, {"antennas": 1.5}, {"readsPerSecond": "fast"}, []):
+            with self.assertRaises(ValueError):
+                parse_settings({"simulation": simulation})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer
+from unittest import mock
+import app.spill
+from app.buffer import EventBuffer
+from app.events import TagEvent
+from app.spill import SpillQueue
+from app.webhook import WebhookPublisher
+from tests.test_webhook import SinkHandler
+
+
+def make_events(start, count):
+    return [TagEvent(i.to_bytes(12, "big")) for i in range(start, start + count)]
+
+
+def epcs(events):
+    return [event.encode() for event in events]
+
+
+class TestSpillQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_events_come_back_in_order_across_segments(self):
+        queue = SpillQueue(self.path, segment_bytes=1000)
+        events = make_events(0, 100)
+        for start in range(0, 100, 7):
+            queue.append(events[start:start + 7])
+        self.assertGreater(len(os.listdir(self.path)), 2)
+        self.assertEqual(len(queue), 100)
+        read = []
+        while len(queue):
+            read.extend(queue.read(9))
+        self.assertEqual(epcs(read), epcs(events))
+        self.assertEqual(queue.read(9), [])
+
+    def test_disk_usage_is_bounded_by_dropping_the_oldest_segments(self):
+        queue = SpillQueue(self.path, max_bytes=20000, segment_bytes=5000)
+        events = make_events(0, 1000)
+        dropped = sum(queue.append(events[start:start + 10]) for start in range(0, 1000, 10))
+        self.assertLessEqual(queue.bytes, 20000)
+        self.assertEqual(dropped, queue.dropped)
+        self.assertEqual(len(queue) + dropped, 1000)
+        # The newest events are kept
+        self.assertEqual(epcs(queue.read(1000)), epcs(events[dropped:]))
+
+    def test_reopened_queue_resumes_after_the_last_read(self):
+        queue = SpillQueue(self.path, segment_bytes=1000)
+        events = make_events(0, 50)
+        queue.append(events)
+        self.assertEqual(len(queue.read(20)), 20)
+        queue.close()
+        # A record torn by a crash is cut off
+        segments = sorted(name for name in os.listdir(self.path) if name.endswith(".seg"))
+        with open(os.path.join(self.path, segments[-1]), 'ab') as f:
+            f.write(b"\xff\x00\x00\x00{")
+        queue = SpillQueue(self.path, segment_bytes=1000)
+        self.assertEqual(len(queue), 30)
+        extra = make_events(50, 5)
+        queue.append(extra)
+        self.assertEqual(epcs(queue.read(100)), epcs(events[20:] + extra))
+
+    def test_buffer_spills_beyond_its_size_and_keeps_fifo_order(self):
+        buffer = EventBuffer(10, sink="webhook")
+        buffer.spill_to(SpillQueue(self.path))
+        events = make_events(0, 35)
+        buffer.offer(events[:25])
+        self.assertEqual(len(buffer.events), 10)
+        self.assertEqual(len(buffer.spill), 15)
+        taken = buffer.take_batch(12, 0)
+        buffer.offer(events[25:])
+        while len(buffer):
+            taken.extend(buffer.take(8, 0))
+        self.assertEqual(epcs(taken), epcs(events))
+        self.assertEqual(buffer.dropped, 0)
+
+
+class TestWebhookSpill(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(app.spill, "SPILL_DIRECTORY", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+        self.server.requests = []
+        self.server.statuses = [503] * 12
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.publisher = WebhookPublisher(name="test")
+
+    def tearDown(self):
+        self.publisher.configure({})
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_events_of_an_outage_are_delivered_from_disk(self):
+        url = f"http://127.0.0.1:{self.server.server_address[1]}/events"
+        self.publisher.configure({
+            "active": True,
+            "eventBatchLimit": 50,
+            "eventBatchLingerMilliseconds": 10,
+            "eventBufferSize": 20,
+            "eventSpill": {"active": True},
+            "retry": {"maxRetries": 1, "initialDelayMilliseconds": 1, "maxDelayMilliseconds": 20},
+            "serverConfiguration": {"url": url}
+        })
+        events = make_events(0, 500)
+        for start in range(0, 500, 25):
+            self.publisher.offer(events[start:start + 25])
+        self.assertTrue(os.path.isdir(os.path.join(self.directory.name, "test-webhook")))
+        deadline = time.monotonic() + 10
+        while self.publisher.delivered < 500 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.publisher.delivered, 500)
+        self.assertEqual(self.publisher.failed, 0)
+        self.assertEqual(self.publisher.buffer.dropped, 0)
+        # Failed attempts are resent, so each event is counted at its first request
+        sent = [event["tagInventoryEvent"]["epcHex"] for _, body in self.server.requests for event in body]
+        expected = [event.to_dict()["tagInventoryEvent"]["epcHex"] for event in events]
+        self.assertEqual(list(dict.fromkeys(sent)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import gzip
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from app.events import TagEvent
+from app.webhook import WebhookPublisher
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        server = self.server
+        server.requests.append((dict(self.headers), json.loads(body)))
+        status = server.statuses.pop(0) if server.statuses else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_events(count):
+    return [TagEvent(i.to_bytes(12, "big")) for i in range(count)]
+
+
+class TestWebhookPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+        self.server.requests = []
+        self.server.statuses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/events"
+        self.publisher = WebhookPublisher()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def configure(self, **settings):
+        webhook_config = {
+            "eventBatchLimit": 100,
+            "eventBatchLingerMilliseconds": 50,
+            "retry": {"initialDelayMilliseconds": 1},
+            "serverConfiguration": {"url": self.url, "authentication": {"username": "user", "password": "pass"}}
+        }
+        webhook_config.update(settings)
+        self.publisher.configure(webhook_config)
+
+    def test_batches_are_cut_by_limit_and_linger(self):
+        self.configure(eventBatchLimit=3)
+        self.publisher.offer(make_events(5))
+        self.assertEqual(len(self.publisher.buffer.take_batch(3, 10)), 3)
+        start = time.monotonic()
+        self.assertEqual(len(self.publisher.buffer.take_batch(3, 0.1)), 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_post_reuses_session_with_auth(self):
+        self.configure()
+        self.assertTrue(self.publisher.post(make_events(10)))
+        self.assertTrue(self.publisher.post(make_events(5)))
+        headers, body = self.server.requests[0]
+        self.assertTrue(headers['Authorization'].startswith('Basic '))
+        self.assertEqual(body[9]['tagInventoryEvent']['epcHex'], f"{9:024X}")
+        self.assertEqual(self.publisher.stats()['delivered'], 15)
+        self.assertEqual(self.publisher.last_http_status, 204)
+
+    def test_gzip_body(self):
+        self.configure(serverConfiguration={"url": self.url, "compression": "gzip"})
+        self.assertTrue(self.publisher.post(make_events(3)))
+        headers, body = self.server.requests[0]
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(body), 3)
+
+    def test_report_fields(self):
+        self.configure(reportFields=["timestamp", "epcHex", "antennaPort"])
+        self.assertTrue(self.publisher.post(make_events(2)))
+        _, body = self.server.requests[0]
+        self.assertEqual([set(event) for event in body], [{"timestamp", "tagInventoryEvent"}] * 2)
+        self.assertEqual(body[1]["tagInventoryEvent"], {"epcHex": f"{1:024X}", "antennaPort": 1})
+
+    def test_sender_survives_errors(self):
+        self.configure(active=True, eventBatchLingerMilliseconds=10)
+        def post(events, give_up=True):
+            if not calls:
+                calls.append(events)
+                raise TypeError("bad batch")
+            calls.append(events)
+            return True
+        calls = []
+        with mock.patch.object(self.publisher, 'post', side_effect=post):
+            self.publisher.offer(make_events(2))
+            deadline = time.monotonic() + 2
+            while len(calls) < 2 and time.monotonic() < deadline:
+                self.publisher.offer(make_events(1))
+                time.sleep(0.02)
+        self.assertGreaterEqual(len(calls), 2)
+        self.assertTrue(self.publisher.threads[0].is_alive())
+        self.publisher.configure({})
+
+    def test_retries_server_errors(self):
+        self.configure()
+        self.server.statuses = [503, 500]
+        self.assertTrue(self.publisher.post(make_events(1)))
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.configure()
+        self.server.statuses = [400]
+        self.assertFalse(self.publisher.post(make_events(2)))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.publisher.stats()['failed'], 2)
+
+    def test_buffer_is_bounded(self):
+        self.configure(eventBufferSize=4)
+        self.publisher.offer(make_events(10))
+        self.assertEqual(self.publisher.stats()['buffered'], 4)
+        self.assertEqual(self.publisher.stats()['dropped'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()